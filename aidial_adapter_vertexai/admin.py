@@ -0,0 +1,158 @@
+"""
+Admin endpoints for profiling of a running adapter.
+
+The endpoints are disabled unless ADMIN_API_KEY env variable is set.
+The requests must pass the key in `X-Admin-Key` header.
+
+* `GET /admin/profile/cpu?duration=10&format=pstats|speedscope`
+  profiles the event loop for the given number of seconds.
+* `POST /admin/tracemalloc/start?frames=10` starts tracing the allocations.
+* `GET /admin/tracemalloc/snapshot?limit=20` reports the top allocation sites.
+* `GET /admin/tracemalloc/diff?limit=20&reset=false` reports the top changes
+  of the allocation sites since the start or the last reset.
+* `POST /admin/tracemalloc/stop` stops tracing the allocations.
+"""
+
+import asyncio
+import json
+import os
+import secrets
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from aidial_sdk.exceptions import HTTPException as DialException
+from aidial_sdk.exceptions import InvalidRequestError
+from fastapi import APIRouter, Depends, Header, Query, Response
+
+from aidial_adapter_vertexai.utils.concurrency import make_async
+from aidial_adapter_vertexai.utils.env import get_env_float
+from aidial_adapter_vertexai.utils.profiling import (
+    memory_tracer,
+    profile_cpu,
+    sample_cpu,
+)
+
+# An empty key is treated as unset, so that it couldn't be matched by an empty header
+ADMIN_API_KEY = (os.getenv("ADMIN_API_KEY") or "").strip() or None
+
+# Maximum duration in seconds of a CPU profile
+PROFILE_MAX_DURATION = get_env_float("PROFILE_MAX_DURATION", 60.0)
+
+# Maximum number of the frames stored per traced allocation,
+# since the memory overhead of tracemalloc grows with it
+TRACEMALLOC_MAX_FRAMES = 100
+
+
+class ProfileFormat(str, Enum):
+    PSTATS = "pstats"
+    SPEEDSCOPE = "speedscope"
+
+
+class GroupBy(str, Enum):
+    LINENO = "lineno"
+    FILENAME = "filename"
+    TRACEBACK = "traceback"
+
+
+def _authenticate(x_admin_key: Optional[str] = Header(None)) -> None:
+    if (
+        not ADMIN_API_KEY
+        or not x_admin_key
+        or not secrets.compare_digest(x_admin_key, ADMIN_API_KEY)
+    ):
+        raise DialException(
+            message="Invalid admin key",
+            status_code=401,
+            type="invalid_request_error",
+            code="invalid_api_key",
+        )
+
+
+def _check_tracing() -> None:
+    if not memory_tracer.tracing:
+        raise InvalidRequestError("The allocations aren't being traced")
+
+
+router = APIRouter(
+    prefix="/admin",
+    dependencies=[Depends(_authenticate)],
+    include_in_schema=False,
+)
+
+# Only one CPU profile at a time, since they slow down the adapter
+_profile_lock = asyncio.Lock()
+
+
+@router.get("/profile/cpu")
+async def cpu_profile(
+    duration: float = Query(10.0, gt=0),
+    format: ProfileFormat = ProfileFormat.PSTATS,
+    interval: float = Query(0.005, gt=0),
+) -> Response:
+    if duration > PROFILE_MAX_DURATION:
+        raise InvalidRequestError(
+            f"The duration must not exceed {PROFILE_MAX_DURATION} seconds"
+        )
+
+    if _profile_lock.locked():
+        raise DialException(
+            message="Another profile is in progress",
+            status_code=409,
+            type="invalid_request_error",
+        )
+
+    async with _profile_lock:
+        match format:
+            case ProfileFormat.PSTATS:
+                return Response(
+                    content=await profile_cpu(duration),
+                    media_type="application/octet-stream",
+                    headers={
+                        "Content-Disposition": 'attachment; filename="cpu.pstats"'
+                    },
+                )
+            case ProfileFormat.SPEEDSCOPE:
+                return Response(
+                    content=json.dumps(await sample_cpu(duration, interval)),
+                    media_type="application/json",
+                    headers={
+                        "Content-Disposition": 'attachment; filename="cpu.speedscope.json"'
+                    },
+                )
+
+
+@router.post("/tracemalloc/start")
+async def tracemalloc_start(
+    frames: int = Query(10, ge=1, le=TRACEMALLOC_MAX_FRAMES)
+) -> Dict[str, Any]:
+    await make_async(memory_tracer.start, frames)
+    return {"tracing": True}
+
+
+@router.post("/tracemalloc/stop")
+async def tracemalloc_stop() -> Dict[str, Any]:
+    memory_tracer.stop()
+    return {"tracing": False}
+
+
+@router.get("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(
+    limit: int = Query(20, ge=1),
+    group_by: GroupBy = GroupBy.LINENO,
+) -> Dict[str, Any]:
+    _check_tracing()
+    return await make_async(
+        lambda _: memory_tracer.get_top(group_by.value, limit), ()
+    )
+
+
+@router.get("/tracemalloc/diff")
+async def tracemalloc_diff(
+    limit: int = Query(20, ge=1),
+    group_by: GroupBy = GroupBy.LINENO,
+    reset: bool = False,
+) -> Dict[str, Any]:
+    _check_tracing()
+    return await make_async(
+        lambda _: memory_tracer.get_diff(group_by.value, limit, reset), ()
+    )
@@ -0,0 +1,362 @@
+"""
+Admission control in front of the Vertex AI deployments.
+
+Vertex AI quotas are measured in requests and tokens per minute per model.
+The admission controller of a deployment keeps token buckets for these quotas
+and lets the requests through only when the buckets allow it.
+
+The requests waiting for the quota are queued and dispatched in the order
+of weighted fair queueing across the API keys, so that a single client
+can't starve the others by a burst of requests.
+
+When the queue is full, the requests are rejected early with 429 error and
+a Retry-After hint.
+
+The limits are enforced per server process, so the quota of a deployment
+should be divided by the number of the adapter replicas.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aidial_sdk.chat_completion import (
+    MessageContentImagePart,
+    MessageContentTextPart,
+)
+from aidial_sdk.chat_completion import Request as ChatCompletionRequest
+from aidial_sdk.embeddings import Request as EmbeddingsRequest
+from pydantic import BaseModel
+
+from aidial_adapter_vertexai.dial_api.exceptions import RateLimitError
+from aidial_adapter_vertexai.telemetry.metrics import admission_counter
+from aidial_adapter_vertexai.utils.env import get_env_float, get_env_int
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+
+class DeploymentLimits(BaseModel):
+    tokens_per_minute: Optional[int] = None
+    requests_per_minute: Optional[int] = None
+
+
+# JSON object mapping a deployment name to its limits, e.g.
+# {"gemini-1.5-pro-002": {"tokens_per_minute": 4000000, "requests_per_minute": 60}}
+DEPLOYMENT_LIMITS: Dict[str, DeploymentLimits] = {
+    deployment: DeploymentLimits.parse_obj(limits)
+    for deployment, limits in json.loads(
+        os.getenv("DEPLOYMENT_LIMITS", "{}")
+    ).items()
+}
+
+# JSON object mapping SHA-256 hex digest of an API key to its scheduling weight.
+# The API keys which aren't listed have weight 1.
+API_KEY_WEIGHTS: Dict[str, float] = json.loads(
+    os.getenv("ADMISSION_API_KEY_WEIGHTS", "{}")
+)
+
+ADMISSION_QUEUE_SIZE = get_env_int("ADMISSION_QUEUE_SIZE", 100)
+ADMISSION_MAX_QUEUE_TIME = get_env_float("ADMISSION_MAX_QUEUE_TIME", 30.0)
+
+CHARS_PER_TOKEN = 4
+ATTACHMENT_TOKENS = 258
+
+
+class TokenBucket:
+    capacity: float
+    rate: float
+    """Number of tokens added per second"""
+
+    tokens: float
+    updated_at: float
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def get_wait_time(self, amount: float) -> float:
+        """
+        Seconds until the given amount of tokens is available.
+        The amount exceeding the capacity is capped by the capacity,
+        otherwise such a request would never be admitted.
+        """
+        return self.get_drain_time(min(amount, self.capacity))
+
+    def get_drain_time(self, amount: float) -> float:
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """
+        Returns the overestimated tokens back to the bucket or
+        takes away the underestimated ones.
+        The bucket goes into debt when more tokens were actually used than available.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish_tag: float
+    seq: int
+    cost: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class Ticket:
+    """
+    The permission to send a request to Vertex AI.
+    Once the request is completed, the actual token usage should be reported,
+    so that the estimation error is corrected in the token bucket.
+    """
+
+    def __init__(self, bucket: TokenBucket | None, estimated_tokens: int):
+        self.bucket = bucket
+        self.estimated_tokens = estimated_tokens
+
+    def settle(self, actual_tokens: int) -> None:
+        if self.bucket is not None:
+            self.bucket.adjust(self.estimated_tokens - actual_tokens)
+            self.bucket = None
+
+
+class AdmissionController:
+    deployment: str
+    tokens: TokenBucket | None
+    requests: TokenBucket | None
+    max_queue_size: int
+    max_queue_time: float
+
+    _queue: List[_Waiter]
+    _virtual_time: float
+    _last_finish_tags: Dict[str, float]
+    _seq: itertools.count
+    _timer: asyncio.TimerHandle | None
+
+    def __init__(
+        self,
+        deployment: str,
+        limits: DeploymentLimits,
+        max_queue_size: int = ADMISSION_QUEUE_SIZE,
+        max_queue_time: float = ADMISSION_MAX_QUEUE_TIME,
+    ):
+        self.deployment = deployment
+        self.tokens = (
+            TokenBucket(limits.tokens_per_minute)
+            if limits.tokens_per_minute
+            else None
+        )
+        self.requests = (
+            TokenBucket(limits.requests_per_minute)
+            if limits.requests_per_minute
+            else None
+        )
+        self.max_queue_size = max_queue_size
+        self.max_queue_time = max_queue_time
+
+        self._queue = []
+        self._virtual_time = 0.0
+        self._last_finish_tags = {}
+        self._seq = itertools.count()
+        self._timer = None
+
+    def _get_wait_time(self, cost: int) -> float:
+        wait = 0.0
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.get_wait_time(cost))
+        if self.requests is not None:
+            wait = max(wait, self.requests.get_wait_time(1))
+        return wait
+
+    def _consume(self, cost: int) -> None:
+        if self.tokens is not None:
+            self.tokens.consume(cost)
+        if self.requests is not None:
+            self.requests.consume(1)
+
+    def _get_pending(self) -> List[_Waiter]:
+        return [waiter for waiter in self._queue if not waiter.future.done()]
+
+    def _withdraw(self, waiter: _Waiter) -> None:
+        # The cancelled and timed-out waiters must not occupy the queue
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            return
+        heapq.heapify(self._queue)
+
+    def _estimate_drain_time(self, cost: int) -> float:
+        pending = self._get_pending()
+        queued_cost = cost + sum(waiter.cost for waiter in pending)
+        wait = 0.0
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.get_drain_time(queued_cost))
+        if self.requests is not None:
+            wait = max(wait, self.requests.get_drain_time(len(pending) + 1))
+        return wait
+
+    def _dispatch(self) -> None:
+        self._timer = None
+
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                heapq.heappop(self._queue)
+                continue
+
+            wait = self._get_wait_time(head.cost)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(
+                    wait, self._dispatch
+                )
+                return
+
+            heapq.heappop(self._queue)
+            self._consume(head.cost)
+            self._virtual_time = head.finish_tag
+            head.future.set_result(None)
+
+    async def admit(self, api_key: str, cost: int) -> Ticket:
+        ticket = Ticket(self.tokens, cost)
+        attributes = {"deployment": self.deployment}
+
+        if not self._queue and self._get_wait_time(cost) == 0:
+            self._consume(cost)
+            admission_counter.add(1, {**attributes, "outcome": "admitted"})
+            return ticket
+
+        if not self._queue:
+            self._forget_idle_flows()
+
+        if len(self._get_pending()) >= self.max_queue_size:
+            retry_after = self._estimate_drain_time(cost)
+            log.warning(
+                f"admission queue of {self.deployment!r} is full, "
+                f"retry after: {retry_after:.1f}s"
+            )
+            admission_counter.add(1, {**attributes, "outcome": "rejected"})
+            raise RateLimitError(
+                "The deployment is overloaded. Please retry later.",
+                retry_after=retry_after,
+            )
+
+        # Start-time fair queueing: the requests of a client are spread
+        # over the virtual time proportionally to their cost and
+        # inversely proportionally to the client weight.
+        flow = hashlib.sha256(api_key.encode()).hexdigest()
+        weight = API_KEY_WEIGHTS.get(flow, 1.0)
+        start_tag = max(
+            self._virtual_time, self._last_finish_tags.get(flow, 0.0)
+        )
+        finish_tag = start_tag + max(cost, 1) / weight
+        self._last_finish_tags[flow] = finish_tag
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(finish_tag, next(self._seq), cost, future)
+        heapq.heappush(self._queue, waiter)
+
+        if self._timer is None:
+            self._dispatch()
+
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(future), timeout=self.max_queue_time
+            )
+        except asyncio.TimeoutError:
+            # The request could have been admitted right after the timeout
+            if future.cancel():
+                self._withdraw(waiter)
+                admission_counter.add(1, {**attributes, "outcome": "timed_out"})
+                raise RateLimitError(
+                    "The request has timed out waiting in the queue. Please retry later.",
+                    retry_after=self._estimate_drain_time(cost),
+                )
+        except asyncio.CancelledError:
+            if future.cancel():
+                self._withdraw(waiter)
+            raise
+
+        admission_counter.add(1, {**attributes, "outcome": "queued"})
+        return ticket
+
+    def _forget_idle_flows(self) -> None:
+        # The flows whose finish tags are in the past are equivalent to new flows
+        self._last_finish_tags = {
+            flow: tag
+            for flow, tag in self._last_finish_tags.items()
+            if tag > self._virtual_time
+        }
+
+
+_controllers: Dict[str, AdmissionController] = {}
+
+
+async def admit(deployment: str, api_key: str, cost: int) -> Ticket:
+    limits = DEPLOYMENT_LIMITS.get(deployment)
+    if limits is None:
+        return Ticket(None, cost)
+
+    controller = _controllers.get(deployment)
+    if controller is None:
+        controller = _controllers[deployment] = AdmissionController(
+            deployment, limits
+        )
+
+    return await controller.admit(api_key, cost)
+
+
+def _estimate_text_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_chat_request_tokens(request: ChatCompletionRequest) -> int:
+    tokens = 0
+    for message in request.messages:
+        content = message.content
+        if isinstance(content, str):
+            tokens += _estimate_text_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                match part:
+                    case MessageContentTextPart(text=text):
+                        tokens += _estimate_text_tokens(text)
+                    case MessageContentImagePart():
+                        tokens += ATTACHMENT_TOKENS
+
+        if message.custom_content and message.custom_content.attachments:
+            tokens += ATTACHMENT_TOKENS * len(
+                message.custom_content.attachments
+            )
+
+    for tools in [request.tools, request.functions]:
+        if tools:
+            tokens += _estimate_text_tokens(
+                json.dumps([tool.dict() for tool in tools])
+            )
+
+    tokens += request.max_tokens or 0
+    return tokens * (request.n or 1)
+
+
+def estimate_embeddings_request_tokens(request: EmbeddingsRequest) -> int:
+    inputs = [request.input, request.custom_input or []]
+    return _estimate_text_tokens(json.dumps(inputs, default=str))
@@ -3,18 +3,38 @@ from contextlib import asynccontextmanager
 import vertexai
 from aidial_sdk import DIALApp
 from aidial_sdk.telemetry.types import TelemetryConfig
+from fastapi import HTTPException as FastAPIException
 
+from aidial_adapter_vertexai.admin import ADMIN_API_KEY
+from aidial_adapter_vertexai.admin import router as admin_router
 from aidial_adapter_vertexai.chat_completion import VertexAIChatCompletion
 from aidial_adapter_vertexai.deployments import (
     ChatCompletionDeployment,
     EmbeddingsDeployment,
 )
-from aidial_adapter_vertexai.dial_api.exceptions import dial_exception_decorator
+from aidial_adapter_vertexai.dial_api.exceptions import (
+    dial_exception_decorator,
+    fastapi_exception_handler,
+)
 from aidial_adapter_vertexai.dial_api.response import (
     ModelObject,
     ModelsResponse,
 )
 from aidial_adapter_vertexai.embeddings import VertexAIEmbeddings
+from aidial_adapter_vertexai.telemetry.loop_monitor import LoopMonitor
+from aidial_adapter_vertexai.telemetry.prometheus import (
+    METRICS_ENDPOINT,
+    configure_metrics,
+    metrics,
+)
+from aidial_adapter_vertexai.telemetry.server_timing import (
+    ServerTimingMiddleware,
+)
+from aidial_adapter_vertexai.telemetry.traffic_capture import (
+    TRAFFIC_CAPTURE_FILE,
+    TRAFFIC_CAPTURE_RATE,
+    TrafficCaptureMiddleware,
+)
 from aidial_adapter_vertexai.utils.env import get_env
 from aidial_adapter_vertexai.utils.log_config import configure_loggers
 
@@ -25,16 +45,29 @@ GCP_PROJECT_ID = get_env("GCP_PROJECT_ID")
 @asynccontextmanager
 async def lifespan(app: DIALApp):
     vertexai.init(project=GCP_PROJECT_ID, location=DEFAULT_REGION)
-    yield
 
+    loop_monitor = LoopMonitor()
+    loop_monitor.start()
+    try:
+        yield
+    finally:
+        await loop_monitor.stop()
+
+
+telemetry_config = TelemetryConfig()
+if METRICS_ENDPOINT:
+    configure_metrics(telemetry_config)
 
 app = DIALApp(
     description="Google VertexAI adapter for DIAL API",
-    telemetry_config=TelemetryConfig(),
+    telemetry_config=telemetry_config,
     add_healthcheck=True,
     lifespan=lifespan,
 )
 
+# NOTE: preserving the Retry-After header of the rate limit errors
+app.add_exception_handler(FastAPIException, fastapi_exception_handler)
+
 # NOTE: configuring logger after the DIAL telemetry is initialized,
 # because it may have configured the root logger on its own.
 configure_loggers()
@@ -51,6 +84,21 @@ async def models():
     return ModelsResponse(data=models)
 
 
+app.add_middleware(ServerTimingMiddleware)
+
+if TRAFFIC_CAPTURE_FILE is not None:
+    app.add_middleware(
+        TrafficCaptureMiddleware,
+        path=TRAFFIC_CAPTURE_FILE,
+        rate=TRAFFIC_CAPTURE_RATE,
+    )
+
+if ADMIN_API_KEY is not None:
+    app.include_router(admin_router)
+
+if METRICS_ENDPOINT:
+    app.add_api_route("/metrics", metrics, include_in_schema=False)
+
 for deployment in ChatCompletionDeployment:
     app.add_chat_completion(deployment.get_model_id(), VertexAIChatCompletion())
 
@@ -49,7 +49,7 @@ class BisonChatAdapter(BisonChatCompletionAdapter):
 
     @classmethod
     async def create(cls, model_id: str) -> "BisonChatAdapter":
-        return cls(await get_chat_model(model_id))
+        return cls(model_id, await get_chat_model(model_id))
 
     def prepare_parameters_no_stream(
         self, params: ModelParameters
@@ -103,7 +103,7 @@ class BisonCodeChatAdapter(BisonChatCompletionAdapter):
 
     @classmethod
     async def create(cls, model_id: str) -> "BisonCodeChatAdapter":
-        return cls(await get_code_chat_model(model_id))
+        return cls(model_id, await get_code_chat_model(model_id))
 
     def validate_parameters(self, params: ModelParameters) -> None:
         if params.stop is not None and params.stop != []:
@@ -1,5 +1,6 @@
+import asyncio
 from abc import abstractmethod
-from typing import AsyncIterator, List
+from typing import AsyncIterator, List, Optional
 
 from aidial_sdk.chat_completion import FinishReason, Message
 from typing_extensions import override
@@ -18,14 +19,26 @@ from aidial_adapter_vertexai.chat.tools import ToolsConfig
 from aidial_adapter_vertexai.chat.truncate_prompt import TruncatedPrompt
 from aidial_adapter_vertexai.dial_api.request import ModelParameters
 from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+from aidial_adapter_vertexai.telemetry.metrics import (
+    count_tokens_duration_histogram,
+)
+from aidial_adapter_vertexai.telemetry.stream import measured_stream
+from aidial_adapter_vertexai.telemetry.tracing import tracer
+from aidial_adapter_vertexai.utils.concurrency import make_async
 from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
+from aidial_adapter_vertexai.utils.retry import (
+    call_with_retries,
+    stream_with_retries,
+)
+from aidial_adapter_vertexai.utils.stream_buffer import buffered_stream
 from aidial_adapter_vertexai.utils.timer import Timer
 
 BisonChatModel = ChatModel | CodeChatModel
 
 
 class BisonChatCompletionAdapter(ChatCompletionAdapter[BisonPrompt]):
-    def __init__(self, model: BisonChatModel):
+    def __init__(self, model_id: str, model: BisonChatModel):
+        self.model_id = model_id
         self.model = model
 
     @abstractmethod
@@ -46,31 +59,57 @@ class BisonChatCompletionAdapter(ChatCompletionAdapter[BisonPrompt]):
         self, prompt: BisonPrompt, max_prompt_tokens: int
     ) -> TruncatedPrompt[BisonPrompt]:
         return await prompt.truncate(
-            tokenizer=self.count_prompt_tokens, user_limit=max_prompt_tokens
+            tokenizer=self.count_prompt_tokens,
+            user_limit=max_prompt_tokens,
+            hint_scope=self.model_id,
         )
 
     @override
     async def chat(
-        self, params: ModelParameters, consumer: Consumer, prompt: BisonPrompt
+        self,
+        params: ModelParameters,
+        consumer: Consumer,
+        prompt: BisonPrompt,
+        prompt_tokens: Optional[int] = None,
     ) -> None:
-        prompt_tokens = await self.count_prompt_tokens(prompt)
+        # The prompt tokens are counted while the completion is generated
+        prompt_tokens_task = asyncio.create_task(
+            self.count_prompt_tokens(prompt)
+            if prompt_tokens is None
+            else _constant(prompt_tokens)
+        )
 
-        with Timer("predict timing: {time}", log.debug):
-            log.debug(
-                "predict request: "
-                f"parameters=({params}), "
-                f"prompt=({prompt})"
+        try:
+            with Timer("predict timing: {time}", log.debug, stage="generate"):
+                log.debug(
+                    "predict request: parameters=(%s), prompt=(%s)",
+                    params,
+                    prompt,
+                )
+
+                completion = ""
+
+                async for chunk in buffered_stream(
+                    measured_stream(
+                        stream_with_retries(
+                            lambda: self.send_message_async(params, prompt),
+                            operation="chat",
+                            deployment=self.model_id,
+                        ),
+                        deployment=self.model_id,
+                    ),
+                    deployment=self.model_id,
+                ):
+                    completion += chunk
+                    await consumer.append_content(chunk)
+
+                log.debug("predict response: %r", completion)
+
+            prompt_tokens, completion_tokens = await asyncio.gather(
+                prompt_tokens_task, self.count_completion_tokens(completion)
             )
-
-            completion = ""
-
-            async for chunk in self.send_message_async(params, prompt):
-                completion += chunk
-                await consumer.append_content(chunk)
-
-            log.debug(f"predict response: {completion!r}")
-
-        completion_tokens = await self.count_completion_tokens(completion)
+        finally:
+            prompt_tokens_task.cancel()
 
         # PaLM models do not return finish reason.
         # Use the heuristic to estimate it.
@@ -91,8 +130,31 @@ class BisonChatCompletionAdapter(ChatCompletionAdapter[BisonPrompt]):
             message_history=prompt.history,
         )
 
-        with Timer("count_tokens[prompt] timing: {time}", log.debug):
-            resp = chat_session.count_tokens(message=prompt.last_user_message)
+        # The SDK doesn't provide an async method for Bison models
+        async def _count_tokens() -> CountTokensResponse:
+            return await make_async(
+                lambda _: chat_session.count_tokens(
+                    message=prompt.last_user_message
+                ),
+                (),
+            )
+
+        attributes = {"deployment": self.model_id, "target": "prompt"}
+        with (
+            tracer.start_as_current_span("count_tokens", attributes=attributes),
+            Timer(
+                "count_tokens[prompt] timing: {time}",
+                log.debug,
+                count_tokens_duration_histogram,
+                attributes,
+                stage="count_tokens",
+            ),
+        ):
+            resp = await call_with_retries(
+                _count_tokens,
+                operation="count_tokens",
+                deployment=self.model_id,
+            )
             log.debug(
                 f"count_tokens[prompt] response: {_display_token_count(resp)}"
             )
@@ -100,8 +162,28 @@ class BisonChatCompletionAdapter(ChatCompletionAdapter[BisonPrompt]):
 
     @override
     async def count_completion_tokens(self, string: str) -> int:
-        with Timer("count_tokens[completion] timing: {time}", log.debug):
-            resp = self.model.start_chat().count_tokens(message=string)
+        async def _count_tokens() -> CountTokensResponse:
+            return await make_async(
+                lambda _: self.model.start_chat().count_tokens(message=string),
+                (),
+            )
+
+        attributes = {"deployment": self.model_id, "target": "completion"}
+        with (
+            tracer.start_as_current_span("count_tokens", attributes=attributes),
+            Timer(
+                "count_tokens[completion] timing: {time}",
+                log.debug,
+                count_tokens_duration_histogram,
+                attributes,
+                stage="count_tokens",
+            ),
+        ):
+            resp = await call_with_retries(
+                _count_tokens,
+                operation="count_tokens",
+                deployment=self.model_id,
+            )
             log.debug(
                 f"count_tokens[completion] response: {_display_token_count(resp)}"
             )
@@ -110,3 +192,7 @@ class BisonChatCompletionAdapter(ChatCompletionAdapter[BisonPrompt]):
 
 def _display_token_count(response: CountTokensResponse) -> str:
     return f"tokens: {response.total_tokens}, billable characters: {response.total_billable_characters}"
+
+
+async def _constant(value: int) -> int:
+    return value
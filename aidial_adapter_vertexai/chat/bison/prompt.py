@@ -7,6 +7,7 @@ from vertexai.preview.language_models import ChatMessage, ChatSession
 
 from aidial_adapter_vertexai.chat.errors import ValidationError
 from aidial_adapter_vertexai.chat.truncate_prompt import TruncatablePrompt
+from aidial_adapter_vertexai.chat.truncation_hints import get_prefix_hashes
 from aidial_adapter_vertexai.dial_api.request import collect_text_content
 
 
@@ -62,6 +63,16 @@ class BisonPrompt(BaseModel, TruncatablePrompt):
             + [1]
         )
 
+    def get_prefix_hashes(self) -> Optional[List[str]]:
+        # The last user message becomes a part of the history on the next turn
+        messages: List[object] = [
+            *((message.author, message.content) for message in self.history),
+            (ChatAuthor.USER.value, self.last_user_message),
+        ]
+        if self.system_instruction is not None:
+            messages.insert(0, self.system_instruction)
+        return get_prefix_hashes("", messages)
+
     def select(self, indices: Set[int]) -> "BisonPrompt":
         system_instruction: str | None = None
         history: List[ChatMessage] = []
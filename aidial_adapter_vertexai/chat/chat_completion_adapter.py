@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Generic, List, TypeVar
+from typing import Generic, List, Optional, TypeVar
 
 from aidial_sdk.chat_completion import Message
 
@@ -22,9 +22,16 @@ class ChatCompletionAdapter(ABC, Generic[P]):
 
     @abstractmethod
     async def chat(
-        self, params: ModelParameters, consumer: Consumer, prompt: P
+        self,
+        params: ModelParameters,
+        consumer: Consumer,
+        prompt: P,
+        prompt_tokens: Optional[int] = None,
     ) -> None:
-        pass
+        """
+        The prompt tokens are passed when they are already known,
+        e.g. computed during the prompt truncation.
+        """
 
     @not_implemented
     async def truncate_prompt(
@@ -1,8 +1,12 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 
 from aidial_sdk.chat_completion import Attachment, Choice, FinishReason
 
+from aidial_adapter_vertexai.chat.stream_coalescing import (
+    ContentCoalescer,
+    StreamCoalescingConfig,
+)
 from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
 
 
@@ -46,30 +50,83 @@ class ChoiceConsumer(Consumer):
     Whether the consumer has sent something to the choice or not.
     """
 
-    def __init__(self, choice: Choice):
+    content_events: int
+    """Number of the content deltas sent to the choice"""
+
+    coalescer: Optional[ContentCoalescer]
+
+    wait_for_client: Optional[Callable[[], Awaitable[None]]]
+    """Waits until the client receives the events sent to the choice"""
+    max_pending_events: int
+    _pending_events: int
+
+    def __init__(
+        self,
+        choice: Choice,
+        coalescing: Optional[StreamCoalescingConfig] = None,
+        wait_for_client: Optional[Callable[[], Awaitable[None]]] = None,
+        max_pending_events: int = 0,
+    ):
         self.empty = True
         self.choice = choice
         self.usage = TokenUsage()
         self.finish_reason = None
+        self.content_events = 0
+        self.wait_for_client = wait_for_client
+        self.max_pending_events = max_pending_events
+        self._pending_events = 0
+        self.coalescer = (
+            ContentCoalescer(coalescing, self._send_content)
+            if coalescing is not None
+            else None
+        )
 
     def is_empty(self) -> bool:
         return self.empty
 
+    def flush(self) -> None:
+        """
+        Sends the content held back by the coalescing.
+        """
+        if self.coalescer is not None:
+            self.coalescer.flush()
+
+    def _send_content(self, content: str) -> None:
+        self.content_events += 1
+        self._pending_events += 1
+        self.choice.append_content(content)
+
+    async def _apply_backpressure(self) -> None:
+        if (
+            self.wait_for_client is not None
+            and self.max_pending_events > 0
+            and self._pending_events >= self.max_pending_events
+        ):
+            self._pending_events = 0
+            await self.wait_for_client()
+
     async def create_function_call(self, name: str, arguments: str | None):
+        self.flush()
         self.empty = False
         await self.set_finish_reason(FinishReason.FUNCTION_CALL)
         self.choice.create_function_call(name, arguments)
 
     async def create_tool_call(self, id: str, name: str, arguments: str | None):
+        self.flush()
         self.empty = False
         await self.set_finish_reason(FinishReason.TOOL_CALLS)
         self.choice.create_function_tool_call(id, name, arguments)
 
     async def append_content(self, content: str):
         self.empty = self.empty and content == ""
-        self.choice.append_content(content)
+        if self.coalescer is not None:
+            self.coalescer.append(content)
+        else:
+            self._send_content(content)
+        await self._apply_backpressure()
 
     async def add_attachment(self, attachment: Attachment):
+        self.flush()
         self.empty = False
         self.choice.add_attachment(
             type=attachment.type,
@@ -84,6 +141,8 @@ class ChoiceConsumer(Consumer):
         self.usage = usage
 
     async def set_finish_reason(self, finish_reason: FinishReason):
+        self.flush()
+
         if finish_reason == FinishReason.STOP and self.finish_reason in [
             FinishReason.FUNCTION_CALL,
             FinishReason.TOOL_CALLS,
@@ -1,5 +1,5 @@
 import json
-from logging import DEBUG
+import os
 from typing import (
     AsyncIterator,
     Callable,
@@ -8,22 +8,15 @@ from typing import (
     Optional,
     TypeVar,
     assert_never,
-    cast,
 )
 
 import vertexai.preview.generative_models as generative_models
 from aidial_sdk.chat_completion import Attachment, FinishReason, Message
-from google.cloud.aiplatform_v1beta1.types.prediction_service import (
-    GenerateContentResponse,
-)
 from typing_extensions import override
 from vertexai.preview.generative_models import (
-    Candidate,
     GenerationConfig,
     GenerationResponse,
     GenerativeModel,
-    Image,
-    Part,
 )
 
 from aidial_adapter_vertexai.chat.chat_completion_adapter import (
@@ -31,6 +24,8 @@ from aidial_adapter_vertexai.chat.chat_completion_adapter import (
 )
 from aidial_adapter_vertexai.chat.consumer import Consumer
 from aidial_adapter_vertexai.chat.errors import UserError
+from aidial_adapter_vertexai.chat.gemini.chunk import Chunk, decode_chunk
+from aidial_adapter_vertexai.chat.gemini.model_cache import model_cache
 from aidial_adapter_vertexai.chat.gemini.prompt.base import GeminiPrompt
 from aidial_adapter_vertexai.chat.gemini.prompt.gemini_1_0_pro import (
     Gemini_1_0_Pro_Prompt,
@@ -42,18 +37,42 @@ from aidial_adapter_vertexai.chat.gemini.prompt.gemini_1_5 import (
     Gemini_1_5_Prompt,
 )
 from aidial_adapter_vertexai.chat.tools import ToolsConfig
-from aidial_adapter_vertexai.chat.truncate_prompt import TruncatedPrompt
+from aidial_adapter_vertexai.chat.truncate_prompt import (
+    TruncatedPrompt,
+    TruncationStrategy,
+)
 from aidial_adapter_vertexai.deployments import (
     ChatCompletionDeployment,
     GeminiDeployment,
 )
 from aidial_adapter_vertexai.dial_api.request import ModelParameters
 from aidial_adapter_vertexai.dial_api.storage import FileStorage
-from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
-from aidial_adapter_vertexai.utils.json import json_dumps, json_dumps_short
+from aidial_adapter_vertexai.hedging import hedged_stream
+from aidial_adapter_vertexai.regions import (
+    get_region_router,
+    routed_call,
+    routed_stream,
+)
+from aidial_adapter_vertexai.telemetry.metrics import (
+    count_tokens_duration_histogram,
+)
+from aidial_adapter_vertexai.telemetry.stream import measured_stream
+from aidial_adapter_vertexai.telemetry.tracing import tracer
+from aidial_adapter_vertexai.utils.json import LazyJson
 from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
-from aidial_adapter_vertexai.utils.protobuf import recurse_proto_marshal_to_dict
+from aidial_adapter_vertexai.utils.retry import (
+    call_with_retries,
+    stream_with_retries,
+)
+from aidial_adapter_vertexai.utils.stream_buffer import buffered_stream
 from aidial_adapter_vertexai.utils.timer import Timer
+from aidial_adapter_vertexai.vertex_ai import get_model_resource_name
+
+# JSON list of the Gemini deployments which truncate prompts
+# using the sums of the token counts of the individual turns
+PREFIX_SUM_TRUNCATION_DEPLOYMENTS: List[str] = json.loads(
+    os.getenv("PREFIX_SUM_TRUNCATION_DEPLOYMENTS", "[]")
+)
 
 HarmCategory = generative_models.HarmCategory
 HarmBlockThreshold = generative_models.HarmBlockThreshold
@@ -102,6 +121,7 @@ class GeminiChatCompletionAdapter(ChatCompletionAdapter[GeminiPrompt]):
         self.file_storage = file_storage
         self.model_id = model_id
         self.deployment = deployment
+        self.router = get_region_router(deployment.value)
 
     @override
     async def parse_prompt(
@@ -128,47 +148,54 @@ class GeminiChatCompletionAdapter(ChatCompletionAdapter[GeminiPrompt]):
                 assert_never(self.deployment)
 
     def _get_model(
-        self,
-        *,
-        params: ModelParameters | None = None,
-        prompt: GeminiPrompt | None = None,
+        self, *, region: str, prompt: GeminiPrompt | None = None
     ) -> GenerativeModel:
-        parameters = create_generation_config(params) if params else None
-
-        if prompt is not None:
-            tools = prompt.tools.to_gemini_tools()
-            tool_config = prompt.tools.to_gemini_tool_config()
-            system_instruction = cast(
-                List[str | Part | Image] | None,
-                prompt.system_instruction,
-            )
-        else:
-            tools = None
-            tool_config = None
-            system_instruction = None
-
-        return GenerativeModel(
-            self.model_id,
-            generation_config=parameters,
-            tools=tools,
-            tool_config=tool_config,
-            system_instruction=system_instruction,
+        return model_cache.get(
+            get_model_resource_name(self.model_id, region),
+            tools=prompt.tools if prompt else None,
+            system_instruction=prompt.system_instruction if prompt else None,
         )
 
-    async def send_message_async(
-        self, params: ModelParameters, prompt: GeminiPrompt
+    async def _send_message_to_region(
+        self, region: str, params: ModelParameters, prompt: GeminiPrompt
     ) -> AsyncIterator[GenerationResponse]:
 
-        model = self._get_model(params=params, prompt=prompt)
+        model = self._get_model(region=region, prompt=prompt)
+        generation_config = create_generation_config(params)
         contents = prompt.contents
 
         if params.stream:
-            response = await model._generate_content_streaming_async(contents)
+            response = await model._generate_content_streaming_async(
+                contents, generation_config=generation_config
+            )
 
             async for chunk in response:
                 yield chunk
         else:
-            yield await model._generate_content_async(contents)
+            yield await model._generate_content_async(
+                contents, generation_config=generation_config
+            )
+
+    def send_message_async(
+        self, params: ModelParameters, prompt: GeminiPrompt
+    ) -> AsyncIterator[GenerationResponse]:
+        """
+        Each attempt is routed to the best region and hedged in case
+        the first chunk is late. The failed attempts are retried.
+        """
+        return stream_with_retries(
+            hedged_stream(
+                self.deployment.value,
+                routed_stream(
+                    self.router,
+                    lambda region: self._send_message_to_region(
+                        region, params, prompt
+                    ),
+                ),
+            ),
+            operation="chat",
+            deployment=self.model_id,
+        )
 
     @staticmethod
     async def process_chunks(
@@ -178,37 +205,43 @@ class GeminiChatCompletionAdapter(ChatCompletionAdapter[GeminiPrompt]):
     ) -> AsyncIterator[str]:
 
         async for chunk in generator():
-            if log.isEnabledFor(DEBUG):
-                chunk_str = json_dumps(chunk, excluded_keys=["safety_ratings"])
-                log.debug(f"response chunk: {chunk_str}")
+            log.debug(
+                "response chunk: %s",
+                LazyJson(chunk, frozen=True, excluded_keys=["safety_ratings"]),
+            )
 
-            if chunk.candidates:
-                candidate = chunk.candidates[0]
+            decoded = decode_chunk(chunk)
 
-                content = candidate.text
+            if decoded.has_candidate:
+                content = decoded.text
                 await consumer.append_content(content)
                 yield content
 
-                await create_function_calls(candidate, consumer, tools)
-                await create_attachments_from_citations(candidate, consumer)
-                await set_finish_reason(candidate, consumer)
+                await create_function_calls(decoded, consumer, tools)
+                await create_attachments_from_citations(decoded, consumer)
+                await set_finish_reason(decoded, consumer)
 
-            if chunk.usage_metadata:
-                await set_usage(chunk.usage_metadata, consumer)
+            if decoded.usage is not None:
+                log.debug(f"usage: {decoded.usage}")
+                await consumer.set_usage(decoded.usage)
 
-            if chunk.prompt_feedback:
+            if decoded.is_blocked:
                 await consumer.set_finish_reason(FinishReason.CONTENT_FILTER)
 
     @override
     async def chat(
-        self, params: ModelParameters, consumer: Consumer, prompt: GeminiPrompt
+        self,
+        params: ModelParameters,
+        consumer: Consumer,
+        prompt: GeminiPrompt,
+        prompt_tokens: Optional[int] = None,
     ) -> None:
-        with Timer("predict timing: {time}", log.debug):
-            if log.isEnabledFor(DEBUG):
-                log.debug(
-                    "predict request: "
-                    + json_dumps_short({"parameters": params, "prompt": prompt})
-                )
+        # The usage is reported by the model itself
+        with Timer("predict timing: {time}", log.debug, stage="generate"):
+            log.debug(
+                "predict request: %s",
+                LazyJson({"parameters": params, "prompt": prompt}, short=True),
+            )
 
             completion = ""
 
@@ -216,36 +249,91 @@ class GeminiChatCompletionAdapter(ChatCompletionAdapter[GeminiPrompt]):
                 lambda: self.process_chunks(
                     consumer,
                     prompt.tools,
-                    lambda: self.send_message_async(params, prompt),
+                    lambda: buffered_stream(
+                        measured_stream(
+                            self.send_message_async(params, prompt),
+                            deployment=self.deployment.value,
+                        ),
+                        deployment=self.deployment.value,
+                    ),
                 ),
                 2,
             ):
                 completion += content
 
-            log.debug(f"predict response: {completion!r}")
+            log.debug("predict response: %r", completion)
 
     @override
     async def truncate_prompt(
         self, prompt: GeminiPrompt, max_prompt_tokens: int
     ) -> TruncatedPrompt[GeminiPrompt]:
         return await prompt.truncate(
-            tokenizer=self.count_prompt_tokens, user_limit=max_prompt_tokens
+            tokenizer=self.count_prompt_tokens,
+            user_limit=max_prompt_tokens,
+            hint_scope=self.model_id,
+            strategy=(
+                TruncationStrategy.PREFIX_SUM
+                if self.deployment.value in PREFIX_SUM_TRUNCATION_DEPLOYMENTS
+                else TruncationStrategy.GREEDY
+            ),
         )
 
     @override
     async def count_prompt_tokens(self, prompt: GeminiPrompt) -> int:
-        with Timer("count_tokens[prompt] timing: {time}", log.debug):
-            resp = await self._get_model(prompt=prompt).count_tokens_async(
-                prompt.contents
+        attributes = {"deployment": self.model_id, "target": "prompt"}
+        with (
+            tracer.start_as_current_span("count_tokens", attributes=attributes),
+            Timer(
+                "count_tokens[prompt] timing: {time}",
+                log.debug,
+                count_tokens_duration_histogram,
+                attributes,
+                stage="count_tokens",
+            ),
+        ):
+            resp = await call_with_retries(
+                routed_call(
+                    self.router,
+                    lambda region: self._get_model(
+                        region=region, prompt=prompt
+                    ).count_tokens_async(prompt.contents),
+                ),
+                operation="count_tokens",
+                deployment=self.model_id,
+            )
+            log.debug(
+                "count_tokens[prompt] response: %s",
+                LazyJson(resp, frozen=True),
             )
-            log.debug(f"count_tokens[prompt] response: {json_dumps(resp)}")
             return resp.total_tokens
 
     @override
     async def count_completion_tokens(self, string: str) -> int:
-        with Timer("count_tokens[completion] timing: {time}", log.debug):
-            resp = await self._get_model().count_tokens_async(string)
-            log.debug(f"count_tokens[completion] response: {json_dumps(resp)}")
+        attributes = {"deployment": self.model_id, "target": "completion"}
+        with (
+            tracer.start_as_current_span("count_tokens", attributes=attributes),
+            Timer(
+                "count_tokens[completion] timing: {time}",
+                log.debug,
+                count_tokens_duration_histogram,
+                attributes,
+                stage="count_tokens",
+            ),
+        ):
+            resp = await call_with_retries(
+                routed_call(
+                    self.router,
+                    lambda region: self._get_model(
+                        region=region
+                    ).count_tokens_async(string),
+                ),
+                operation="count_tokens",
+                deployment=self.model_id,
+            )
+            log.debug(
+                "count_tokens[completion] response: %s",
+                LazyJson(resp, frozen=True),
+            )
             return resp.total_tokens
 
     @classmethod
@@ -258,9 +346,9 @@ class GeminiChatCompletionAdapter(ChatCompletionAdapter[GeminiPrompt]):
         return cls(file_storage, model_id, deployment)
 
 
-async def set_finish_reason(candidate: Candidate, consumer: Consumer) -> None:
+async def set_finish_reason(chunk: Chunk, consumer: Consumer) -> None:
     openai_reason = to_openai_finish_reason(
-        finish_reason=candidate.finish_reason,
+        finish_reason=chunk.finish_reason,
         retriable=consumer.is_empty(),
     )
 
@@ -269,55 +357,31 @@ async def set_finish_reason(candidate: Candidate, consumer: Consumer) -> None:
 
 
 async def create_attachments_from_citations(
-    candidate: Candidate, consumer: Consumer
+    chunk: Chunk, consumer: Consumer
 ) -> None:
-    citation_metadata = candidate.citation_metadata
-
-    if (
-        citation_metadata is None
-        or citation_metadata.citations is None
-        or not len(citation_metadata.citations)
-    ):
-        return None
-
-    for citation in citation_metadata.citations:
-        if citation.uri:
-            await consumer.add_attachment(
-                Attachment(url=citation.uri, title=citation.title)
-            )
-
-
-async def set_usage(
-    usage: GenerateContentResponse.UsageMetadata, consumer: Consumer
-) -> None:
-    log.debug(f"usage: {json_dumps(usage)}")
-    await consumer.set_usage(
-        TokenUsage(
-            prompt_tokens=usage.prompt_token_count,
-            completion_tokens=usage.candidates_token_count,
+    for citation in chunk.citations:
+        await consumer.add_attachment(
+            Attachment(url=citation.uri, title=citation.title)
         )
-    )
 
 
 async def create_function_calls(
-    candidate: Candidate, consumer: Consumer, tools: ToolsConfig
+    chunk: Chunk, consumer: Consumer, tools: ToolsConfig
 ) -> None:
-    for call in candidate.function_calls:
-        arguments = json.dumps(recurse_proto_marshal_to_dict(call.args))
-
+    for call in chunk.function_calls:
         if tools.is_tool:
             id = tools.create_fresh_tool_call_id(call.name)
-            log.debug(f"tool call: id={id}, {json_dumps(call)}")
+            log.debug(f"tool call: id={id}, {call}")
             await consumer.create_tool_call(
                 id=id,
                 name=call.name,
-                arguments=arguments,
+                arguments=call.arguments,
             )
         else:
-            log.debug(f"function call: {json_dumps(call)}")
+            log.debug(f"function call: {call}")
             await consumer.create_function_call(
                 name=call.name,
-                arguments=arguments,
+                arguments=call.arguments,
             )
 
 
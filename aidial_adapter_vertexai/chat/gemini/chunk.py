@@ -0,0 +1,100 @@
+"""
+Decoding of the streamed Gemini response chunks.
+
+The high-level `GenerationResponse` and `Candidate` wrappers create
+new wrapper objects on every property access, and the proto-plus
+marshalling of the function call arguments is recursive and slow.
+The chunks are streamed at a high rate, so they are decoded
+directly from the underlying protobuf messages.
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from google.protobuf import json_format
+from vertexai.preview.generative_models import FinishReason as GenFinishReason
+from vertexai.preview.generative_models import GenerationResponse
+
+from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+
+
+@dataclass
+class FunctionCall:
+    name: str
+    arguments: str
+    """JSON object with the arguments"""
+
+
+@dataclass
+class Citation:
+    uri: str
+    title: str
+
+
+@dataclass
+class Chunk:
+    has_candidate: bool = False
+    """The rest of the candidate fields are only set when it's true"""
+
+    text: str = ""
+    function_calls: List[FunctionCall] = field(default_factory=list)
+    citations: List[Citation] = field(default_factory=list)
+    finish_reason: GenFinishReason = GenFinishReason.FINISH_REASON_UNSPECIFIED
+
+    usage: Optional[TokenUsage] = None
+    is_blocked: bool = False
+    """The prompt was blocked"""
+
+
+def _decode_finish_reason(value: int) -> GenFinishReason:
+    # The API may return the reasons unknown to the installed SDK
+    try:
+        return GenFinishReason(value)
+    except ValueError:
+        return GenFinishReason.FINISH_REASON_UNSPECIFIED
+
+
+def decode_chunk(response: GenerationResponse) -> Chunk:
+    pb = response._raw_response._pb
+    chunk = Chunk()
+
+    if pb.candidates:
+        candidate = pb.candidates[0]
+        chunk.has_candidate = True
+
+        texts: List[str] = []
+        for part in candidate.content.parts:
+            match part.WhichOneof("data"):
+                case "text":
+                    texts.append(part.text)
+                case "function_call":
+                    call = part.function_call
+                    chunk.function_calls.append(
+                        FunctionCall(
+                            name=call.name,
+                            arguments=json.dumps(
+                                json_format.MessageToDict(call.args)
+                            ),
+                        )
+                    )
+        chunk.text = "".join(texts)
+
+        for citation in candidate.citation_metadata.citations:
+            if citation.uri:
+                chunk.citations.append(
+                    Citation(uri=citation.uri, title=citation.title)
+                )
+
+        chunk.finish_reason = _decode_finish_reason(candidate.finish_reason)
+
+    usage = pb.usage_metadata
+    if usage.ListFields():
+        chunk.usage = TokenUsage(
+            prompt_tokens=usage.prompt_token_count,
+            completion_tokens=usage.candidates_token_count,
+        )
+
+    chunk.is_blocked = bool(pb.prompt_feedback.ListFields())
+
+    return chunk
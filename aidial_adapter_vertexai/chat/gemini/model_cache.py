@@ -0,0 +1,78 @@
+"""
+Cache of the prepared Gemini models.
+
+Creation of a `GenerativeModel` involves conversion of the tool declarations,
+which is noticeable for the agents with dozens of tools, especially when
+the prompt is truncated and the tokens are counted many times.
+
+The models are created without the generation config,
+which is passed to each generation call instead,
+so that the same model could serve requests with different parameters.
+"""
+
+from collections import OrderedDict
+from typing import List, Tuple, cast
+
+from vertexai.preview.generative_models import GenerativeModel, Image, Part
+
+from aidial_adapter_vertexai.chat.tools import ToolsConfig
+from aidial_adapter_vertexai.utils.env import get_env_int
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+
+GEMINI_MODEL_CACHE_SIZE = get_env_int("GEMINI_MODEL_CACHE_SIZE", 256)
+
+_ModelKey = Tuple[str, str, str]
+
+
+class GenerativeModelCache:
+    max_size: int
+    _models: OrderedDict[_ModelKey, GenerativeModel]
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._models = OrderedDict()
+
+    def get(
+        self,
+        resource_name: str,
+        tools: ToolsConfig | None,
+        system_instruction: List[Part] | None,
+    ) -> GenerativeModel:
+        key = (
+            resource_name,
+            _get_tools_hash(tools),
+            canonical_hash(system_instruction) if system_instruction else "",
+        )
+
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            return model
+
+        model = GenerativeModel(
+            resource_name,
+            tools=tools.to_gemini_tools() if tools else None,
+            tool_config=tools.to_gemini_tool_config() if tools else None,
+            system_instruction=cast(
+                List[str | Part | Image] | None, system_instruction
+            ),
+        )
+
+        self._models[key] = model
+        if len(self._models) > self.max_size:
+            self._models.popitem(last=False)
+
+        return model
+
+    def clear(self) -> None:
+        self._models.clear()
+
+
+def _get_tools_hash(tools: ToolsConfig | None) -> str:
+    # The tool call ids don't affect the model
+    if tools is None or not tools.functions:
+        return ""
+    return tools.declarations_hash
+
+
+model_cache = GenerativeModelCache(GEMINI_MODEL_CACHE_SIZE)
@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-from logging import DEBUG
 from typing import (
     Callable,
     Coroutine,
@@ -31,7 +30,8 @@ from aidial_adapter_vertexai.dial_api.resource import (
     ValidationError as ResourceValidationError,
 )
 from aidial_adapter_vertexai.dial_api.storage import FileStorage
-from aidial_adapter_vertexai.utils.json import json_dumps_short
+from aidial_adapter_vertexai.telemetry.tracing import tracer
+from aidial_adapter_vertexai.utils.json import LazyJson
 from aidial_adapter_vertexai.utils.log_config import app_logger as log
 from aidial_adapter_vertexai.utils.pdf import get_pdf_page_count
 from aidial_adapter_vertexai.utils.resource import Resource
@@ -72,13 +72,22 @@ class AttachmentProcessor(BaseModel):
             if type not in self.mime_types:
                 return None
 
-            if self.init_validator is not None:
-                await self.init_validator()
+            with tracer.start_as_current_span(
+                "attachment.process",
+                attributes={
+                    "attachment.entity": dial_resource.entity_name,
+                    "attachment.type": type or "",
+                },
+            ) as span:
+                if self.init_validator is not None:
+                    await self.init_validator()
 
-            resource = await dial_resource.download(file_storage)
+                resource = await dial_resource.download(file_storage)
+                span.set_attribute("attachment.size", len(resource.data))
 
-            if self.post_validator is not None:
-                await self.post_validator(resource)
+                if self.post_validator is not None:
+                    with tracer.start_as_current_span("attachment.validate"):
+                        await self.post_validator(resource)
 
             return resource
 
@@ -128,9 +137,8 @@ class AttachmentProcessors(BaseModel):
     async def _collect_resource(
         self, dial_resource: DialResource, resource: Resource | str
     ) -> Resource | None:
-        if log.isEnabledFor(DEBUG):
-            log.debug(f"resource reference: {json_dumps_short(dial_resource)}")
-            log.debug(f"resource content: {json_dumps_short(resource)}")
+        log.debug("resource reference: %s", LazyJson(dial_resource, short=True))
+        log.debug("resource content: %s", LazyJson(resource, short=True))
 
         if isinstance(resource, str):
             name = await dial_resource.get_resource_name(self.file_storage)
@@ -221,7 +229,11 @@ def max_pdf_page_count_validator(limit: int) -> PostValidator:
     async def validator(resource: Resource):
         nonlocal count
         try:
-            pages = await get_pdf_page_count(resource.data)
+            with tracer.start_as_current_span(
+                "pdf.page_count", attributes={"pdf.size": len(resource.data)}
+            ) as span:
+                pages = await get_pdf_page_count(resource.data)
+                span.set_attribute("pdf.pages", pages)
             log.debug(f"PDF page count: {pages}")
             count += pages
         except Exception:
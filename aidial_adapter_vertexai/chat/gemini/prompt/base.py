@@ -1,11 +1,12 @@
 from abc import ABC
-from typing import List, Set
+from typing import List, Optional, Set
 
 from pydantic import BaseModel, Field
 from vertexai.preview.generative_models import Content, Part
 
 from aidial_adapter_vertexai.chat.tools import ToolsConfig
 from aidial_adapter_vertexai.chat.truncate_prompt import TruncatablePrompt
+from aidial_adapter_vertexai.chat.truncation_hints import get_prefix_hashes
 
 
 class GeminiConversation(BaseModel):
@@ -48,6 +49,13 @@ class GeminiPrompt(BaseModel, TruncatablePrompt, ABC):
             [1] * self.has_system_instruction + [2] * (n // 2) + [1] * (n % 2)
         )
 
+    def get_prefix_hashes(self) -> Optional[List[str]]:
+        # The tools are counted as a part of the prompt
+        messages: List[object] = [*self.contents]
+        if self.system_instruction is not None:
+            messages.insert(0, self.system_instruction)
+        return get_prefix_hashes(self.tools.declarations_hash, messages)
+
     def select(self, indices: Set[int]) -> "GeminiPrompt":
         system_instruction: List[Part] | None = None
         contents: List[Content] = []
@@ -25,6 +25,8 @@ from aidial_adapter_vertexai.dial_api.storage import (
     compute_hash_digest,
 )
 from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+from aidial_adapter_vertexai.telemetry.metrics import generation_time_histogram
+from aidial_adapter_vertexai.telemetry.tracing import tracer
 from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
 from aidial_adapter_vertexai.utils.timer import Timer
 from aidial_adapter_vertexai.vertex_ai import get_image_generation_model
@@ -36,9 +38,11 @@ class ImagenChatCompletionAdapter(ChatCompletionAdapter[ImagenPrompt]):
     def __init__(
         self,
         file_storage: Optional[FileStorage],
+        model_id: str,
         model: ImageGenerationModel,
     ):
         self.file_storage = file_storage
+        self.model_id = model_id
         self.model = model
 
     @override
@@ -74,11 +78,27 @@ class ImagenChatCompletionAdapter(ChatCompletionAdapter[ImagenPrompt]):
 
     @override
     async def chat(
-        self, params: ModelParameters, consumer: Consumer, prompt: ImagenPrompt
+        self,
+        params: ModelParameters,
+        consumer: Consumer,
+        prompt: ImagenPrompt,
+        prompt_tokens: Optional[int] = None,
     ) -> None:
-        prompt_tokens = await self.count_prompt_tokens(prompt)
-
-        with Timer("predict timing: {time}", log.debug):
+        if prompt_tokens is None:
+            prompt_tokens = await self.count_prompt_tokens(prompt)
+
+        with (
+            tracer.start_as_current_span(
+                "generate", attributes={"deployment": self.model_id}
+            ),
+            Timer(
+                "predict timing: {time}",
+                log.debug,
+                generation_time_histogram,
+                {"deployment": self.model_id},
+                stage="generate",
+            ),
+        ):
             response: ImageGenerationResponse = self.model.generate_images(
                 prompt, number_of_images=1, seed=None
             )
@@ -97,7 +117,14 @@ class ImagenChatCompletionAdapter(ChatCompletionAdapter[ImagenPrompt]):
         )
 
         if self.file_storage is not None:
-            with Timer("upload to file storage: {time}", log.debug):
+            with (
+                tracer.start_as_current_span(
+                    "imagen.upload", attributes={"image.size": len(data)}
+                ),
+                Timer(
+                    "upload to file storage: {time}", log.debug, stage="upload"
+                ),
+            ):
                 filename = "images/" + compute_hash_digest(base64_data)
                 meta = await self.file_storage.upload(
                     filename=filename, content_type=type, content=data
@@ -135,4 +162,4 @@ class ImagenChatCompletionAdapter(ChatCompletionAdapter[ImagenPrompt]):
         model_id: str,
     ) -> "ImagenChatCompletionAdapter":
         model = await get_image_generation_model(model_id)
-        return cls(file_storage, model)
+        return cls(file_storage, model_id, model)
@@ -0,0 +1,191 @@
+"""
+Chat completion results recorded from a model, so that they could be
+sent to several responses (e.g. for coalesced requests) or
+replayed later (e.g. from the response cache).
+"""
+
+import asyncio
+from typing import List, Optional
+
+from aidial_sdk.chat_completion import Attachment, FinishReason, Response
+from pydantic import BaseModel
+
+from aidial_adapter_vertexai.chat.consumer import ChoiceConsumer, Consumer
+from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+
+
+class FunctionCallResult(BaseModel):
+    name: str
+    arguments: Optional[str] = None
+
+
+class ToolCallResult(BaseModel):
+    id: str
+    name: str
+    arguments: Optional[str] = None
+
+
+class ChoiceResult(BaseModel):
+    content: str = ""
+    function_call: Optional[FunctionCallResult] = None
+    tool_calls: List[ToolCallResult] = []
+    attachments: List[Attachment] = []
+    usage: TokenUsage = TokenUsage()
+    finish_reason: Optional[FinishReason] = None
+
+    async def replay(
+        self, consumer: Consumer, chunk_size: Optional[int] = None
+    ) -> None:
+        """
+        The content is split into chunks of the given size to emulate streaming.
+        """
+        if chunk_size:
+            for idx in range(0, len(self.content), chunk_size):
+                await consumer.append_content(
+                    self.content[idx : idx + chunk_size]
+                )
+                # Let the chunk be sent before the next one
+                await asyncio.sleep(0)
+        elif self.content:
+            await consumer.append_content(self.content)
+
+        if self.function_call is not None:
+            await consumer.create_function_call(
+                self.function_call.name, self.function_call.arguments
+            )
+
+        for tool_call in self.tool_calls:
+            await consumer.create_tool_call(
+                tool_call.id, tool_call.name, tool_call.arguments
+            )
+
+        for attachment in self.attachments:
+            await consumer.add_attachment(attachment)
+
+        await consumer.set_usage(self.usage)
+
+        if self.finish_reason is not None:
+            await consumer.set_finish_reason(self.finish_reason)
+
+
+class ChatCompletionResult(BaseModel):
+    choices: List[ChoiceResult]
+    discarded_messages: Optional[List[int]] = None
+
+    @property
+    def usage(self) -> TokenUsage:
+        usage = TokenUsage()
+        for choice in self.choices:
+            usage.accumulate(choice.usage)
+        return usage
+
+    async def replay(
+        self, response: Response, chunk_size: Optional[int] = None
+    ) -> None:
+        for choice_result in self.choices:
+            choice = response.create_choice()
+            choice.open()
+
+            consumer = ChoiceConsumer(choice)
+            await choice_result.replay(consumer, chunk_size)
+            choice.close(consumer.finish_reason)
+
+        usage = self.usage
+        response.set_usage(usage.prompt_tokens, usage.completion_tokens)
+
+        if self.discarded_messages is not None:
+            response.set_discarded_messages(self.discarded_messages)
+
+
+class RecordingConsumer(Consumer):
+    result: ChoiceResult
+
+    def __init__(self):
+        self.result = ChoiceResult()
+
+    def is_empty(self) -> bool:
+        result = self.result
+        return not (
+            result.content
+            or result.function_call
+            or result.tool_calls
+            or result.attachments
+        )
+
+    async def append_content(self, content: str):
+        self.result.content += content
+
+    async def create_function_call(self, name: str, arguments: str | None):
+        await self.set_finish_reason(FinishReason.FUNCTION_CALL)
+        self.result.function_call = FunctionCallResult(
+            name=name, arguments=arguments
+        )
+
+    async def create_tool_call(self, id: str, name: str, arguments: str | None):
+        await self.set_finish_reason(FinishReason.TOOL_CALLS)
+        self.result.tool_calls.append(
+            ToolCallResult(id=id, name=name, arguments=arguments)
+        )
+
+    async def add_attachment(self, attachment: Attachment):
+        self.result.attachments.append(attachment)
+
+    async def set_usage(self, usage: TokenUsage):
+        self.result.usage = usage
+
+    async def set_finish_reason(self, finish_reason: FinishReason):
+        # The finish reason is validated by the consumer the result is replayed to
+        if (
+            finish_reason == FinishReason.STOP
+            and self.result.finish_reason
+            in [
+                FinishReason.FUNCTION_CALL,
+                FinishReason.TOOL_CALLS,
+            ]
+        ):
+            return
+        self.result.finish_reason = finish_reason
+
+
+class TeeConsumer(Consumer):
+    """
+    Passes the output of the model to the consumer and records it at the same time.
+    """
+
+    consumer: Consumer
+    recorder: RecordingConsumer
+
+    def __init__(self, consumer: Consumer):
+        self.consumer = consumer
+        self.recorder = RecordingConsumer()
+
+    @property
+    def result(self) -> ChoiceResult:
+        return self.recorder.result
+
+    def is_empty(self) -> bool:
+        return self.consumer.is_empty()
+
+    async def append_content(self, content: str):
+        await self.consumer.append_content(content)
+        await self.recorder.append_content(content)
+
+    async def create_function_call(self, name: str, arguments: str | None):
+        await self.consumer.create_function_call(name, arguments)
+        await self.recorder.create_function_call(name, arguments)
+
+    async def create_tool_call(self, id: str, name: str, arguments: str | None):
+        await self.consumer.create_tool_call(id, name, arguments)
+        await self.recorder.create_tool_call(id, name, arguments)
+
+    async def add_attachment(self, attachment: Attachment):
+        await self.consumer.add_attachment(attachment)
+        await self.recorder.add_attachment(attachment)
+
+    async def set_usage(self, usage: TokenUsage):
+        await self.consumer.set_usage(usage)
+        await self.recorder.set_usage(usage)
+
+    async def set_finish_reason(self, finish_reason: FinishReason):
+        await self.consumer.set_finish_reason(finish_reason)
+        await self.recorder.set_finish_reason(finish_reason)
@@ -0,0 +1,114 @@
+"""
+Coalescing of the streamed content deltas.
+
+The models sometimes stream very small chunks and each of them becomes
+a separate SSE event, which is costly to encode and send at high concurrency.
+The consecutive content deltas are merged until their size reaches
+the threshold or the first of them waits for longer than the maximum delay.
+
+The coalescing is disabled by default. It's configured per deployment
+by DEPLOYMENT_STREAM_COALESCING env variable and could be overridden
+per request via `custom_fields.configuration.stream_coalescing`
+(`null` disables the coalescing).
+"""
+
+import asyncio
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+from aidial_sdk.chat_completion import Request
+from pydantic import BaseModel
+from pydantic import ValidationError as PydanticValidationError
+
+from aidial_adapter_vertexai.chat.errors import ValidationError
+
+
+class StreamCoalescingConfig(BaseModel):
+    max_size: int = 64
+    """Number of characters after which the merged content is sent"""
+    max_delay: float = 0.02
+    """Maximum time in seconds the content is held back"""
+
+
+# JSON object mapping a deployment name to its coalescing configuration, e.g.
+# {"gemini-1.5-flash-002": {"max_size": 64, "max_delay": 0.02}}
+DEPLOYMENT_STREAM_COALESCING: Dict[str, StreamCoalescingConfig] = {
+    deployment: StreamCoalescingConfig.parse_obj(config)
+    for deployment, config in json.loads(
+        os.getenv("DEPLOYMENT_STREAM_COALESCING", "{}")
+    ).items()
+}
+
+_REQUEST_CONFIG_FIELD = "stream_coalescing"
+
+
+def get_stream_coalescing_config(
+    request: Request,
+) -> Optional[StreamCoalescingConfig]:
+    if not request.stream:
+        return None
+
+    configuration = (
+        request.custom_fields.configuration if request.custom_fields else None
+    )
+
+    if configuration is None or _REQUEST_CONFIG_FIELD not in configuration:
+        return DEPLOYMENT_STREAM_COALESCING.get(request.deployment_id)
+
+    config = configuration[_REQUEST_CONFIG_FIELD]
+    if config is None:
+        return None
+
+    try:
+        return StreamCoalescingConfig.parse_obj(config)
+    except PydanticValidationError as e:
+        raise ValidationError(
+            f"Invalid {_REQUEST_CONFIG_FIELD} configuration: {e}"
+        )
+
+
+class ContentCoalescer:
+    """
+    Merges the content deltas before passing them to the sink.
+    """
+
+    config: StreamCoalescingConfig
+    _sink: Callable[[str], None]
+    _buffer: List[str]
+    _size: int
+    _timer: Optional[asyncio.TimerHandle]
+
+    def __init__(
+        self, config: StreamCoalescingConfig, sink: Callable[[str], None]
+    ):
+        self.config = config
+        self._sink = sink
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+
+    def append(self, content: str) -> None:
+        if not content:
+            return
+
+        self._buffer.append(content)
+        self._size += len(content)
+
+        if self._size >= self.config.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.config.max_delay, self.flush
+            )
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._buffer:
+            content = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self._sink(content)
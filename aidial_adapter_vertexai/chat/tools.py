@@ -8,7 +8,7 @@ from aidial_sdk.chat_completion import (
     ToolChoice,
 )
 from aidial_sdk.chat_completion.request import AzureChatCompletionRequest
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from vertexai.preview.generative_models import (
     FunctionDeclaration as GeminiFunction,
 )
@@ -16,6 +16,7 @@ from vertexai.preview.generative_models import Tool as GeminiTool
 from vertexai.preview.generative_models import ToolConfig as GeminiToolConfig
 
 from aidial_adapter_vertexai.chat.errors import ValidationError
+from aidial_adapter_vertexai.utils.hash import canonical_hash
 
 FunctionCallingConfig = GeminiToolConfig.FunctionCallingConfig
 
@@ -39,10 +40,24 @@ class ToolsConfig(BaseModel):
     None means that functions are used, not tools.
     """
 
+    _declarations_hash: str | None = PrivateAttr(default=None)
+
     @property
     def is_tool(self) -> bool:
         return self.tool_ids is not None
 
+    @property
+    def declarations_hash(self) -> str:
+        """
+        Hash of the function declarations and the calling mode.
+        It's computed once, since the declarations don't change.
+        """
+        if self._declarations_hash is None:
+            self._declarations_hash = canonical_hash(
+                self.functions, self.required
+            )
+        return self._declarations_hash
+
     def not_supported(self) -> None:
         if self.functions:
             if self.is_tool:
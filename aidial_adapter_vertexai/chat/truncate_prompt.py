@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from enum import Enum
+from itertools import accumulate
 from typing import (
     Awaitable,
     Callable,
@@ -8,6 +10,7 @@ from typing import (
     Self,
     Set,
     Sized,
+    Tuple,
     TypeVar,
 )
 
@@ -19,14 +22,45 @@ from aidial_sdk.exceptions import (
 )
 from pydantic import BaseModel
 
+from aidial_adapter_vertexai.chat.truncation_hints import (
+    TruncationHint,
+    partition_token_counts,
+    truncation_hints,
+)
+from aidial_adapter_vertexai.telemetry.tracing import tracer
+from aidial_adapter_vertexai.utils.concurrency import gather_with_limit
+from aidial_adapter_vertexai.utils.env import get_env_int
+
+# Maximum number of concurrent token counting calls
+# made by the prefix sum truncation strategy
+TRUNCATION_CONCURRENCY = get_env_int("TRUNCATION_CONCURRENCY", 16)
+
 DiscardedMessages = List[int]
 
+
+class TruncationStrategy(str, Enum):
+    GREEDY = "greedy"
+    """
+    Adds the partitions of messages one by one starting from the newest one
+    and counts the tokens of the prompt after each addition.
+    """
+
+    PREFIX_SUM = "prefix_sum"
+    """
+    Counts the tokens of each partition concurrently and picks the cut
+    from the sums of the counts, assuming the counts are additive.
+    The cut is checked by counting the tokens of the truncated prompt.
+    """
+
+
 _P = TypeVar("_P")
 
 
 class TruncatedPrompt(BaseModel, Generic[_P]):
     prompt: _P
     discarded_messages: DiscardedMessages
+    prompt_tokens: Optional[int] = None
+    """Token count of the truncated prompt, if it was computed"""
 
 
 class TruncatePromptError(ABC, BaseModel):
@@ -124,12 +158,23 @@ class TruncatablePrompt(ABC, Sized):
     def omit(self, indices: Set[int]) -> Self:
         return self.select(set(range(len(self))) - indices)
 
+    def get_prefix_hashes(self) -> Optional[List[str]]:
+        """
+        Returns the hashes of the prefixes of the list of messages,
+        which identify the previous turns of the same conversation.
+
+        None means that the prompt doesn't support the truncation hints.
+        """
+        return None
+
     async def truncate(
         self,
         *,
         tokenizer: Callable[[Self], Awaitable[int]],
         model_limit: Optional[int] = None,
         user_limit: Optional[int] = None,
+        hint_scope: Optional[str] = None,
+        strategy: TruncationStrategy = TruncationStrategy.GREEDY,
     ) -> TruncatedPrompt[Self]:
         """
         Returns a list of indices of discarded messages and
@@ -142,6 +187,8 @@ class TruncatablePrompt(ABC, Sized):
         * The tokenizer computes number of tokens in the given prompt.
         * The model limit is the intrinsic context limit on the number of input tokes for the given model.
         * The user limit (aka max_prompt_tokens) defines the number of tokens that the resulting truncated prompt must fit in.
+        * The hint scope enables the truncation hints shared by the prompts with the same tokenizer (e.g. the same model).
+        * The strategy defines how the truncation boundary is searched for.
 
         Throws a DIAL exception when the truncation satisfying the given limits is impossible.
         """
@@ -150,14 +197,19 @@ class TruncatablePrompt(ABC, Sized):
             tokenizer=tokenizer,
             model_limit=model_limit,
             user_limit=user_limit,
+            hint_scope=hint_scope,
+            strategy=strategy,
         )
 
         if isinstance(result, TruncatePromptError):
             raise result.to_dial_exception()
 
+        discarded_messages, prompt_tokens = result
+
         return TruncatedPrompt(
-            discarded_messages=list(result),
-            prompt=self.omit(set(result)),
+            discarded_messages=list(discarded_messages),
+            prompt=self.omit(set(discarded_messages)),
+            prompt_tokens=prompt_tokens,
         )
 
     async def compute_discarded_messages(
@@ -166,7 +218,51 @@ class TruncatablePrompt(ABC, Sized):
         tokenizer: Callable[[Self], Awaitable[int]],
         model_limit: Optional[int],
         user_limit: Optional[int],
-    ) -> DiscardedMessages | TruncatePromptError:
+        hint_scope: Optional[str] = None,
+        strategy: TruncationStrategy = TruncationStrategy.GREEDY,
+    ) -> Tuple[DiscardedMessages, Optional[int]] | TruncatePromptError:
+        """
+        Returns the discarded messages along with the number of tokens
+        in the remaining prompt, when the latter is known.
+        """
+        iterations = 0
+
+        async def _tokenizer(prompt: Self) -> int:
+            nonlocal iterations
+            iterations += 1
+            return await tokenizer(prompt)
+
+        with tracer.start_as_current_span(
+            "truncate_prompt",
+            attributes={
+                "messages.count": len(self),
+                "truncation.strategy": strategy.value,
+                "truncation.user_limit": user_limit or 0,
+            },
+        ) as span:
+            result = await self._compute_discarded_messages(
+                tokenizer=_tokenizer,
+                model_limit=model_limit,
+                user_limit=user_limit,
+                hint_scope=hint_scope,
+                strategy=strategy,
+            )
+
+            span.set_attribute("truncation.iterations", iterations)
+            if not isinstance(result, TruncatePromptError):
+                span.set_attribute("messages.discarded", len(result[0]))
+
+            return result
+
+    async def _compute_discarded_messages(
+        self,
+        *,
+        tokenizer: Callable[[Self], Awaitable[int]],
+        model_limit: Optional[int],
+        user_limit: Optional[int],
+        hint_scope: Optional[str],
+        strategy: TruncationStrategy,
+    ) -> Tuple[DiscardedMessages, Optional[int]] | TruncatePromptError:
         if (
             user_limit is not None
             and model_limit is not None
@@ -178,38 +274,109 @@ class TruncatablePrompt(ABC, Sized):
 
         if user_limit is None:
             if model_limit is None:
-                return []
+                return [], None
 
             token_count = await tokenizer(self)
             if token_count <= model_limit:
-                return []
+                return [], token_count
 
             return ModelLimitOverflowError(
                 model_limit=model_limit, token_count=token_count
             )
 
-        if await tokenizer(self) <= user_limit:
-            return []
+        prefix_hashes = (
+            self.get_prefix_hashes()
+            if hint_scope is not None
+            and (
+                truncation_hints.enabled
+                or strategy == TruncationStrategy.PREFIX_SUM
+            )
+            else None
+        )
+
+        result: Tuple[DiscardedMessages, int] | TruncatePromptError | None = (
+            None
+        )
+
+        if hint_scope is not None and prefix_hashes:
+            found = truncation_hints.find(hint_scope, user_limit, prefix_hashes)
+            if found is not None:
+                prefix_length, hint = found
+                result = await self._truncate_from_hint(
+                    tokenizer=tokenizer,
+                    user_limit=user_limit,
+                    hint=hint,
+                    is_exact=prefix_length == len(prefix_hashes),
+                )
+
+        if result is None:
+            match strategy:
+                case TruncationStrategy.GREEDY:
+                    result = await self._truncate(
+                        tokenizer=tokenizer, user_limit=user_limit
+                    )
+                case TruncationStrategy.PREFIX_SUM:
+                    result = await self._truncate_by_prefix_sums(
+                        tokenizer=tokenizer,
+                        user_limit=user_limit,
+                        hint_scope=hint_scope,
+                        prefix_hashes=prefix_hashes,
+                    )
 
+        if (
+            hint_scope is not None
+            and prefix_hashes
+            and not isinstance(result, TruncatePromptError)
+            and result[0]
+        ):
+            discarded_messages, token_count = result
+            truncation_hints.save(
+                hint_scope,
+                user_limit,
+                prefix_hashes,
+                TruncationHint(
+                    cut=discarded_messages[-1] + 1, token_count=token_count
+                ),
+            )
+
+        return result
+
+    def _get_partition_indexer(self) -> Callable[[int], List[int]]:
         partition_sizes = self.partition_messages()
         if sum(partition_sizes) != len(self):
             raise ValueError(
                 "Partition sizes must add up to the number of messages."
             )
+        return _partition_indexer(partition_sizes)
 
-        async def _tokenize_selected(indices: Set[int]) -> int:
-            return await tokenizer(self.select(indices))
-
-        get_partition_indices = _partition_indexer(partition_sizes)
-
-        n = len(self)
-        kept_indices: Set[int] = {
+    def _get_required_indices(
+        self, get_partition_indices: Callable[[int], List[int]]
+    ) -> Set[int]:
+        return {
             j
-            for i in range(n)
+            for i in range(len(self))
             for j in get_partition_indices(i)
             if self.is_required_message(i)
         }
 
+    async def _truncate(
+        self,
+        *,
+        tokenizer: Callable[[Self], Awaitable[int]],
+        user_limit: int,
+    ) -> Tuple[DiscardedMessages, int] | TruncatePromptError:
+        token_count = await tokenizer(self)
+        if token_count <= user_limit:
+            return [], token_count
+
+        get_partition_indices = self._get_partition_indexer()
+
+        async def _tokenize_selected(indices: Set[int]) -> int:
+            return await tokenizer(self.select(indices))
+
+        n = len(self)
+        kept_indices = self._get_required_indices(get_partition_indices)
+
         token_count = await _tokenize_selected(kept_indices)
         if token_count > user_limit:
             return UserLimitOverflowError(
@@ -223,13 +390,259 @@ class TruncatablePrompt(ABC, Sized):
             chunk_indices = get_partition_indices(idx)
             new_kept_indices = {*kept_indices, *chunk_indices}
 
-            if (
-                len(new_kept_indices) == n
-                or await _tokenize_selected(new_kept_indices) > user_limit
-            ):
+            if len(new_kept_indices) == n:
+                break
+
+            new_token_count = await _tokenize_selected(new_kept_indices)
+            if new_token_count > user_limit:
                 break
 
             kept_indices = new_kept_indices
+            token_count = new_token_count
 
         all_indices = set(range(n))
-        return sorted(list(all_indices - kept_indices))
+        return sorted(list(all_indices - kept_indices)), token_count
+
+    async def _truncate_from_hint(
+        self,
+        *,
+        tokenizer: Callable[[Self], Awaitable[int]],
+        user_limit: int,
+        hint: TruncationHint,
+        is_exact: bool,
+    ) -> Tuple[DiscardedMessages, int] | TruncatePromptError | None:
+        """
+        Searches for the truncation boundary starting from the boundary
+        of the previous turn of the conversation.
+
+        The previous prompt is a prefix of the current one, so the messages
+        discarded from the previous prompt are discarded from the current one too
+        (given that the token count doesn't decrease when messages are added).
+
+        Returns None when the hint isn't applicable to the prompt.
+        """
+        n = len(self)
+        get_partition_indices = self._get_partition_indexer()
+
+        cut = hint.cut
+        if cut >= n or get_partition_indices(cut)[0] != cut:
+            return None
+
+        if is_exact:
+            # The same prompt was already truncated
+            required_indices = self._get_required_indices(get_partition_indices)
+            return (
+                _get_discarded_messages(required_indices, cut),
+                hint.token_count,
+            )
+
+        return await self._search_forward(
+            tokenizer=tokenizer,
+            user_limit=user_limit,
+            get_partition_indices=get_partition_indices,
+            cut=cut,
+        )
+
+    async def _search_forward(
+        self,
+        *,
+        tokenizer: Callable[[Self], Awaitable[int]],
+        user_limit: int,
+        get_partition_indices: Callable[[int], List[int]],
+        cut: int,
+        token_count: Optional[int] = None,
+    ) -> Tuple[DiscardedMessages, int] | TruncatePromptError:
+        """
+        Discards the partitions of messages starting from the given cut
+        until the prompt fits into the user limit.
+
+        The cut must be the first index of a partition.
+        The token count of the prompt kept by the cut is computed
+        unless it's given.
+        """
+        n = len(self)
+        required_indices = self._get_required_indices(get_partition_indices)
+
+        while True:
+            if token_count is None:
+                kept_indices = required_indices | set(range(cut, n))
+                token_count = await tokenizer(self.select(kept_indices))
+
+            if token_count <= user_limit:
+                return (
+                    _get_discarded_messages(required_indices, cut),
+                    token_count,
+                )
+
+            while cut < n and cut in required_indices:
+                cut = get_partition_indices(cut)[-1] + 1
+
+            if cut >= n:
+                return UserLimitOverflowError(
+                    user_limit=user_limit, token_count=token_count
+                )
+
+            cut = get_partition_indices(cut)[-1] + 1
+            token_count = None
+
+    async def _search_backward(
+        self,
+        *,
+        tokenizer: Callable[[Self], Awaitable[int]],
+        user_limit: int,
+        get_partition_indices: Callable[[int], List[int]],
+        cut: int,
+        token_count: int,
+    ) -> Tuple[DiscardedMessages, int]:
+        """
+        Keeps the partitions of messages preceding the given cut
+        while the prompt fits into the user limit,
+        so that the result is the same as of the greedy truncation.
+
+        The cut must be the first index of a partition
+        and the prompt kept by the cut must fit.
+        """
+        n = len(self)
+        required_indices = self._get_required_indices(get_partition_indices)
+
+        while True:
+            prev = cut
+            while prev > 0 and prev - 1 in required_indices:
+                prev = get_partition_indices(prev - 1)[0]
+
+            if prev == 0:
+                break
+
+            prev = get_partition_indices(prev - 1)[0]
+            kept_indices = required_indices | set(range(prev, n))
+            new_token_count = await tokenizer(self.select(kept_indices))
+            if new_token_count > user_limit:
+                break
+
+            cut, token_count = prev, new_token_count
+
+        return _get_discarded_messages(required_indices, cut), token_count
+
+    async def _truncate_by_prefix_sums(
+        self,
+        *,
+        tokenizer: Callable[[Self], Awaitable[int]],
+        user_limit: int,
+        hint_scope: Optional[str],
+        prefix_hashes: Optional[List[str]],
+    ) -> Tuple[DiscardedMessages, int] | TruncatePromptError:
+        n = len(self)
+        get_partition_indices = self._get_partition_indexer()
+        required_indices = self._get_required_indices(get_partition_indices)
+
+        partitions = [
+            chunk
+            for chunk in _get_partitions(self.partition_messages())
+            if chunk[0] not in required_indices
+        ]
+
+        # The partition is counted along with the required messages,
+        # since the prompt can't be empty
+        async def _count_partition(chunk: List[int]) -> int:
+            return await tokenizer(self.select({*required_indices, *chunk}))
+
+        cached_counts: List[Optional[int]] = [
+            (
+                partition_token_counts.get(hint_scope, prefix_hashes[chunk[-1]])
+                if hint_scope is not None and prefix_hashes
+                else None
+            )
+            for chunk in partitions
+        ]
+
+        # The whole prompt is counted along with the partitions,
+        # so that a fitting prompt doesn't cost an extra round trip
+        counts = await gather_with_limit(
+            TRUNCATION_CONCURRENCY,
+            [
+                lambda: tokenizer(self),
+                lambda: tokenizer(self.select(required_indices)),
+                *(
+                    lambda chunk=chunk: _count_partition(chunk)
+                    for chunk, count in zip(partitions, cached_counts)
+                    if count is None
+                ),
+            ],
+        )
+
+        whole_count, required_count, *new_counts = counts
+
+        new_counts_iter = iter(new_counts)
+        deltas: List[int] = []
+        for chunk, count in zip(partitions, cached_counts):
+            if count is None:
+                count = next(new_counts_iter) - required_count
+                if hint_scope is not None and prefix_hashes:
+                    partition_token_counts.set(
+                        hint_scope, prefix_hashes[chunk[-1]], count
+                    )
+            deltas.append(count)
+
+        if whole_count <= user_limit:
+            return [], whole_count
+
+        if required_count > user_limit:
+            return UserLimitOverflowError(
+                user_limit=user_limit, token_count=required_count
+            )
+
+        # Estimated token counts of the prompts keeping
+        # the partitions starting from the i-th one
+        suffix_sums = list(accumulate(reversed(deltas), initial=0))[::-1]
+        start = next(
+            idx
+            for idx, suffix_sum in enumerate(suffix_sums)
+            if required_count + suffix_sum <= user_limit
+        )
+
+        if start == len(partitions):
+            cut, token_count = n, required_count
+        else:
+            cut = partitions[start][0]
+            token_count = await tokenizer(
+                self.select(required_indices | set(range(cut, n)))
+            )
+
+        # The estimation is off when the token counts aren't additive:
+        # an underestimated cut discards too few messages
+        # and an overestimated one discards too many
+        if token_count > user_limit:
+            return await self._search_forward(
+                tokenizer=tokenizer,
+                user_limit=user_limit,
+                get_partition_indices=get_partition_indices,
+                cut=cut,
+                token_count=token_count,
+            )
+
+        return await self._search_backward(
+            tokenizer=tokenizer,
+            user_limit=user_limit,
+            get_partition_indices=get_partition_indices,
+            cut=cut,
+            token_count=token_count,
+        )
+
+
+def _get_partitions(chunks: List[int]) -> List[List[int]]:
+    """
+    >>> _get_partitions([1, 2])
+    [[0], [1, 2]]
+    """
+    partitions: List[List[int]] = []
+    offset = 0
+    for size in chunks:
+        partitions.append(list(range(offset, offset + size)))
+        offset += size
+    return partitions
+
+
+def _get_discarded_messages(
+    required_indices: Set[int], cut: int
+) -> DiscardedMessages:
+    return [idx for idx in range(cut) if idx not in required_indices]
@@ -0,0 +1,135 @@
+"""
+Hints for the truncation of the growing conversations.
+
+When a conversation is continued, the prompt of the next turn
+is the prompt of the previous turn followed by the new messages.
+Therefore, the truncation boundary only moves forward and the search
+for the new boundary could start from the boundary of the previous turn.
+
+The hints are keyed by the hash of the whole truncated prompt,
+so that the next turn finds the hint by the hash of its prefix.
+
+The token counts of the individual partitions of messages are remembered
+as well, so that the next turn counts only the new partitions.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from aidial_adapter_vertexai.utils.env import get_env_int
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+
+TRUNCATION_HINT_CACHE_SIZE = get_env_int("TRUNCATION_HINT_CACHE_SIZE", 10000)
+
+
+class TruncationHint(BaseModel):
+    cut: int
+    """Number of the leading messages the discarded messages are taken from"""
+    token_count: int
+    """Token count of the truncated prompt"""
+
+
+class TruncationHintCache:
+    max_size: int
+    _hints: OrderedDict[str, TruncationHint]
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._hints = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def find(
+        self, scope: str, user_limit: int, prefix_hashes: List[str]
+    ) -> Optional[Tuple[int, TruncationHint]]:
+        """
+        Returns the hint for the longest prefix of the conversation
+        along with the length of the prefix.
+        """
+        for length in range(len(prefix_hashes), 0, -1):
+            key = _get_key(scope, user_limit, prefix_hashes[length - 1])
+            hint = self._hints.get(key)
+            if hint is not None:
+                self._hints.move_to_end(key)
+                return length, hint
+        return None
+
+    def save(
+        self,
+        scope: str,
+        user_limit: int,
+        prefix_hashes: List[str],
+        hint: TruncationHint,
+    ) -> None:
+        if not self.enabled or not prefix_hashes:
+            return
+
+        key = _get_key(scope, user_limit, prefix_hashes[-1])
+        self._hints[key] = hint
+        self._hints.move_to_end(key)
+        while len(self._hints) > self.max_size:
+            self._hints.popitem(last=False)
+
+    def clear(self) -> None:
+        self._hints.clear()
+
+
+class PartitionTokenCountCache:
+    """
+    Token counts of the partitions of messages keyed by the hash
+    of the conversation prefix ending with the partition.
+    """
+
+    max_size: int
+    _counts: OrderedDict[str, int]
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._counts = OrderedDict()
+
+    def get(self, scope: str, prefix_hash: str) -> Optional[int]:
+        key = f"{scope}:{prefix_hash}"
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts.move_to_end(key)
+        return count
+
+    def set(self, scope: str, prefix_hash: str, count: int) -> None:
+        if self.max_size <= 0:
+            return
+
+        key = f"{scope}:{prefix_hash}"
+        self._counts[key] = count
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.max_size:
+            self._counts.popitem(last=False)
+
+    def clear(self) -> None:
+        self._counts.clear()
+
+
+def _get_key(scope: str, user_limit: int, prefix_hash: str) -> str:
+    return f"{scope}:{user_limit}:{prefix_hash}"
+
+
+def get_prefix_hashes(seed: str, messages: Iterable[object]) -> List[str]:
+    """
+    Returns the hashes of all the prefixes of the list of messages.
+    """
+    hashes: List[str] = []
+    prefix_hash = seed
+    for message in messages:
+        prefix_hash = hashlib.sha256(
+            (prefix_hash + canonical_hash(message)).encode()
+        ).hexdigest()
+        hashes.append(prefix_hash)
+    return hashes
+
+
+truncation_hints = TruncationHintCache(TRUNCATION_HINT_CACHE_SIZE)
+partition_token_counts = PartitionTokenCountCache(TRUNCATION_HINT_CACHE_SIZE)
@@ -1,11 +1,23 @@
 import asyncio
-from typing import List, assert_never
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    assert_never,
+)
 
 from aidial_sdk.chat_completion import ChatCompletion, Request, Response
 from aidial_sdk.chat_completion.request import ChatCompletionRequest
 from aidial_sdk.deployment.from_request_mixin import FromRequestDeploymentMixin
 from aidial_sdk.deployment.tokenize import (
     TokenizeError,
+    TokenizeInput,
     TokenizeInputRequest,
     TokenizeInputString,
     TokenizeOutput,
@@ -24,19 +36,147 @@ from aidial_sdk.exceptions import ResourceNotFoundError
 from typing_extensions import override
 
 from aidial_adapter_vertexai.adapters import get_chat_completion_model
+from aidial_adapter_vertexai.admission import (
+    Ticket,
+    admit,
+    estimate_chat_request_tokens,
+)
 from aidial_adapter_vertexai.chat.chat_completion_adapter import (
     ChatCompletionAdapter,
     TruncatedPrompt,
 )
 from aidial_adapter_vertexai.chat.consumer import ChoiceConsumer
 from aidial_adapter_vertexai.chat.errors import UserError, ValidationError
+from aidial_adapter_vertexai.chat.result import (
+    ChatCompletionResult,
+    ChoiceResult,
+    RecordingConsumer,
+    TeeConsumer,
+)
+from aidial_adapter_vertexai.chat.stream_coalescing import (
+    get_stream_coalescing_config,
+)
 from aidial_adapter_vertexai.chat.tools import ToolsConfig
+from aidial_adapter_vertexai.coalescing import (
+    chat_flights,
+    get_chat_request_key,
+    get_tokenize_input_key,
+    tokenize_flights,
+)
 from aidial_adapter_vertexai.deployments import ChatCompletionDeployment
 from aidial_adapter_vertexai.dial_api.exceptions import dial_exception_decorator
 from aidial_adapter_vertexai.dial_api.request import ModelParameters
-from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+from aidial_adapter_vertexai.response_cache import (
+    RESPONSE_CACHE_REPLAY_CHUNK_SIZE,
+    cache_response,
+    get_cached_response,
+    get_response_cache_key,
+)
+from aidial_adapter_vertexai.semantic_cache import (
+    create_semantic_query,
+    semantic_cache,
+)
+from aidial_adapter_vertexai.telemetry.metrics import (
+    current_deployment,
+    record_token_usage,
+    stream_content_events_histogram,
+)
+from aidial_adapter_vertexai.telemetry.server_timing import (
+    current_server_timing,
+)
+from aidial_adapter_vertexai.telemetry.tracing import tracer
+from aidial_adapter_vertexai.utils.concurrency import gather_with_limit
+from aidial_adapter_vertexai.utils.env import get_env_int
+from aidial_adapter_vertexai.utils.hash import canonical_hash
 from aidial_adapter_vertexai.utils.log_config import app_logger as log
 from aidial_adapter_vertexai.utils.not_implemented import is_implemented
+from aidial_adapter_vertexai.utils.stream_buffer import (
+    STREAM_MAX_PENDING_EVENTS,
+)
+from aidial_adapter_vertexai.utils.timer import Timer
+
+# Maximum number of inputs of a /tokenize or /truncate_prompt request
+# processed concurrently
+TOKENIZE_CONCURRENCY = get_env_int("TOKENIZE_CONCURRENCY", 8)
+
+ChoiceConsumerFactory = Callable[
+    [int], AsyncContextManager[RecordingConsumer | TeeConsumer]
+]
+"""Creates the consumer of the given choice, which records the choice result"""
+
+
+async def _admit_chat_request(request: Request) -> Ticket:
+    return await admit(
+        request.deployment_id,
+        request.api_key,
+        estimate_chat_request_tokens(request),
+    )
+
+
+@asynccontextmanager
+async def _record_choice(choice_idx: int) -> AsyncIterator[RecordingConsumer]:
+    yield RecordingConsumer()
+
+
+class _PromptParser:
+    """
+    Parses the prompts of a batch of inputs.
+    The inputs with the same messages and tools share the parsed prompt.
+    """
+
+    model: ChatCompletionAdapter
+    _prompts: Dict[str, asyncio.Task[Any]]
+
+    def __init__(self, model: ChatCompletionAdapter):
+        self.model = model
+        self._prompts = {}
+
+    async def parse(self, request: ChatCompletionRequest) -> Any:
+        key = canonical_hash(
+            request.dict(
+                include={
+                    "messages",
+                    "tools",
+                    "tool_choice",
+                    "functions",
+                    "function_call",
+                }
+            )
+        )
+
+        task = self._prompts.get(key)
+        if task is None:
+            task = self._prompts[key] = asyncio.ensure_future(
+                self._parse(request)
+            )
+
+        return await asyncio.shield(task)
+
+    async def _parse(self, request: ChatCompletionRequest) -> Any:
+        return await _parse_prompt(self.model, request)
+
+
+async def _parse_prompt(
+    model: ChatCompletionAdapter, request: ChatCompletionRequest
+) -> Any:
+    tools = ToolsConfig.from_request(request)
+
+    with (
+        tracer.start_as_current_span(
+            "parse_prompt",
+            attributes={
+                "deployment": current_deployment.get(),
+                "messages.count": len(request.messages),
+                "tools.count": len(tools.functions),
+            },
+        ),
+        Timer("parse_prompt timing: {time}", log.debug, stage="parse"),
+    ):
+        prompt = await model.parse_prompt(tools, request.messages)
+
+    if isinstance(prompt, UserError):
+        raise prompt
+    return prompt
 
 
 class VertexAIChatCompletion(ChatCompletion):
@@ -50,18 +190,51 @@ class VertexAIChatCompletion(ChatCompletion):
 
     @dial_exception_decorator
     async def chat_completion(self, request: Request, response: Response):
-        model = await self._get_model(request)
-        tools = ToolsConfig.from_request(request)
-        prompt = await model.parse_prompt(tools, request.messages)
+        current_deployment.set(request.deployment_id)
+        params = ModelParameters.create(request)
+
+        try:
+            query = await create_semantic_query(request, params)
+            if query is not None:
+                result = semantic_cache.lookup(query)
+                if result is not None:
+                    await self._replay(params, result, response)
+                    return
 
-        if isinstance(prompt, UserError):
+            key = get_chat_request_key(request, params)
+            if key is None:
+                result = await self._chat_completion(request, params, response)
+            else:
+                result = await chat_flights.do(
+                    key, lambda: self._record_chat_completion(request, params)
+                )
+                await result.replay(response)
+
+            if query is not None:
+                semantic_cache.store(query, result)
+        except UserError as e:
             # Show a usage in a stage to educate a chat user
-            await prompt.report_usage(response)
+            await e.report_usage(response)
 
             # Raise an exception for an API client
-            raise prompt
+            raise e
 
-        params = ModelParameters.create(request)
+    @staticmethod
+    async def _replay(
+        params: ModelParameters,
+        result: ChatCompletionResult,
+        response: Response,
+    ) -> None:
+        await result.replay(
+            response,
+            RESPONSE_CACHE_REPLAY_CHUNK_SIZE if params.stream else None,
+        )
+
+    async def _prepare_prompt(
+        self, request: Request, params: ModelParameters
+    ) -> Tuple[ChatCompletionAdapter, TruncatedPrompt, int]:
+        model = await self._get_model(request)
+        prompt = await _parse_prompt(model, request)
 
         # Currently n>1 is emulated by calling the model n times
         n = params.n or 1
@@ -79,37 +252,150 @@ class VertexAIChatCompletion(ChatCompletion):
                 raise ValidationError(
                     "max_prompt_tokens request parameter is not supported"
                 )
-            truncated_prompt = await model.truncate_prompt(
-                prompt, params.max_prompt_tokens
-            )
+            with Timer(
+                "truncate_prompt timing: {time}", log.debug, stage="truncate"
+            ):
+                truncated_prompt = await model.truncate_prompt(
+                    prompt, params.max_prompt_tokens
+                )
 
-        async def generate_response(usage: TokenUsage, choice_idx: int) -> None:
+        return model, truncated_prompt, n
+
+    async def _chat_completion(
+        self, request: Request, params: ModelParameters, response: Response
+    ) -> ChatCompletionResult:
+        coalescing = get_stream_coalescing_config(request)
+
+        @asynccontextmanager
+        async def stream_choice(choice_idx: int) -> AsyncIterator[TeeConsumer]:
             choice = response.create_choice()
             choice.open()
 
-            consumer = ChoiceConsumer(choice)
-            await model.chat(params, consumer, truncated_prompt.prompt)
-            usage.accumulate(consumer.usage)
+            choice_consumer = ChoiceConsumer(
+                choice,
+                coalescing,
+                wait_for_client=response.aflush if params.stream else None,
+                max_pending_events=STREAM_MAX_PENDING_EVENTS,
+            )
+            try:
+                yield TeeConsumer(choice_consumer)
+            finally:
+                choice_consumer.flush()
+
+            if params.stream:
+                stream_content_events_histogram.record(
+                    choice_consumer.content_events,
+                    {
+                        "deployment": request.deployment_id,
+                        "coalescing": coalescing is not None,
+                    },
+                )
+
+            timing = current_server_timing.get()
+            if params.stream and timing is not None:
+                with choice.create_stage("Timing") as stage:
+                    stage.append_content(timing.to_markdown())
 
-            finish_reason = consumer.finish_reason
+            finish_reason = choice_consumer.finish_reason
             log.debug(f"finish_reason[{choice_idx}]: {finish_reason}")
             choice.close(finish_reason)
 
-        usage = TokenUsage()
+        result, generated = await self._generate(request, params, stream_choice)
+        if not generated:
+            await self._replay(params, result, response)
+            return result
 
-        await asyncio.gather(
-            *(generate_response(usage, idx) for idx in range(n))
-        )
-
-        log.debug(f"usage: {usage}")
+        usage = result.usage
         response.set_usage(usage.prompt_tokens, usage.completion_tokens)
 
+        if result.discarded_messages is not None:
+            response.set_discarded_messages(result.discarded_messages)
+
+        return result
+
+    async def _record_chat_completion(
+        self, request: Request, params: ModelParameters
+    ) -> ChatCompletionResult:
+        result, _ = await self._generate(request, params, _record_choice)
+        return result
+
+    async def _generate(
+        self,
+        request: Request,
+        params: ModelParameters,
+        create_consumer: ChoiceConsumerFactory,
+    ) -> Tuple[ChatCompletionResult, bool]:
+        """
+        Generates the completion unless it's found in the response cache.
+        The output of the model for every choice is passed
+        to the consumer created for the choice.
+
+        Returns the result and whether it was generated.
+        """
+        ticket: Optional[Ticket] = None
         if params.max_prompt_tokens is not None:
-            response.set_discarded_messages(truncated_prompt.discarded_messages)
+            # The truncation counts the tokens of the prompt with Vertex AI
+            ticket = await _admit_chat_request(request)
+
+        # The unused part of the estimation is given back to the token bucket
+        used_tokens = 0
+        try:
+            model, truncated_prompt, n = await self._prepare_prompt(
+                request, params
+            )
+            discarded_messages = _get_discarded_messages(
+                params, truncated_prompt
+            )
+
+            cache_key = get_response_cache_key(
+                request.deployment_id, params, n, truncated_prompt.prompt
+            )
+            result = await get_cached_response(request.deployment_id, cache_key)
+            if result is not None:
+                result.discarded_messages = discarded_messages
+                return result, False
+
+            if ticket is None:
+                ticket = await _admit_chat_request(request)
+
+            async def generate_choice(choice_idx: int) -> ChoiceResult:
+                async with create_consumer(choice_idx) as consumer:
+                    await model.chat(
+                        params,
+                        consumer,
+                        truncated_prompt.prompt,
+                        truncated_prompt.prompt_tokens,
+                    )
+                return consumer.result
+
+            # The prompt is sent to Vertex AI even if the generation fails
+            used_tokens = (truncated_prompt.prompt_tokens or 0) * n
+            result = ChatCompletionResult(
+                choices=await asyncio.gather(
+                    *(generate_choice(idx) for idx in range(n))
+                ),
+                discarded_messages=discarded_messages,
+            )
+
+            usage = result.usage
+            used_tokens = usage.total_tokens
+        finally:
+            if ticket is not None:
+                ticket.settle(used_tokens)
+
+        log.debug(f"usage: {usage}")
+        record_token_usage(
+            request.deployment_id, usage.prompt_tokens, usage.completion_tokens
+        )
+
+        await cache_response(cache_key, result)
+
+        return result, True
 
     @override
     @dial_exception_decorator
     async def tokenize(self, request: TokenizeRequest) -> TokenizeResponse:
+        current_deployment.set(request.deployment_id)
         model = await self._get_model(request)
 
         if not is_implemented(
@@ -117,21 +403,35 @@ class VertexAIChatCompletion(ChatCompletion):
         ) or not is_implemented(model.count_prompt_tokens):
             raise ResourceNotFoundError("The endpoint is not implemented")
 
-        outputs: List[TokenizeOutput] = []
-        for input in request.inputs:
-            match input:
-                case TokenizeInputRequest():
-                    outputs.append(
-                        await self._tokenize_request(model, input.value)
-                    )
-                case TokenizeInputString():
-                    outputs.append(
-                        await self._tokenize_string(model, input.value)
-                    )
-                case _:
-                    assert_never(input.type)
+        parser = _PromptParser(model)
+
+        async def _tokenize(input: TokenizeInput) -> TokenizeOutput:
+            key = get_tokenize_input_key(
+                request.deployment_id, request.api_key, input
+            )
+            if key is None:
+                return await self._tokenize_input(parser, input)
+            return await tokenize_flights.do(
+                key, lambda: self._tokenize_input(parser, input)
+            )
+
+        outputs = await gather_with_limit(
+            TOKENIZE_CONCURRENCY,
+            (lambda input=input: _tokenize(input) for input in request.inputs),
+        )
         return TokenizeResponse(outputs=outputs)
 
+    async def _tokenize_input(
+        self, parser: _PromptParser, input: TokenizeInput
+    ) -> TokenizeOutput:
+        match input:
+            case TokenizeInputRequest():
+                return await self._tokenize_request(parser, input.value)
+            case TokenizeInputString():
+                return await self._tokenize_string(parser.model, input.value)
+            case _:
+                assert_never(input.type)
+
     async def _tokenize_string(
         self, model: ChatCompletionAdapter, value: str
     ) -> TokenizeOutput:
@@ -142,15 +442,11 @@ class VertexAIChatCompletion(ChatCompletion):
             return TokenizeError(error=str(e))
 
     async def _tokenize_request(
-        self, model: ChatCompletionAdapter, request: ChatCompletionRequest
+        self, parser: _PromptParser, request: ChatCompletionRequest
     ) -> TokenizeOutput:
         try:
-            tools = ToolsConfig.from_request(request)
-            prompt = await model.parse_prompt(tools, request.messages)
-            if isinstance(prompt, UserError):
-                raise prompt
-
-            token_count = await model.count_prompt_tokens(prompt)
+            prompt = await parser.parse(request)
+            token_count = await parser.model.count_prompt_tokens(prompt)
             return TokenizeSuccess(token_count=token_count)
         except Exception as e:
             return TokenizeError(error=str(e))
@@ -160,27 +456,32 @@ class VertexAIChatCompletion(ChatCompletion):
     async def truncate_prompt(
         self, request: TruncatePromptRequest
     ) -> TruncatePromptResponse:
+        current_deployment.set(request.deployment_id)
         model = await self._get_model(request)
 
         if not is_implemented(model.truncate_prompt):
             raise ResourceNotFoundError("The endpoint is not implemented")
 
-        outputs: List[TruncatePromptResult] = []
-        for input in request.inputs:
-            outputs.append(await self._truncate_prompt_request(model, input))
+        parser = _PromptParser(model)
+
+        outputs: List[TruncatePromptResult] = await gather_with_limit(
+            TOKENIZE_CONCURRENCY,
+            (
+                lambda input=input: self._truncate_prompt_request(parser, input)
+                for input in request.inputs
+            ),
+        )
         return TruncatePromptResponse(outputs=outputs)
 
     async def _truncate_prompt_request(
-        self, model: ChatCompletionAdapter, request: ChatCompletionRequest
+        self, parser: _PromptParser, request: ChatCompletionRequest
     ) -> TruncatePromptResult:
         try:
             if request.max_prompt_tokens is None:
                 raise ValidationError("max_prompt_tokens is required")
 
-            tools = ToolsConfig.from_request(request)
-            prompt = await model.parse_prompt(tools, request.messages)
-
-            truncated_prompt = await model.truncate_prompt(
+            prompt = await parser.parse(request)
+            truncated_prompt = await parser.model.truncate_prompt(
                 prompt, request.max_prompt_tokens
             )
             return TruncatePromptSuccess(
@@ -188,3 +489,11 @@ class VertexAIChatCompletion(ChatCompletion):
             )
         except Exception as e:
             return TruncatePromptError(error=str(e))
+
+
+def _get_discarded_messages(
+    params: ModelParameters, truncated_prompt: TruncatedPrompt
+) -> List[int] | None:
+    if params.max_prompt_tokens is None:
+        return None
+    return truncated_prompt.discarded_messages
@@ -0,0 +1,94 @@
+"""
+Coalescing of identical concurrent requests.
+
+RAG pipelines and evaluation jobs often send byte-identical requests
+at the same moment. When such a request is deterministic, the duplicates
+join the request which is already in flight and share its result
+instead of calling Vertex AI once more.
+
+The API key is a part of the request key, since the response depends
+on the files the key has access to.
+"""
+
+import json
+import os
+from typing import List, Optional
+
+from aidial_sdk.chat_completion import Request as ChatCompletionRequest
+from aidial_sdk.deployment.tokenize import TokenizeInput, TokenizeOutput
+from aidial_sdk.embeddings import Request as EmbeddingsRequest
+from aidial_sdk.embeddings import Response as EmbeddingsResponse
+
+from aidial_adapter_vertexai.chat.result import ChatCompletionResult
+from aidial_adapter_vertexai.dial_api.request import ModelParameters
+from aidial_adapter_vertexai.utils.env import get_env_bool
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+from aidial_adapter_vertexai.utils.single_flight import SingleFlight
+
+REQUEST_COALESCING = get_env_bool("REQUEST_COALESCING", True)
+
+# JSON list of the chat deployments whose requests are coalesced
+# even when they are not deterministic (temperature > 0)
+COALESCING_DEPLOYMENTS: List[str] = json.loads(
+    os.getenv("COALESCING_DEPLOYMENTS", "[]")
+)
+
+# The fields which don't affect the response
+_TRANSPORT_FIELDS = {
+    "api_key_secret",
+    "jwt_secret",
+    "deployment_id",
+    "api_version",
+    "headers",
+    "original_request",
+}
+
+chat_flights: SingleFlight[ChatCompletionResult] = SingleFlight("chat")
+tokenize_flights: SingleFlight[TokenizeOutput] = SingleFlight("tokenize")
+embeddings_flights: SingleFlight[EmbeddingsResponse] = SingleFlight(
+    "embeddings"
+)
+
+
+def get_chat_request_key(
+    request: ChatCompletionRequest, params: ModelParameters
+) -> Optional[str]:
+    """
+    Returns None when the request must not be coalesced.
+    """
+    if not REQUEST_COALESCING or params.stream:
+        return None
+
+    if (
+        params.temperature != 0
+        and request.deployment_id not in COALESCING_DEPLOYMENTS
+    ):
+        return None
+
+    return canonical_hash(
+        "chat",
+        request.deployment_id,
+        request.api_key,
+        request.dict(exclude=_TRANSPORT_FIELDS),
+    )
+
+
+def get_tokenize_input_key(
+    deployment_id: str, api_key: str, input: TokenizeInput
+) -> Optional[str]:
+    if not REQUEST_COALESCING:
+        return None
+
+    return canonical_hash("tokenize", deployment_id, api_key, input)
+
+
+def get_embeddings_request_key(request: EmbeddingsRequest) -> Optional[str]:
+    if not REQUEST_COALESCING:
+        return None
+
+    return canonical_hash(
+        "embeddings",
+        request.deployment_id,
+        request.api_key,
+        request.dict(exclude=_TRANSPORT_FIELDS),
+    )
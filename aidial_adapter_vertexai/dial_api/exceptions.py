@@ -1,7 +1,12 @@
+import math
 from functools import wraps
+from typing import Dict
 
 from aidial_sdk.exceptions import HTTPException as DialException
 from aidial_sdk.exceptions import InternalServerError, InvalidRequestError
+from fastapi import HTTPException as FastAPIException
+from fastapi import Request
+from fastapi.responses import JSONResponse
 from google.api_core.exceptions import (
     GoogleAPICallError,
     InvalidArgument,
@@ -10,9 +15,62 @@ from google.api_core.exceptions import (
 from google.auth.exceptions import GoogleAuthError
 
 from aidial_adapter_vertexai.chat.errors import UserError, ValidationError
+from aidial_adapter_vertexai.telemetry.metrics import (
+    current_deployment,
+    error_counter,
+)
 from aidial_adapter_vertexai.utils.log_config import app_logger as log
 
 
+class RateLimitError(DialException):
+    """
+    The request is rejected before reaching Vertex AI,
+    because the deployment is overloaded.
+    The client is advised to retry after `retry_after` seconds.
+    """
+
+    retry_after: float
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(
+            message=message,
+            status_code=429,
+            type="rate_limit_exceeded",
+            code="rate_limit_exceeded",
+        )
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(math.ceil(self.retry_after))}
+
+    def to_fastapi_response(self) -> JSONResponse:
+        response = super().to_fastapi_response()
+        response.headers.update(self.headers)
+        return response
+
+    def to_fastapi_exception(self) -> FastAPIException:
+        # The chat completion endpoint raises the exception
+        # instead of returning the response
+        return FastAPIException(
+            status_code=self.status_code,
+            detail=self.json_error(),
+            headers=self.headers,
+        )
+
+
+def fastapi_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+    """
+    Replaces the handler of the SDK, which drops the headers of the exception.
+    """
+    assert isinstance(exc, FastAPIException)
+    return JSONResponse(
+        status_code=exc.status_code,
+        content=exc.detail,
+        headers=exc.headers,
+    )
+
+
 def to_dial_exception(e: Exception) -> DialException:
     if isinstance(e, GoogleAuthError):
         return DialException(
@@ -74,6 +132,15 @@ def dial_exception_decorator(func):
             log.exception(
                 f"caught exception: {type(e).__module__}.{type(e).__name__}"
             )
-            raise to_dial_exception(e) from e
+            dial_exception = to_dial_exception(e)
+            error_counter.add(
+                1,
+                {
+                    "deployment": current_deployment.get(),
+                    "error": type(e).__name__,
+                    "status_code": dial_exception.status_code,
+                },
+            )
+            raise dial_exception from e
 
     return wrapper
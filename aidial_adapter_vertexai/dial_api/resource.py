@@ -7,6 +7,9 @@ from aidial_sdk.chat_completion import Attachment
 from pydantic import BaseModel, Field, root_validator, validator
 
 from aidial_adapter_vertexai.dial_api.storage import FileStorage, download_file
+from aidial_adapter_vertexai.telemetry.traffic_capture import (
+    record_attachment_size,
+)
 from aidial_adapter_vertexai.utils.resource import Resource
 from aidial_adapter_vertexai.utils.text import truncate_string
 
@@ -173,9 +176,11 @@ class AttachmentResource(DialResource):
 
 async def _download_url(file_storage: FileStorage | None, url: str) -> bytes:
     if (resource := Resource.from_data_url(url)) is not None:
-        return resource.data
-
-    if file_storage:
-        return await file_storage.download_file(url)
+        data = resource.data
+    elif file_storage:
+        data = await file_storage.download_file(url)
     else:
-        return await download_file(url)
+        data = await download_file(url)
+
+    record_attachment_size(url, len(data))
+    return data
@@ -1,14 +1,22 @@
+import asyncio
 import hashlib
 import io
 import mimetypes
 import os
-from typing import Mapping, Optional, TypedDict
+from typing import Dict, Mapping, Optional, TypedDict
 from urllib.parse import unquote, urljoin
 
 import aiohttp
-from pydantic import BaseModel
-
+from pydantic import BaseModel, PrivateAttr
+
+from aidial_adapter_vertexai.telemetry.metrics import (
+    attachment_download_duration_histogram,
+    attachment_download_size_histogram,
+    current_deployment,
+)
+from aidial_adapter_vertexai.telemetry.tracing import tracer
 from aidial_adapter_vertexai.utils.log_config import app_logger as log
+from aidial_adapter_vertexai.utils.timer import Timer
 
 
 class FileMetadata(TypedDict):
@@ -28,6 +36,12 @@ class FileStorage(BaseModel):
     api_key: str
     bucket: Optional[Bucket] = None
 
+    # The storage is created per request, so the files referenced
+    # multiple times in the request are downloaded only once
+    _downloads: Dict[str, asyncio.Task[bytes]] = PrivateAttr(
+        default_factory=dict
+    )
+
     @property
     def auth_headers(self) -> Mapping[str, str]:
         return {"api-key": self.api_key}
@@ -96,10 +110,27 @@ class FileStorage(BaseModel):
 
     async def download_file(self, link: str) -> bytes:
         url = self.attachment_link_to_url(link)
-        headers: Mapping[str, str] = {}
-        if url.lower().startswith(self.dial_url.lower()):
-            headers = self.auth_headers
-        return await download_file(url, headers)
+
+        task = self._downloads.get(url)
+        if task is None:
+            headers: Mapping[str, str] = {}
+            if url.lower().startswith(self.dial_url.lower()):
+                headers = self.auth_headers
+
+            task = self._downloads[url] = asyncio.ensure_future(
+                download_file(url, headers)
+            )
+            task.add_done_callback(lambda _: self._forget_failed(url, task))
+        else:
+            log.debug(f"reusing the download of {url}")
+
+        return await asyncio.shield(task)
+
+    def _forget_failed(self, url: str, task: asyncio.Task[bytes]) -> None:
+        if (
+            task.cancelled() or task.exception() is not None
+        ) and self._downloads.get(url) is task:
+            del self._downloads[url]
 
     async def get_human_readable_name(self, link: str) -> str:
         url = self.attachment_link_to_url(link)
@@ -119,10 +150,22 @@ class FileStorage(BaseModel):
 
 
 async def download_file(url: str, headers: Mapping[str, str] = {}) -> bytes:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            response.raise_for_status()
-            return await response.read()
+    attributes = {"deployment": current_deployment.get()}
+    with tracer.start_as_current_span("attachment.download") as span, Timer(
+        "download timing: {time}",
+        log.debug,
+        attachment_download_duration_histogram,
+        attributes,
+        stage="download",
+    ):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                content = await response.read()
+        span.set_attribute("attachment.size", len(content))
+
+    attachment_download_size_histogram.record(len(content), attributes)
+    return content
 
 
 def compute_hash_digest(file_content: str) -> str:
@@ -1,5 +1,5 @@
-from logging import DEBUG
-from typing import AsyncIterator, Callable, List, Tuple
+import asyncio
+from typing import AsyncIterator, Awaitable, List, Tuple
 
 from aidial_sdk.chat_completion.request import Attachment
 from aidial_sdk.embeddings import Response as EmbeddingsResponse
@@ -26,9 +26,14 @@ from aidial_adapter_vertexai.embedding.types import (
     make_embeddings_response,
     vector_to_embedding,
 )
-from aidial_adapter_vertexai.utils.concurrency import gather_sync
-from aidial_adapter_vertexai.utils.json import json_dumps_short
+from aidial_adapter_vertexai.telemetry.metrics import (
+    embeddings_batch_duration_histogram,
+)
+from aidial_adapter_vertexai.utils.concurrency import make_async
+from aidial_adapter_vertexai.utils.json import LazyJson
 from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
+from aidial_adapter_vertexai.utils.retry import call_with_retries
+from aidial_adapter_vertexai.utils.timer import Timer
 from aidial_adapter_vertexai.vertex_ai import get_multi_modal_embedding_model
 
 # See the documentation: https://cloud.google.com/vertex-ai/generative-ai/docs/model-reference/multimodal-embeddings-api
@@ -76,15 +81,17 @@ def compute_embeddings(
     dimensions: int | None,
 ) -> Tuple[Embedding, int]:
 
-    if log.isEnabledFor(DEBUG):
-        msg = json_dumps_short(
+    log.debug(
+        "request: %s",
+        LazyJson(
             {
                 "image": request.image,
                 "contextual_text": request.contextual_text,
                 "dimension": dimensions,
-            }
-        )
-        log.debug(f"request: {msg}")
+            },
+            short=True,
+        ),
+    )
 
     response: MultiModalEmbeddingResponse = model.get_embeddings(
         image=request.image,
@@ -92,9 +99,7 @@ def compute_embeddings(
         dimension=dimensions,
     )
 
-    if log.isEnabledFor(DEBUG):
-        msg = json_dumps_short(response)
-        log.debug(f"response: {msg}")
+    log.debug("response: %s", LazyJson(response, short=True, frozen=True))
 
     vec, tokens = request.extract_embeddings(response)
 
@@ -195,22 +200,36 @@ class MultiModalEmbeddingsAdapter(EmbeddingsAdapter):
 
         base64_encode = request.encoding_format == "base64"
 
+        async def embed(sub_request: ModelRequest) -> Tuple[Embedding, int]:
+            with Timer(
+                "embeddings timing: {time}",
+                log.debug,
+                embeddings_batch_duration_histogram,
+                {"deployment": self.model_id},
+            ):
+                return await call_with_retries(
+                    lambda: make_async(
+                        lambda _: compute_embeddings(
+                            sub_request,
+                            self.model,
+                            base64_encode=base64_encode,
+                            dimensions=request.dimensions,
+                        ),
+                        (),
+                    ),
+                    operation="embeddings",
+                    deployment=self.model_id,
+                )
+
         # NOTE: The model doesn't support batched inputs
-        tasks: List[Callable[[], Tuple[Embedding, int]]] = []
+        tasks: List[Awaitable[Tuple[Embedding, int]]] = []
         async for sub_request in await get_requests(self.storage, request):
-            tasks.append(
-                lambda sub_req=sub_request: compute_embeddings(
-                    sub_req,
-                    self.model,
-                    base64_encode=base64_encode,
-                    dimensions=request.dimensions,
-                )
-            )
+            tasks.append(embed(sub_request))
 
         embeddings: List[Embedding] = []
         total_tokens = 0
 
-        for embedding, tokens in await gather_sync(tasks):
+        for embedding, tokens in await asyncio.gather(*tasks):
             embeddings.append(embedding)
             total_tokens += tokens
 
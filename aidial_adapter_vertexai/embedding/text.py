@@ -1,5 +1,4 @@
-from logging import DEBUG
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, cast
 
 from aidial_sdk.embeddings import Response as EmbeddingsResponse
 from aidial_sdk.embeddings.request import EmbeddingsRequest
@@ -20,9 +19,14 @@ from aidial_adapter_vertexai.embedding.types import (
     make_embeddings_response,
     vector_to_embedding,
 )
+from aidial_adapter_vertexai.telemetry.metrics import (
+    embeddings_batch_duration_histogram,
+)
 from aidial_adapter_vertexai.utils.concurrency import make_async
-from aidial_adapter_vertexai.utils.json import json_dumps_short
+from aidial_adapter_vertexai.utils.json import LazyJson
 from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
+from aidial_adapter_vertexai.utils.retry import call_with_retries
+from aidial_adapter_vertexai.utils.timer import Timer
 from aidial_adapter_vertexai.vertex_ai import (
     TextEmbeddingModel,
     get_text_embedding_model,
@@ -69,29 +73,47 @@ specs: Dict[str, ModelSpec] = {
 
 
 async def compute_embeddings(
+    model_id: str,
     model: TextEmbeddingModel,
     base64_encode: bool,
     dimensions: int | None,
     inputs: List[str | TextEmbeddingInput],
 ) -> Tuple[List[Embedding], int]:
 
-    if log.isEnabledFor(DEBUG):
-        msg = json_dumps_short(
-            {"inputs": inputs, "output_dimensionality": dimensions}
+    log.debug(
+        "request: %s",
+        LazyJson(
+            {"inputs": inputs, "output_dimensionality": dimensions}, short=True
+        ),
+    )
+
+    with Timer(
+        "embeddings timing: {time}",
+        log.debug,
+        embeddings_batch_duration_histogram,
+        {"deployment": model_id},
+    ):
+        response = await call_with_retries(
+            lambda: make_async(
+                lambda _: model.get_embeddings(
+                    inputs, output_dimensionality=dimensions
+                ),
+                (),
+            ),
+            operation="embeddings",
+            deployment=model_id,
         )
-        log.debug(f"request: {msg}")
 
-    response = await make_async(
-        lambda _: model.get_embeddings(
-            inputs, output_dimensionality=dimensions
+    log.debug(
+        "response: %s",
+        LazyJson(
+            response,
+            short=True,
+            frozen=True,
+            excluded_keys=["_prediction_response"],
         ),
-        (),
     )
 
-    if log.isEnabledFor(DEBUG):
-        msg = json_dumps_short(response, excluded_keys=["_prediction_response"])
-        log.debug(f"response: {msg}")
-
     embeddings: List[Embedding] = []
     tokens = 0
 
@@ -181,7 +203,11 @@ class TextEmbeddingsAdapter(EmbeddingsAdapter):
         base64_encode = request.encoding_format == "base64"
 
         embeddings, tokens = await compute_embeddings(
-            self.model, base64_encode, request.dimensions, inputs
+            self.model_id,
+            self.model,
+            base64_encode,
+            request.dimensions,
+            inputs,
         )
 
         return make_embeddings_response(
@@ -189,3 +215,24 @@ class TextEmbeddingsAdapter(EmbeddingsAdapter):
             embeddings=embeddings,
             tokens=tokens,
         )
+
+    async def embed_texts(
+        self, texts: List[str], task_type: Optional[str] = None
+    ) -> List[List[float]]:
+        """
+        Embeddings of the texts for the internal use by the adapter.
+        """
+        spec = specs.get(self.model_id)
+        inputs: List[str | TextEmbeddingInput] = (
+            [
+                TextEmbeddingInput(text=text, task_type=task_type)
+                for text in texts
+            ]
+            if task_type is not None and spec is not None and spec.supports_type
+            else list(texts)
+        )
+
+        embeddings, _tokens = await compute_embeddings(
+            self.model_id, self.model, False, None, inputs
+        )
+        return cast(List[List[float]], embeddings)
@@ -1,17 +1,48 @@
 from aidial_sdk.embeddings import Embeddings, Request, Response
 
 from aidial_adapter_vertexai.adapters import get_embeddings_model
+from aidial_adapter_vertexai.admission import (
+    admit,
+    estimate_embeddings_request_tokens,
+)
+from aidial_adapter_vertexai.coalescing import (
+    embeddings_flights,
+    get_embeddings_request_key,
+)
 from aidial_adapter_vertexai.deployments import EmbeddingsDeployment
 from aidial_adapter_vertexai.dial_api.exceptions import dial_exception_decorator
+from aidial_adapter_vertexai.telemetry.metrics import (
+    current_deployment,
+    record_token_usage,
+)
 
 
 class VertexAIEmbeddings(Embeddings):
     @dial_exception_decorator
     async def embeddings(self, request: Request) -> Response:
+        current_deployment.set(request.deployment_id)
+        key = get_embeddings_request_key(request)
+        if key is None:
+            return await self._embeddings(request)
+        return await embeddings_flights.do(
+            key, lambda: self._embeddings(request)
+        )
+
+    async def _embeddings(self, request: Request) -> Response:
+        ticket = await admit(
+            request.deployment_id,
+            request.api_key,
+            estimate_embeddings_request_tokens(request),
+        )
 
         model = await get_embeddings_model(
             deployment=EmbeddingsDeployment(request.deployment_id),
             api_key=request.api_key,
         )
 
-        return await model.embeddings(request)
+        response = await model.embeddings(request)
+        ticket.settle(response.usage.total_tokens)
+        record_token_usage(
+            request.deployment_id, response.usage.prompt_tokens, 0
+        )
+        return response
@@ -0,0 +1,224 @@
+"""
+Hedged requests to Vertex AI.
+
+When the first chunk of a response doesn't arrive within the given percentile
+of the recently observed time-to-first-chunk, an identical request is sent
+(possibly to another region) and the response which starts streaming first
+is used, while the other one is cancelled.
+
+The share of the hedged requests is limited per deployment,
+so that the extra cost stays bounded: at most `max_rate` of the requests
+and `max_rate * window` of them in a burst.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Generic,
+    Optional,
+    TypeVar,
+)
+
+from pydantic import BaseModel
+
+from aidial_adapter_vertexai.telemetry.metrics import hedge_counter
+from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
+from aidial_adapter_vertexai.utils.retry import RetryBudget
+
+T = TypeVar("T")
+
+
+class HedgingConfig(BaseModel):
+    percentile: float = 95.0
+    """Percentile of the time-to-first-chunk after which a request is hedged"""
+    min_delay: float = 0.0
+    """Lower bound of the hedging delay in seconds"""
+    max_rate: float = 0.05
+    """Maximum share of the hedged requests"""
+    min_samples: int = 20
+    """Number of observations required before hedging is enabled"""
+    window: int = 1000
+    """Number of the most recent observations the percentile is computed over"""
+
+
+# JSON object mapping a deployment name to its hedging configuration, e.g.
+# {"gemini-1.5-pro-002": {"percentile": 95, "max_rate": 0.05}}
+DEPLOYMENT_HEDGING: Dict[str, HedgingConfig] = {
+    deployment: HedgingConfig.parse_obj(config)
+    for deployment, config in json.loads(
+        os.getenv("DEPLOYMENT_HEDGING", "{}")
+    ).items()
+}
+
+
+class LatencyTracker:
+    """
+    Sliding window of the latency observations.
+    """
+
+    samples: Deque[float]
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def get_percentile(self, percentile: float) -> float:
+        samples = sorted(self.samples)
+        index = round(percentile / 100 * (len(samples) - 1))
+        return samples[min(max(index, 0), len(samples) - 1)]
+
+
+class _Attempt(Generic[T]):
+    """
+    A stream whose first element is being awaited in a background task.
+    """
+
+    def __init__(self, stream: AsyncIterator[T]):
+        self.stream = stream
+        self.started_at = time.monotonic()
+        self.first = asyncio.ensure_future(stream.__anext__())
+
+    async def cancel(self) -> None:
+        self.first.cancel()
+        await asyncio.gather(self.first, return_exceptions=True)
+        try:
+            await self.stream.aclose()  # type: ignore
+        except Exception:
+            pass
+
+
+class Hedger:
+    deployment: str
+    config: HedgingConfig
+    latency: LatencyTracker
+    budget: RetryBudget
+
+    def __init__(self, deployment: str, config: HedgingConfig):
+        self.deployment = deployment
+        self.config = config
+        self.latency = LatencyTracker(config.window)
+        # The hedges saved up while the latency was low mustn't fire at once
+        # when it goes up, so the burst is limited by the share of
+        # the hedged requests over the window
+        self.budget = RetryBudget(
+            ratio=config.max_rate,
+            min_per_second=0.0,
+            capacity=max(1.0, config.max_rate * config.window),
+        )
+
+    def get_delay(self) -> Optional[float]:
+        if len(self.latency.samples) < self.config.min_samples:
+            return None
+        return max(
+            self.config.min_delay,
+            self.latency.get_percentile(self.config.percentile),
+        )
+
+    async def stream(
+        self, generator: Callable[[], AsyncIterator[T]]
+    ) -> AsyncIterator[T]:
+        """
+        Each call of the generator must start an identical request.
+        """
+        self.budget.deposit()
+        attributes = {"deployment": self.deployment}
+
+        primary = _Attempt(generator())
+        winner = primary
+        hedge: _Attempt[T] | None = None
+
+        try:
+            delay = self.get_delay()
+            if delay is not None:
+                await asyncio.wait([primary.first], timeout=delay)
+
+                if not primary.first.done():
+                    if self.budget.try_withdraw():
+                        log.debug(
+                            f"no response within {delay:.3f}s, hedging the request"
+                        )
+                        hedge = _Attempt(generator())
+                        winner = await self._race(primary, hedge)
+                    else:
+                        hedge_counter.add(
+                            1, {**attributes, "outcome": "budget_exhausted"}
+                        )
+
+            try:
+                first = await winner.first
+            except StopAsyncIteration:
+                empty = True
+            else:
+                empty = False
+                self.latency.record(time.monotonic() - primary.started_at)
+
+            if hedge is not None:
+                outcome = "won" if winner is hedge else "lost"
+                hedge_counter.add(1, {**attributes, "outcome": outcome})
+
+        except BaseException:
+            await primary.cancel()
+            if hedge is not None:
+                await hedge.cancel()
+            raise
+
+        loser = primary if winner is hedge else hedge
+        if loser is not None:
+            await loser.cancel()
+
+        if empty:
+            return
+
+        yield first
+        async for item in winner.stream:
+            yield item
+
+    @staticmethod
+    async def _race(primary: _Attempt[T], hedge: _Attempt[T]) -> _Attempt[T]:
+        """
+        Returns the attempt which succeeded first or
+        the primary attempt if both failed.
+        """
+        pending = {primary.first, hedge.first}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for attempt in [primary, hedge]:
+                if attempt.first in done and not _has_failed(attempt.first):
+                    return attempt
+        return primary
+
+
+def _has_failed(task: asyncio.Future) -> bool:
+    error = task.exception()
+    return error is not None and not isinstance(error, StopAsyncIteration)
+
+
+_hedgers: Dict[str, Hedger] = {}
+
+
+def hedged_stream(
+    deployment: str, generator: Callable[[], AsyncIterator[T]]
+) -> Callable[[], AsyncIterator[T]]:
+    """
+    Returns the stream which is hedged according to the deployment configuration.
+    """
+    config = DEPLOYMENT_HEDGING.get(deployment)
+    if config is None:
+        return generator
+
+    if deployment not in _hedgers:
+        _hedgers[deployment] = Hedger(deployment, config)
+    hedger = _hedgers[deployment]
+
+    return lambda: hedger.stream(generator)
@@ -0,0 +1,301 @@
+"""
+Routing of Vertex AI requests between several regions.
+
+Each deployment could be served from a list of regions.
+The router picks the region with the lowest expected latency
+taking into account recent failures (e.g. exhausted quota) in the region.
+The regions which fail repeatedly are temporarily excluded by circuit breakers.
+"""
+
+import json
+import os
+import random
+import time
+from enum import Enum
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Set,
+    TypeVar,
+    assert_never,
+)
+
+from aidial_adapter_vertexai.telemetry.metrics import region_request_counter
+from aidial_adapter_vertexai.utils.env import (
+    get_env,
+    get_env_float,
+    get_env_int,
+)
+from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
+from aidial_adapter_vertexai.utils.retry import is_transient_error
+
+T = TypeVar("T")
+
+DEFAULT_REGION = get_env("DEFAULT_REGION")
+
+# JSON object mapping a deployment name to the list of its regions, e.g.
+# {"gemini-1.5-pro-002": ["us-central1", "europe-west4"]}
+DEPLOYMENT_REGIONS: Dict[str, List[str]] = json.loads(
+    os.getenv("DEPLOYMENT_REGIONS", "{}")
+)
+
+EWMA_ALPHA = get_env_float("REGION_EWMA_ALPHA", 0.2)
+EXPLORATION_RATE = get_env_float("REGION_EXPLORATION_RATE", 0.05)
+CIRCUIT_BREAKER_THRESHOLD = get_env_int("REGION_CIRCUIT_BREAKER_THRESHOLD", 5)
+CIRCUIT_BREAKER_COOLDOWN = get_env_float(
+    "REGION_CIRCUIT_BREAKER_COOLDOWN", 30.0
+)
+
+# The error rate of 100% makes a region look 10 times slower
+ERROR_RATE_PENALTY = 10.0
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and
+    stays open for `cooldown` seconds.
+    Then a single probe request is allowed (half-open state),
+    which either closes the circuit or opens it again.
+    The probe which hasn't reported back within `cooldown` seconds is considered lost.
+    """
+
+    threshold: int
+    cooldown: float
+
+    state: CircuitState
+    failures: int
+    opened_at: float
+    probed_at: float
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probed_at = 0.0
+
+    def is_available(self) -> bool:
+        now = time.monotonic()
+        match self.state:
+            case CircuitState.CLOSED:
+                return True
+            case CircuitState.OPEN:
+                return now - self.opened_at >= self.cooldown
+            case CircuitState.HALF_OPEN:
+                return now - self.probed_at >= self.cooldown
+            case _:
+                assert_never(self.state)
+
+    def on_request(self) -> None:
+        if self.state != CircuitState.CLOSED and self.is_available():
+            self.state = CircuitState.HALF_OPEN
+            self.probed_at = time.monotonic()
+
+    def on_success(self) -> None:
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.failures >= self.threshold
+        ):
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+
+class RegionStats:
+    latency: float | None
+    """EWMA of the request latency in seconds"""
+    error_rate: float
+    """EWMA of the share of failed requests"""
+    breaker: CircuitBreaker
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.latency = None
+        self.error_rate = 0.0
+        self.breaker = breaker
+
+    def score(self) -> float:
+        # Regions without latency stats are explored first
+        latency = self.latency or 0.0
+        return latency * (1.0 + ERROR_RATE_PENALTY * self.error_rate)
+
+    def record(self, *, latency: float | None, failed: bool) -> None:
+        if latency is not None:
+            self.latency = (
+                latency
+                if self.latency is None
+                else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+            )
+
+        self.error_rate = EWMA_ALPHA * failed + (1 - EWMA_ALPHA) * (
+            self.error_rate
+        )
+
+
+class RegionRouter:
+    deployment: str
+    regions: List[str]
+    stats: Dict[str, RegionStats]
+    exploration_rate: float
+    """Share of requests sent to a random region to keep its stats fresh"""
+
+    def __init__(
+        self,
+        deployment: str,
+        regions: List[str],
+        exploration_rate: float = EXPLORATION_RATE,
+    ):
+        if not regions:
+            raise ValueError("The list of regions must not be empty")
+
+        self.deployment = deployment
+        self.regions = regions
+        self.exploration_rate = exploration_rate
+        self.stats = {
+            region: RegionStats(
+                CircuitBreaker(
+                    CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN
+                )
+            )
+            for region in regions
+        }
+
+    def select(self, exclude: Set[str] | None = None) -> str:
+        """
+        Returns the best region which isn't excluded and
+        whose circuit breaker isn't open.
+        Falls back to the excluded regions and then to the open circuits,
+        since a request attempt is better than a certain failure.
+        """
+        exclude = exclude or set()
+        candidates = [r for r in self.regions if r not in exclude] or list(
+            self.regions
+        )
+
+        available = [
+            r for r in candidates if self.stats[r].breaker.is_available()
+        ]
+
+        if available:
+            if len(available) > 1 and random.random() < self.exploration_rate:
+                region = random.choice(available)
+            else:
+                region = min(available, key=lambda r: self.stats[r].score())
+        else:
+            region = min(
+                candidates, key=lambda r: self.stats[r].breaker.opened_at
+            )
+
+        self.stats[region].breaker.on_request()
+        return region
+
+    def report_success(self, region: str, latency: float | None) -> None:
+        stats = self.stats[region]
+        stats.record(latency=latency, failed=False)
+        stats.breaker.on_success()
+        region_request_counter.add(
+            1,
+            {"deployment": self.deployment, "region": region, "outcome": "ok"},
+        )
+
+    def report_failure(self, region: str, error: Exception) -> None:
+        # Only the errors caused by the region state (quota, availability)
+        # affect the routing. The invalid requests fail in any region,
+        # but such a failure means that the region itself is reachable.
+        if not is_transient_error(error):
+            self.stats[region].breaker.on_success()
+            return
+
+        stats = self.stats[region]
+        stats.record(latency=None, failed=True)
+        stats.breaker.on_failure()
+
+        log.debug(
+            f"region {region!r} failed: {type(error).__name__}, "
+            f"error rate: {stats.error_rate:.2f}, "
+            f"circuit: {stats.breaker.state.value}"
+        )
+        region_request_counter.add(
+            1,
+            {
+                "deployment": self.deployment,
+                "region": region,
+                "outcome": type(error).__name__,
+            },
+        )
+
+
+_routers: Dict[str, RegionRouter] = {}
+
+
+def get_region_router(deployment: str) -> RegionRouter:
+    if deployment not in _routers:
+        regions = DEPLOYMENT_REGIONS.get(deployment) or [DEFAULT_REGION]
+        _routers[deployment] = RegionRouter(deployment, regions)
+    return _routers[deployment]
+
+
+def routed_call(
+    router: RegionRouter, func: Callable[[str], Awaitable[T]]
+) -> Callable[[], Awaitable[T]]:
+    """
+    Returns a call which is made in the region picked by the router.
+    Each subsequent invocation of the call (e.g. a retry) fails over
+    to a region which wasn't tried yet.
+    """
+    tried: Set[str] = set()
+
+    async def call() -> T:
+        region = router.select(exclude=tried)
+        tried.add(region)
+        try:
+            result = await func(region)
+        except Exception as e:
+            router.report_failure(region, e)
+            raise e
+        router.report_success(region, latency=None)
+        return result
+
+    return call
+
+
+def routed_stream(
+    router: RegionRouter, generator: Callable[[str], AsyncIterator[T]]
+) -> Callable[[], AsyncIterator[T]]:
+    """
+    Same as `routed_call`, but for a stream.
+    The time to the first element is reported as the region latency.
+    """
+    tried: Set[str] = set()
+
+    async def stream() -> AsyncIterator[T]:
+        region = router.select(exclude=tried)
+        tried.add(region)
+
+        start = time.monotonic()
+        started = False
+        try:
+            async for item in generator(region):
+                if not started:
+                    started = True
+                    router.report_success(region, time.monotonic() - start)
+                yield item
+        except Exception as e:
+            if not started:
+                router.report_failure(region, e)
+            raise e
+
+    return stream
@@ -0,0 +1,201 @@
+"""
+Cache of the deterministic chat completion responses.
+
+The responses to the requests with zero temperature are stored
+by the hash of the deployment, model parameters and the parsed prompt
+(including the tools). A cached response is replayed to the client
+as if it was generated by the model.
+
+The cache is disabled by default. It's enabled by RESPONSE_CACHE env variable,
+which is either `memory` for an in-process LRU cache or a URL of a shared store
+supported by aiocache, e.g. `redis://localhost:6379/0`.
+"""
+
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from aiocache import Cache
+from pydantic import ValidationError
+
+from aidial_adapter_vertexai.chat.result import ChatCompletionResult
+from aidial_adapter_vertexai.deployments import ChatCompletionDeployment
+from aidial_adapter_vertexai.dial_api.request import ModelParameters
+from aidial_adapter_vertexai.telemetry.metrics import response_cache_counter
+from aidial_adapter_vertexai.utils.env import get_env_int
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE")
+RESPONSE_CACHE_SIZE = get_env_int("RESPONSE_CACHE_SIZE", 1000)
+RESPONSE_CACHE_TTL = get_env_int("RESPONSE_CACHE_TTL", 3600)
+RESPONSE_CACHE_REPLAY_CHUNK_SIZE = get_env_int(
+    "RESPONSE_CACHE_REPLAY_CHUNK_SIZE", 64
+)
+
+# The generated images are stored in the bucket of the user,
+# so they can't be served to the other users.
+NON_CACHEABLE_DEPLOYMENTS = [ChatCompletionDeployment.IMAGEN_005.value]
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:
+        pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """
+    LRU cache in the memory of the server process.
+    """
+
+    max_size: int
+    ttl: float
+    _entries: OrderedDict[str, Tuple[float, str]]
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._clock = clock
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class SharedCacheBackend(CacheBackend):
+    """
+    Cache in a store shared by the adapter replicas.
+    """
+
+    _cache: Any
+    ttl: int
+
+    def __init__(self, url: str, ttl: int):
+        self._cache = Cache.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._cache.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        await self._cache.set(key, value, ttl=self.ttl)
+
+
+class ResponseCache:
+    backend: CacheBackend
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    async def get(
+        self, deployment: str, key: str
+    ) -> Optional[ChatCompletionResult]:
+        attributes = {"deployment": deployment}
+
+        try:
+            value = await self.backend.get(key)
+            result = (
+                None if value is None else ChatCompletionResult.parse_raw(value)
+            )
+        except (ValidationError, ValueError) as e:
+            log.warning(f"invalid response cache entry: {e}")
+            result = None
+        except Exception as e:
+            # The cache is an optimization, so its failures aren't fatal
+            log.warning(f"response cache is unavailable: {e}")
+            response_cache_counter.add(1, {**attributes, "outcome": "error"})
+            return None
+
+        outcome = "miss" if result is None else "hit"
+        log.debug(f"response cache {outcome}: {key[:8]}")
+        response_cache_counter.add(1, {**attributes, "outcome": outcome})
+        return result
+
+    async def set(self, key: str, result: ChatCompletionResult) -> None:
+        try:
+            await self.backend.set(
+                key, result.json(exclude={"discarded_messages"})
+            )
+        except Exception as e:
+            log.warning(f"response cache is unavailable: {e}")
+
+
+def _create_response_cache() -> Optional[ResponseCache]:
+    if not RESPONSE_CACHE:
+        return None
+
+    if RESPONSE_CACHE == "memory":
+        backend = InMemoryCacheBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    else:
+        backend = SharedCacheBackend(RESPONSE_CACHE, RESPONSE_CACHE_TTL)
+
+    return ResponseCache(backend)
+
+
+response_cache = _create_response_cache()
+
+
+def get_response_cache_key(
+    deployment: str, params: ModelParameters, n: int, prompt: Any
+) -> Optional[str]:
+    """
+    Returns None when the response must not be cached.
+    """
+    if response_cache is None or deployment in NON_CACHEABLE_DEPLOYMENTS:
+        return None
+
+    if params.temperature != 0:
+        return None
+
+    return canonical_hash(
+        "chat",
+        deployment,
+        # The truncation is already applied to the prompt and
+        # the cached response could be replayed in both streaming modes
+        params.dict(exclude={"n", "stream", "max_prompt_tokens"}),
+        n,
+        prompt,
+    )
+
+
+async def get_cached_response(
+    deployment: str, key: Optional[str]
+) -> Optional[ChatCompletionResult]:
+    if key is None or response_cache is None:
+        return None
+    return await response_cache.get(deployment, key)
+
+
+async def cache_response(
+    key: Optional[str], result: ChatCompletionResult
+) -> None:
+    if key is not None and response_cache is not None:
+        await response_cache.set(key, result)
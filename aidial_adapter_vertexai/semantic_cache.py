@@ -0,0 +1,297 @@
+"""
+Semantic cache of Gemini chat completion responses.
+
+The last user message is embedded by one of the text embedding models and
+compared with the questions answered before. When the similarity is above
+the threshold, the answer to the similar question is returned.
+
+The cached answers are partitioned by the deployment, the system prompt
+and the model parameters. Only the first question of a conversation
+is cached, since the answer to a follow-up question depends on the history.
+The questions with attachments, tools or a prompt token limit bypass
+the cache, and so do all the questions while the embedding model
+is unavailable.
+
+The cache is disabled by default. It's enabled for the Gemini deployments
+listed in SEMANTIC_CACHE_DEPLOYMENTS env variable.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple, get_args
+
+import numpy as np
+from aidial_sdk.chat_completion import FinishReason, Request, Role
+from aidial_sdk.chat_completion.request import ChatCompletionRequest
+from pydantic import BaseModel
+
+from aidial_adapter_vertexai.chat.result import ChatCompletionResult
+from aidial_adapter_vertexai.deployments import GeminiDeployment
+from aidial_adapter_vertexai.dial_api.request import (
+    ModelParameters,
+    get_attachments,
+)
+from aidial_adapter_vertexai.embedding.text import TextEmbeddingsAdapter
+from aidial_adapter_vertexai.telemetry.metrics import semantic_cache_counter
+from aidial_adapter_vertexai.utils.env import get_env_float, get_env_int
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+from aidial_adapter_vertexai.vertex_ai import get_text_embedding_model
+
+# JSON list of the Gemini deployments the semantic cache is enabled for
+SEMANTIC_CACHE_DEPLOYMENTS: List[str] = json.loads(
+    os.getenv("SEMANTIC_CACHE_DEPLOYMENTS", "[]")
+)
+SEMANTIC_CACHE_EMBEDDINGS_DEPLOYMENT = os.getenv(
+    "SEMANTIC_CACHE_EMBEDDINGS_DEPLOYMENT", "text-embedding-004"
+)
+SEMANTIC_CACHE_THRESHOLD = get_env_float("SEMANTIC_CACHE_THRESHOLD", 0.95)
+SEMANTIC_CACHE_NEAR_MISS_MARGIN = get_env_float(
+    "SEMANTIC_CACHE_NEAR_MISS_MARGIN", 0.05
+)
+SEMANTIC_CACHE_TTL = get_env_int("SEMANTIC_CACHE_TTL", 3600)
+SEMANTIC_CACHE_SIZE = get_env_int("SEMANTIC_CACHE_SIZE", 1000)
+
+GEMINI_DEPLOYMENTS = [
+    deployment.value for deployment in get_args(GeminiDeployment)
+]
+
+
+class SemanticQuery(BaseModel):
+    deployment: str
+    partition: str
+    vector: np.ndarray
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class _Partition:
+    """
+    Brute force vector index of the questions and their answers.
+    """
+
+    vectors: np.ndarray
+    """Normalized embeddings of the questions, one per row"""
+    results: List[ChatCompletionResult]
+    expires_at: np.ndarray
+    last_used_at: np.ndarray
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.empty((0, dimensions), dtype=np.float32)
+        self.results = []
+        self.expires_at = np.empty(0)
+        self.last_used_at = np.empty(0)
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def _keep(self, mask: np.ndarray) -> None:
+        self.vectors = self.vectors[mask]
+        self.expires_at = self.expires_at[mask]
+        self.last_used_at = self.last_used_at[mask]
+        self.results = [r for r, keep in zip(self.results, mask) if keep]
+
+    def evict_expired(self, now: float) -> None:
+        expired = self.expires_at <= now
+        if expired.any():
+            self._keep(~expired)
+
+    def search(self, vector: np.ndarray) -> Optional[Tuple[int, float]]:
+        if len(self) == 0:
+            return None
+        similarities = self.vectors @ vector
+        idx = int(np.argmax(similarities))
+        return idx, float(similarities[idx])
+
+    def add(
+        self,
+        vector: np.ndarray,
+        result: ChatCompletionResult,
+        now: float,
+        ttl: float,
+        max_size: int,
+    ) -> None:
+        if len(self) >= max_size:
+            # Evict the least recently used entries
+            order = np.argsort(self.last_used_at)
+            mask = np.ones(len(self), dtype=bool)
+            mask[order[: len(self) - max_size + 1]] = False
+            self._keep(mask)
+
+        self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+        self.results.append(result)
+        self.expires_at = np.append(self.expires_at, now + ttl)
+        self.last_used_at = np.append(self.last_used_at, now)
+
+
+class SemanticCache:
+    threshold: float
+    near_miss_margin: float
+    ttl: float
+    max_size: int
+    """Maximum number of entries per partition"""
+
+    _partitions: Dict[str, _Partition]
+
+    def __init__(
+        self,
+        *,
+        threshold: float,
+        near_miss_margin: float,
+        ttl: float,
+        max_size: int,
+    ):
+        self.threshold = threshold
+        self.near_miss_margin = near_miss_margin
+        self.ttl = ttl
+        self.max_size = max_size
+        self._partitions = {}
+
+    def lookup(self, query: SemanticQuery) -> Optional[ChatCompletionResult]:
+        attributes = {"deployment": query.deployment}
+        now = time.monotonic()
+
+        partition = self._partitions.get(query.partition)
+        if partition is not None:
+            partition.evict_expired(now)
+
+        found = partition.search(query.vector) if partition else None
+        if found is None:
+            semantic_cache_counter.add(1, {**attributes, "outcome": "miss"})
+            return None
+
+        idx, similarity = found
+        log.debug(f"semantic cache similarity: {similarity:.4f}")
+
+        if similarity >= self.threshold:
+            assert partition is not None
+            partition.last_used_at[idx] = now
+            semantic_cache_counter.add(1, {**attributes, "outcome": "hit"})
+            return partition.results[idx]
+
+        outcome = (
+            "near_miss"
+            if similarity >= self.threshold - self.near_miss_margin
+            else "miss"
+        )
+        semantic_cache_counter.add(1, {**attributes, "outcome": outcome})
+        return None
+
+    def store(self, query: SemanticQuery, result: ChatCompletionResult) -> None:
+        # Only the complete answers are worth reusing
+        if any(
+            choice.finish_reason != FinishReason.STOP
+            or choice.function_call is not None
+            or choice.tool_calls
+            for choice in result.choices
+        ):
+            return
+
+        partition = self._partitions.get(query.partition)
+        if partition is None:
+            partition = self._partitions[query.partition] = _Partition(
+                query.vector.shape[0]
+            )
+
+        partition.add(
+            query.vector,
+            result.copy(exclude={"discarded_messages"}),
+            time.monotonic(),
+            self.ttl,
+            self.max_size,
+        )
+
+
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    near_miss_margin=SEMANTIC_CACHE_NEAR_MISS_MARGIN,
+    ttl=SEMANTIC_CACHE_TTL,
+    max_size=SEMANTIC_CACHE_SIZE,
+)
+
+
+def _get_question(
+    request: ChatCompletionRequest, params: ModelParameters
+) -> Optional[str]:
+    """
+    Returns the question if the request is eligible for the semantic cache.
+    """
+    if (
+        request.tools
+        or request.functions
+        or (params.n or 1) > 1
+        # The cached answer isn't checked against the prompt limit
+        or params.max_prompt_tokens is not None
+        or not request.messages
+    ):
+        return None
+
+    *history, last = request.messages
+    if any(message.role != Role.SYSTEM for message in history):
+        return None
+
+    if (
+        last.role != Role.USER
+        or not isinstance(last.content, str)
+        or get_attachments(last)
+    ):
+        return None
+
+    return last.content
+
+
+async def create_semantic_query(
+    request: Request, params: ModelParameters
+) -> Optional[SemanticQuery]:
+    """
+    Returns None when the request bypasses the semantic cache.
+    """
+    deployment = request.deployment_id
+    if (
+        deployment not in SEMANTIC_CACHE_DEPLOYMENTS
+        or deployment not in GEMINI_DEPLOYMENTS
+    ):
+        return None
+
+    question = _get_question(request, params)
+    if question is None:
+        semantic_cache_counter.add(
+            1, {"deployment": deployment, "outcome": "bypass"}
+        )
+        return None
+
+    system_prompt = [
+        message.content
+        for message in request.messages
+        if message.role == Role.SYSTEM
+    ]
+
+    partition = canonical_hash(
+        deployment,
+        system_prompt,
+        params.dict(exclude={"n", "stream"}),
+    )
+
+    model_id = SEMANTIC_CACHE_EMBEDDINGS_DEPLOYMENT
+    try:
+        adapter = TextEmbeddingsAdapter(
+            model_id=model_id, model=await get_text_embedding_model(model_id)
+        )
+        [embedding] = await adapter.embed_texts(
+            [question], task_type="SEMANTIC_SIMILARITY"
+        )
+    except Exception as e:
+        log.warning(f"semantic cache is unavailable: {e}")
+        semantic_cache_counter.add(
+            1, {"deployment": deployment, "outcome": "error"}
+        )
+        return None
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    vector /= np.linalg.norm(vector) or 1.0
+
+    return SemanticQuery(
+        deployment=deployment, partition=partition, vector=vector
+    )
@@ -0,0 +1,124 @@
+"""
+Monitoring of the event loop responsiveness.
+
+The monitor sleeps for a fixed interval and reports the extra time
+it took the loop to wake it up (the scheduling lag) as a metric.
+A lag means that a callback ran synchronous work on the loop,
+e.g. CPU-bound processing or a blocking call.
+
+In debug mode, a watchdog thread logs the stack of the loop thread
+whenever the loop is held for longer than the threshold, which points
+at the blocking code.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from aidial_adapter_vertexai.telemetry.metrics import (
+    loop_blocked_counter,
+    loop_lag_histogram,
+)
+from aidial_adapter_vertexai.utils.env import get_env_float
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+# Interval in seconds between the samples of the loop lag. 0 disables the monitor.
+LOOP_LAG_INTERVAL = get_env_float("LOOP_LAG_INTERVAL", 1.0)
+
+# Duration in seconds the loop is held for to log the stack of the blocking code.
+# 0 disables the watchdog.
+LOOP_BLOCKING_THRESHOLD = get_env_float("LOOP_BLOCKING_THRESHOLD", 0.0)
+
+
+class LoopMonitor:
+    interval: float
+    blocking_threshold: float
+
+    _task: Optional[asyncio.Task[None]]
+    _watchdog: Optional[threading.Thread]
+    _stopped: threading.Event
+    _heartbeat: float
+    _loop_thread_id: Optional[int]
+
+    def __init__(
+        self,
+        interval: float = LOOP_LAG_INTERVAL,
+        blocking_threshold: float = LOOP_BLOCKING_THRESHOLD,
+    ):
+        self.interval = interval
+        self.blocking_threshold = blocking_threshold
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+
+    def start(self) -> None:
+        if self.interval <= 0 and self.blocking_threshold <= 0:
+            return
+
+        self._stopped.clear()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.create_task(self._sample())
+
+        if self.blocking_threshold > 0:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _get_tick(self) -> float:
+        # The heartbeat must be frequent enough to detect the blocking
+        ticks = [self.interval, self.blocking_threshold / 2]
+        return min(tick for tick in ticks if tick > 0)
+
+    async def _sample(self) -> None:
+        tick = self._get_tick()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(tick)
+            self._heartbeat = now = time.monotonic()
+
+            if self.interval > 0:
+                loop_lag_histogram.record(max(0.0, now - start - tick) * 1000)
+
+    def _watch(self) -> None:
+        reported: Optional[float] = None
+
+        while not self._stopped.wait(self.blocking_threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat
+
+            # The blocking is reported once until the loop wakes up
+            if blocked <= self.blocking_threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+
+            loop_blocked_counter.add(1)
+
+            frame = sys._current_frames().get(self._loop_thread_id or 0)
+            stack = (
+                "".join(traceback.format_stack(frame))
+                if frame is not None
+                else "<unknown>"
+            )
+            log.warning(
+                f"the event loop is blocked for more than {blocked:.3f}s:\n"
+                f"{stack}"
+            )
@@ -0,0 +1,150 @@
+"""
+Metrics reported by the adapter.
+
+The instruments are created via OpenTelemetry API, so they are no-op
+unless a meter provider is configured (see `TelemetryConfig` in the DIAL SDK).
+"""
+
+from contextvars import ContextVar
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter("aidial_adapter_vertexai")
+
+current_deployment: ContextVar[str] = ContextVar(
+    "current_deployment", default="unknown"
+)
+"""
+Deployment of the request being processed.
+Used to attribute the metrics reported by the deployment-agnostic code.
+"""
+
+retry_counter = meter.create_counter(
+    name="vertex_ai.retries",
+    description="Number of retried Vertex AI calls",
+)
+
+retry_budget_exhausted_counter = meter.create_counter(
+    name="vertex_ai.retry_budget_exhausted",
+    description="Number of retries rejected due to the exhausted retry budget",
+)
+
+region_request_counter = meter.create_counter(
+    name="vertex_ai.region_requests",
+    description="Number of Vertex AI requests routed to a region by outcome",
+)
+
+admission_counter = meter.create_counter(
+    name="adapter.admissions",
+    description="Number of requests passed through the admission control by outcome",
+)
+
+hedge_counter = meter.create_counter(
+    name="vertex_ai.hedges",
+    description="Number of hedged Vertex AI requests by outcome",
+)
+
+coalesced_request_counter = meter.create_counter(
+    name="adapter.coalesced_requests",
+    description="Number of requests served by an identical in-flight request",
+)
+
+response_cache_counter = meter.create_counter(
+    name="adapter.response_cache.lookups",
+    description="Number of the response cache lookups by outcome (hit, miss, error)",
+)
+
+semantic_cache_counter = meter.create_counter(
+    name="adapter.semantic_cache.lookups",
+    description="Number of the semantic cache lookups by outcome (hit, near_miss, miss, bypass, error)",
+)
+
+stream_content_events_histogram = meter.create_histogram(
+    name="adapter.stream.content_events",
+    description="Number of the content events sent per streamed choice",
+)
+
+stream_buffer_high_water_histogram = meter.create_histogram(
+    name="adapter.stream.buffer_high_water",
+    description="Maximum number of the upstream chunks buffered per stream",
+)
+
+stream_buffer_overflow_counter = meter.create_counter(
+    name="adapter.stream.buffer_overflows",
+    description="Number of streams failed due to the buffer overflow",
+)
+
+time_to_first_token_histogram = meter.create_histogram(
+    name="adapter.chat.time_to_first_token",
+    unit="ms",
+    description="Time from the model call to the first streamed chunk",
+)
+
+generation_time_histogram = meter.create_histogram(
+    name="adapter.chat.generation_time",
+    unit="ms",
+    description="Time from the model call to the end of the generation",
+)
+
+inter_chunk_gap_histogram = meter.create_histogram(
+    name="adapter.chat.inter_chunk_gap",
+    unit="ms",
+    description="Time between the consecutive streamed chunks",
+)
+
+count_tokens_duration_histogram = meter.create_histogram(
+    name="vertex_ai.count_tokens.duration",
+    unit="ms",
+    description="Latency of the token counting calls",
+)
+
+embeddings_batch_duration_histogram = meter.create_histogram(
+    name="vertex_ai.embeddings.batch_duration",
+    unit="ms",
+    description="Latency of the embeddings calls",
+)
+
+attachment_download_duration_histogram = meter.create_histogram(
+    name="adapter.attachment.download_duration",
+    unit="ms",
+    description="Time of the attachment downloads",
+)
+
+attachment_download_size_histogram = meter.create_histogram(
+    name="adapter.attachment.download_size",
+    unit="By",
+    description="Size of the downloaded attachments",
+)
+
+token_counter = meter.create_counter(
+    name="adapter.tokens",
+    description="Number of the tokens consumed by type (prompt, completion)",
+)
+
+error_counter = meter.create_counter(
+    name="adapter.errors",
+    description="Number of the failed requests by the error class",
+)
+
+
+def record_token_usage(
+    deployment: str, prompt_tokens: int, completion_tokens: int
+) -> None:
+    token_counter.add(
+        prompt_tokens, {"deployment": deployment, "type": "prompt"}
+    )
+    token_counter.add(
+        completion_tokens, {"deployment": deployment, "type": "completion"}
+    )
+
+
+loop_lag_histogram = meter.create_histogram(
+    name="adapter.event_loop.lag",
+    unit="ms",
+    description="Delay of the scheduled callbacks of the event loop",
+)
+
+loop_blocked_counter = meter.create_counter(
+    name="adapter.event_loop.blocked",
+    description="Number of times the event loop was held longer than the blocking threshold",
+)
@@ -0,0 +1,74 @@
+"""
+Prometheus `/metrics` endpoint served on the adapter port.
+
+When the metrics aren't configured via OTEL_METRICS_EXPORTER,
+the adapter sets up a meter provider with a Prometheus reader on its own.
+Otherwise, the meter provider is set up by the DIAL SDK, so the histograms
+have the default buckets.
+Either way, the endpoint exposes the default Prometheus registry,
+which the Prometheus reader of the DIAL SDK reports to as well.
+"""
+
+from aidial_sdk.telemetry.types import TelemetryConfig
+from fastapi import Response
+from opentelemetry.exporter.prometheus import PrometheusMetricReader
+from opentelemetry.metrics import set_meter_provider
+from opentelemetry.sdk.metrics import Histogram, MeterProvider
+from opentelemetry.sdk.metrics.view import (
+    ExplicitBucketHistogramAggregation,
+    View,
+)
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from aidial_adapter_vertexai.utils.env import get_env_bool
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+METRICS_ENDPOINT = get_env_bool("METRICS_ENDPOINT", False)
+
+# The default buckets end at 10s, which is too short for the generation
+_GENERATION_TIME_BUCKETS = [
+    *[100, 250, 500, 1000, 2500, 5000, 10000],
+    *[20000, 30000, 60000, 120000, 300000],
+]
+
+_SIZE_BUCKETS = [2**power for power in range(10, 28, 2)]
+
+_VIEWS = [
+    View(
+        instrument_type=Histogram,
+        instrument_name="adapter.chat.generation_time",
+        aggregation=ExplicitBucketHistogramAggregation(
+            _GENERATION_TIME_BUCKETS
+        ),
+    ),
+    View(
+        instrument_type=Histogram,
+        instrument_name="adapter.attachment.download_size",
+        aggregation=ExplicitBucketHistogramAggregation(_SIZE_BUCKETS),
+    ),
+]
+
+
+def configure_metrics(config: TelemetryConfig) -> None:
+    if config.metrics is None:
+        set_meter_provider(
+            MeterProvider(
+                metric_readers=[PrometheusMetricReader()], views=_VIEWS
+            )
+        )
+    else:
+        log.info(
+            "The meter provider is configured by OTEL_METRICS_EXPORTER, "
+            "so the adapter histograms have the default buckets"
+        )
+        if not config.metrics.prometheus_export:
+            log.warning(
+                "The adapter metrics aren't exported to Prometheus, "
+                "so the /metrics endpoint doesn't report them"
+            )
+
+
+async def metrics() -> Response:
+    return Response(
+        content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST
+    )
@@ -0,0 +1,103 @@
+"""
+Breakdown of the request processing time reported to the client.
+
+The breakdown is opt-in: either the request has `X-Server-Timing: true` header
+or its deployment is listed in SERVER_TIMING_DEPLOYMENTS env variable.
+
+The durations are collected from the `Timer` call sites with a stage name.
+The durations of the same stage are summed up (e.g. for the concurrent
+downloads) and the stages may overlap (e.g. the prompt parsing includes
+the downloads of the attachments).
+
+The non-streaming responses report the breakdown in `Server-Timing` header.
+The headers of the streaming responses are sent before the generation is over,
+so they report the breakdown in the final "Timing" stage instead.
+"""
+
+import json
+import os
+import re
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# JSON list of the deployments reporting the timing breakdown by default
+SERVER_TIMING_DEPLOYMENTS: List[str] = json.loads(
+    os.getenv("SERVER_TIMING_DEPLOYMENTS", "[]")
+)
+
+SERVER_TIMING_REQUEST_HEADER = "X-Server-Timing"
+
+_DEPLOYMENT_PATH = re.compile(r"^/openai/deployments/([^/]+)/")
+
+
+class ServerTiming:
+    durations: Dict[str, float]
+    """Total duration in seconds per stage"""
+
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, stage: str, duration: float) -> None:
+        self.durations[stage] = self.durations.get(stage, 0.0) + duration
+
+    def to_header(self) -> str:
+        return ", ".join(
+            f"{stage};dur={duration * 1000:.1f}"
+            for stage, duration in self.durations.items()
+        )
+
+    def to_markdown(self) -> str:
+        rows = "\n".join(
+            f"|{stage}|{duration * 1000:.1f}|"
+            for stage, duration in self.durations.items()
+        )
+        return f"|Stage|Duration, ms|\n|---|---|\n{rows}\n"
+
+
+current_server_timing: ContextVar[Optional[ServerTiming]] = ContextVar(
+    "current_server_timing", default=None
+)
+
+
+def record_server_timing(stage: str, duration: float) -> None:
+    timing = current_server_timing.get()
+    if timing is not None:
+        timing.add(stage, duration)
+
+
+def _is_requested(scope: Scope) -> bool:
+    value = Headers(scope=scope).get(SERVER_TIMING_REQUEST_HEADER)
+    if value is not None:
+        return value.lower() in ["true", "1", "yes"]
+
+    match = _DEPLOYMENT_PATH.match(scope["path"])
+    return match is not None and match.group(1) in SERVER_TIMING_DEPLOYMENTS
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not _is_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        timing = ServerTiming()
+        token = current_server_timing.set(timing)
+
+        async def _send(message: Message) -> None:
+            if message["type"] == "http.response.start" and timing.durations:
+                headers = MutableHeaders(scope=message)
+                content_type = headers.get("content-type", "")
+                if not content_type.startswith("text/event-stream"):
+                    headers.append("Server-Timing", timing.to_header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            current_server_timing.reset(token)
@@ -0,0 +1,57 @@
+import time
+from typing import AsyncIterator, TypeVar
+
+from aidial_adapter_vertexai.telemetry.metrics import (
+    generation_time_histogram,
+    inter_chunk_gap_histogram,
+    time_to_first_token_histogram,
+)
+from aidial_adapter_vertexai.telemetry.server_timing import record_server_timing
+from aidial_adapter_vertexai.telemetry.tracing import tracer
+
+T = TypeVar("T")
+
+
+async def measured_stream(
+    stream: AsyncIterator[T], *, deployment: str
+) -> AsyncIterator[T]:
+    """
+    Reports the time to the first chunk, the gaps between the chunks
+    and the total generation time of a model stream.
+    """
+
+    attributes = {"deployment": deployment}
+
+    # The span isn't made current, since the context
+    # must not be switched across the yields of the generator
+    span = tracer.start_span("generate", attributes=attributes)
+    start = last = time.perf_counter()
+    chunks = 0
+
+    try:
+        async for chunk in stream:
+            now = time.perf_counter()
+            if chunks == 0:
+                time_to_first_token_histogram.record(
+                    (now - start) * 1000, attributes
+                )
+                record_server_timing("ttft", now - start)
+                span.add_event("first_chunk")
+                span.set_attribute(
+                    "generate.time_to_first_chunk_ms", (now - start) * 1000
+                )
+            else:
+                inter_chunk_gap_histogram.record(
+                    (now - last) * 1000, attributes
+                )
+            last = now
+            chunks += 1
+
+            yield chunk
+
+        generation_time_histogram.record(
+            (time.perf_counter() - start) * 1000, attributes
+        )
+    finally:
+        span.set_attribute("generate.chunks", chunks)
+        span.end()
@@ -0,0 +1,10 @@
+"""
+Spans of the stages of the request processing.
+
+The spans are created via OpenTelemetry API, so they are no-op
+unless a tracer provider is configured (see `TelemetryConfig` in the DIAL SDK).
+"""
+
+from opentelemetry import trace
+
+tracer = trace.get_tracer("aidial_adapter_vertexai")
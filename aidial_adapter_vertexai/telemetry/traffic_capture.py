@@ -0,0 +1,360 @@
+"""
+Capture of the anonymized shapes of the incoming requests,
+which are replayed by `tests/benchmarks/bench_replay.py`
+to load-test the adapter with the production mix of requests.
+
+The capture is disabled by default. It's enabled by TRAFFIC_CAPTURE_FILE
+env variable with the path of the JSON Lines file the shapes are appended to.
+
+A shape keeps the structure of the request, but not its content:
+the deployment, the endpoint, the roles and the lengths of the messages,
+the types and the sizes of the attachments, the number of the tools and
+the numeric generation parameters, along with the arrival time,
+the status and the timing of the response.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from aidial_adapter_vertexai.utils.env import get_env_float, get_env_int
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+TRAFFIC_CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE")
+# Fraction of the requests which are captured
+TRAFFIC_CAPTURE_RATE = get_env_float("TRAFFIC_CAPTURE_RATE", 1.0)
+# Maximum number of the shapes waiting to be written,
+# the shapes beyond it are dropped
+TRAFFIC_CAPTURE_MAX_BACKLOG = get_env_int("TRAFFIC_CAPTURE_MAX_BACKLOG", 1000)
+
+_ENDPOINT_PATH = re.compile(r"^/openai/deployments/([^/]+)/(.+)$")
+
+_NUMERIC_PARAMETERS = [
+    "temperature",
+    "top_p",
+    "n",
+    "max_tokens",
+    "max_prompt_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "seed",
+    "stream",
+]
+
+# The shapes are written off the event loop
+_writer = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="traffic-capture"
+)
+_backlog = threading.BoundedSemaphore(TRAFFIC_CAPTURE_MAX_BACKLOG)
+_dropping = False
+
+AttachmentShapes = Dict[str, List[Dict[str, Any]]]
+"""
+The shapes of the attachments by their URLs,
+whose sizes are known only once the attachments are downloaded
+"""
+
+
+class _Capture:
+    timestamp: float
+    deployment: str
+    endpoint: str
+    request: Optional[Dict[str, Any]]
+    """Shape of the request, computed once the body is received"""
+    attachments: AttachmentShapes
+
+    status: Optional[int]
+    response_size: int
+    start: float
+    first_byte: Optional[float]
+    end: Optional[float]
+
+    def __init__(self, deployment: str, endpoint: str):
+        self.timestamp = time.time()
+        self.deployment = deployment
+        self.endpoint = endpoint
+        self.request = None
+        self.attachments = {}
+        self.status = None
+        self.response_size = 0
+        self.start = time.perf_counter()
+        self.first_byte = None
+        self.end = None
+
+    def set_body(self, body: bytes) -> None:
+        # The body is dropped right away, since it's retained
+        # until the end of the request otherwise
+        self.request = get_request_shape(
+            self.endpoint, json.loads(body) if body else {}, self.attachments
+        )
+
+    def set_attachment_size(self, url: str, size: int) -> None:
+        for shape in self.attachments.pop(url, []):
+            shape["size"] = size
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": self.timestamp,
+            "deployment": self.deployment,
+            "endpoint": self.endpoint,
+            "request": (
+                self.request
+                if self.request is not None
+                else get_request_shape(self.endpoint, {}, {})
+            ),
+            "status": self.status,
+            "response_size": self.response_size,
+            "time_to_first_byte": (
+                None
+                if self.first_byte is None
+                else self.first_byte - self.start
+            ),
+            "duration": None if self.end is None else self.end - self.start,
+        }
+
+
+current_traffic_capture: ContextVar[Optional[_Capture]] = ContextVar(
+    "current_traffic_capture", default=None
+)
+
+
+def record_attachment_size(url: str, size: int) -> None:
+    capture = current_traffic_capture.get()
+    if capture is not None:
+        capture.set_attachment_size(url, size)
+
+
+def _get_text_length(content: Any) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(len(part.get("text") or "") for part in content)
+    return 0
+
+
+def _get_attachment_shape(
+    type: Optional[str],
+    url: Optional[str],
+    data: Optional[str],
+    attachments: AttachmentShapes,
+) -> Dict[str, Any]:
+    size: Optional[int] = None
+    if data:
+        size = len(data) * 3 // 4
+    elif url and url.startswith("data:"):
+        size = len(url.partition(",")[2]) * 3 // 4
+
+    ext = None
+    if url and not url.startswith("data:"):
+        name = url.split("?")[0].rsplit("/", 1)[-1]
+        if "." in name:
+            ext = name.rsplit(".", 1)[-1].lower()
+
+    shape = {"type": type, "ext": ext, "size": size}
+    if size is None and url:
+        attachments.setdefault(url, []).append(shape)
+    return shape
+
+
+def _get_message_shape(
+    message: Dict[str, Any], attachments: AttachmentShapes
+) -> Dict[str, Any]:
+    content = message.get("content")
+    attachment_shapes = [
+        _get_attachment_shape(
+            attachment.get("type"),
+            attachment.get("url"),
+            attachment.get("data"),
+            attachments,
+        )
+        for attachment in (message.get("custom_content") or {}).get(
+            "attachments"
+        )
+        or []
+    ]
+
+    if isinstance(content, list):
+        attachment_shapes += [
+            _get_attachment_shape(
+                None, part["image_url"].get("url"), None, attachments
+            )
+            for part in content
+            if part.get("type") == "image_url"
+        ]
+
+    return {
+        "role": message.get("role"),
+        "content_length": _get_text_length(content),
+        "attachments": attachment_shapes,
+        "tool_calls": len(message.get("tool_calls") or []),
+        "function_call": message.get("function_call") is not None,
+    }
+
+
+def _get_tool_choice(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return "function"
+
+
+def get_chat_shape(
+    request: Dict[str, Any], attachments: AttachmentShapes
+) -> Dict[str, Any]:
+    stop = request.get("stop")
+    return {
+        "messages": [
+            _get_message_shape(message, attachments)
+            for message in request.get("messages") or []
+        ],
+        "parameters": {
+            name: request[name]
+            for name in _NUMERIC_PARAMETERS
+            if request.get(name) is not None
+        },
+        "stop": len([stop] if isinstance(stop, str) else stop or []),
+        "tools": len(request.get("tools") or []),
+        "functions": len(request.get("functions") or []),
+        "tool_choice": _get_tool_choice(
+            request.get("tool_choice") or request.get("function_call")
+        ),
+    }
+
+
+def get_embeddings_shape(request: Dict[str, Any]) -> Dict[str, Any]:
+    inputs = request.get("input")
+    if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+
+    custom_fields = request.get("custom_fields") or {}
+    return {
+        "inputs": [
+            len(value) if isinstance(value, (str, list)) else 0
+            for value in inputs
+        ],
+        "custom_inputs": len(request.get("custom_input") or []),
+        "dimensions": request.get("dimensions"),
+        "encoding_format": request.get("encoding_format"),
+        "type": custom_fields.get("type"),
+        "instruction_length": len(custom_fields.get("instruction") or ""),
+    }
+
+
+def get_request_shape(
+    endpoint: str, request: Dict[str, Any], attachments: AttachmentShapes
+) -> Dict[str, Any]:
+    match endpoint:
+        case "chat/completions":
+            return get_chat_shape(request, attachments)
+        case "embeddings":
+            return get_embeddings_shape(request)
+        case "tokenize":
+            return {
+                "inputs": [
+                    (
+                        {
+                            "type": "request",
+                            "request": get_chat_shape(
+                                input["value"], attachments
+                            ),
+                        }
+                        if input.get("type") == "request"
+                        else {"type": "string", "length": len(input["value"])}
+                    )
+                    for input in request.get("inputs") or []
+                ]
+            }
+        case "truncate_prompt":
+            return {
+                "inputs": [
+                    get_chat_shape(input, attachments)
+                    for input in request.get("inputs") or []
+                ]
+            }
+        case _:
+            return {}
+
+
+def _write(path: str, capture: _Capture) -> None:
+    try:
+        line = json.dumps(capture.to_dict())
+        with open(path, "a") as f:
+            f.write(line + "\n")
+    except Exception as e:
+        log.warning(f"failed to capture the request: {e}")
+    finally:
+        _backlog.release()
+
+
+def _submit(path: str, capture: _Capture) -> None:
+    global _dropping
+
+    if not _backlog.acquire(blocking=False):
+        if not _dropping:
+            log.warning(
+                "the traffic capture backlog is full, the requests are dropped"
+            )
+        _dropping = True
+        return
+
+    _dropping = False
+    _writer.submit(_write, path, capture)
+
+
+class TrafficCaptureMiddleware:
+    def __init__(self, app: ASGIApp, path: str, rate: float = 1.0):
+        self.app = app
+        self.path = path
+        self.rate = rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        match = _ENDPOINT_PATH.match(scope.get("path", ""))
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or match is None
+            or random.random() >= self.rate
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        capture = _Capture(deployment=match.group(1), endpoint=match.group(2))
+        token = current_traffic_capture.set(capture)
+
+        body: List[bytes] = []
+
+        async def _receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request" and capture.request is None:
+                body.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    try:
+                        capture.set_body(b"".join(body))
+                    except Exception as e:
+                        log.warning(f"failed to capture the request: {e}")
+                    body.clear()
+            return message
+
+        async def _send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body and capture.first_byte is None:
+                    capture.first_byte = time.perf_counter()
+                capture.response_size += len(body)
+            await send(message)
+
+        try:
+            await self.app(scope, _receive, _send)
+        finally:
+            current_traffic_capture.reset(token)
+            capture.end = time.perf_counter()
+            _submit(self.path, capture)
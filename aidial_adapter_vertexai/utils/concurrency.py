@@ -1,6 +1,6 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, List, TypeVar
+from typing import Awaitable, Callable, Iterable, List, TypeVar
 
 T = TypeVar("T")
 A = TypeVar("A")
@@ -25,8 +25,17 @@ async def make_async(func: Callable[[A], T], arg: A) -> T:
         return await loop.run_in_executor(executor, func, arg)
 
 
-async def gather_sync(sync_tasks: List[Callable[[], T]], **kwargs) -> List[T]:
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor(**kwargs) as executor:
-        tasks = [loop.run_in_executor(executor, task) for task in sync_tasks]
-        return await asyncio.gather(*tasks)
+async def gather_with_limit(
+    limit: int, funcs: Iterable[Callable[[], Awaitable[T]]]
+) -> List[T]:
+    """
+    Runs the given functions concurrently, at most `limit` at a time.
+    The results are returned in the order of the functions.
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def _run(func: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            return await func()
+
+    return await asyncio.gather(*(_run(func) for func in funcs))
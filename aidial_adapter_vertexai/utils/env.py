@@ -8,3 +8,18 @@ def get_env(name: str) -> str:
             return val
 
     raise Exception(f"{name} env variable is not set")
+
+
+def get_env_int(name: str, default: int) -> int:
+    val = os.getenv(name)
+    return default if val is None else int(val)
+
+
+def get_env_float(name: str, default: float) -> float:
+    val = os.getenv(name)
+    return default if val is None else float(val)
+
+
+def get_env_bool(name: str, default: bool) -> bool:
+    val = os.getenv(name)
+    return default if val is None else val.lower() in ["true", "1", "yes"]
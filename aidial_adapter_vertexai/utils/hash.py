@@ -0,0 +1,50 @@
+"""
+Stable hashing of the request data.
+The hash is used as a key for deduplication and caching of the requests.
+"""
+
+import hashlib
+import json
+from dataclasses import asdict, is_dataclass
+from enum import Enum
+from typing import Any
+
+from pydantic import BaseModel
+
+
+def _to_json(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.dict(exclude_none=True)
+
+    if isinstance(obj, Enum):
+        return obj.value
+
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+
+    # Vertex AI SDK objects, e.g. Content and Part
+    if callable(getattr(obj, "to_dict", None)):
+        return obj.to_dict()
+
+    if isinstance(obj, bytes):
+        return hashlib.sha256(obj).hexdigest()
+
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+
+    raise TypeError(f"Object of type {type(obj).__name__} isn't hashable")
+
+
+def canonical_hash(*objs: Any) -> str:
+    """
+    SHA-256 hex digest of the objects which doesn't depend
+    on the order of the dictionary keys and unset optional fields.
+    """
+    data = json.dumps(
+        objs,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=_to_json,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
@@ -2,117 +2,313 @@
 Utilities for pretty-printing JSON in debug logs.
 These functions are useful for dumping large data structures,
 with options to trim long strings and lists to specified limits.
+
+The objects are converted to JSON-compatible values in a single pass,
+which truncates the strings and lists while walking the object,
+so the parts which are cut off are never converted.
+Protobuf messages are walked directly, so their binary fields
+(e.g. inline images) are never base64-encoded.
 """
 
+import dataclasses
 import json
-from dataclasses import asdict, is_dataclass
 from enum import Enum
-from typing import Any
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
 
 import proto
+from google.protobuf import json_format
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import Message as PbMessage
 from pydantic import BaseModel
 
-from aidial_adapter_vertexai.utils.protobuf import message_to_dict
-
-
-def json_dumps_short(
-    obj: Any, *, string_limit: int = 100, list_len_limit: int = 10, **kwargs
-) -> str:
-    def default(obj) -> str:
-        return _truncate_strings(str(obj), string_limit)
-
-    return json.dumps(
-        _truncate_lists(
-            _truncate_strings(_to_dict(obj, **kwargs), string_limit),
-            list_len_limit,
-        ),
-        default=default,
-    )
-
-
-def json_dumps(obj: Any, **kwargs) -> str:
-    return json.dumps(_to_dict(obj, **kwargs))
-
-
-def _to_dict(obj: Any, **kwargs) -> Any:
-    def rec(val):
-        return _to_dict(val, **kwargs)
-
-    def dict_field(key: str, val: Any) -> Any:
-        if key in kwargs.get("excluded_keys", []):
-            return "<excluded>"
-        return val
-
-    if isinstance(obj, bytes):
-        return f"<bytes>({len(obj):_} B)"
-
-    if isinstance(obj, Enum):
-        return obj.value
-
-    if isinstance(obj, dict):
-        return {key: rec(dict_field(key, value)) for key, value in obj.items()}
-
-    if isinstance(obj, list):
-        return [rec(element) for element in obj]
-
-    if isinstance(obj, tuple):
-        return tuple(rec(element) for element in obj)
+Converter = Callable[[Any, int], Any]
 
-    if isinstance(obj, BaseModel):
-        return rec(obj.dict())
 
-    if isinstance(obj, proto.Message):
-        return rec(message_to_dict(obj))
+def _to_json_short(
+    obj: Any,
+    *,
+    string_limit: int = 100,
+    list_len_limit: int = 10,
+    depth_limit: int = 32,
+    size_limit: int = 100_000,
+    **kwargs,
+) -> Any:
+    return _Serializer(
+        string_limit=string_limit,
+        list_len_limit=list_len_limit,
+        depth_limit=depth_limit,
+        size_limit=size_limit,
+        **kwargs,
+    ).convert(obj, 0)
 
-    if hasattr(obj, "to_dict"):
-        return rec(obj.to_dict())
 
-    if is_dataclass(type(obj)):
-        return rec(asdict(obj))
+def json_dumps_short(obj: Any, **kwargs) -> str:
+    return json.dumps(_to_json_short(obj, **kwargs))
 
-    return obj
 
-
-def _truncate_strings(obj: Any, limit: int) -> Any:
-    def rec(val):
-        return _truncate_strings(val, limit)
-
-    if isinstance(obj, dict):
-        return {key: rec(value) for key, value in obj.items()}
-
-    if isinstance(obj, list):
-        return [rec(element) for element in obj]
-
-    if isinstance(obj, tuple):
-        return tuple(rec(element) for element in obj)
-
-    if isinstance(obj, str) and len(obj) > limit:
-        skip = len(obj) - limit
-        return (
-            obj[: limit // 2] + f"...({skip:_} skipped)..." + obj[-limit // 2 :]
-        )
-
-    return obj
-
-
-def _truncate_lists(obj: Any, limit: int) -> Any:
-    def rec(val):
-        return _truncate_lists(val, limit)
-
-    if isinstance(obj, dict):
-        return {key: rec(value) for key, value in obj.items()}
-
-    if isinstance(obj, list):
-        if len(obj) > limit:
-            skip = len(obj) - limit
+def json_dumps(obj: Any, **kwargs) -> str:
+    return json.dumps(_Serializer(**kwargs).convert(obj, 0))
+
+
+class LazyJson:
+    """
+    Defers the serialization until the log record is emitted, e.g.
+    `log.debug("request: %s", LazyJson(request, short=True))`,
+    so the skipped records aren't serialized at all and the emitted ones
+    are serialized by the logging thread.
+
+    The object may be changed after the logging call, so the logging handler
+    takes a snapshot of it before passing it to the logging thread,
+    unless the object is `frozen`, e.g. a response received from Vertex AI.
+    """
+
+    def __init__(
+        self, obj: Any, *, short: bool = False, frozen: bool = False, **kwargs
+    ):
+        self.obj = obj
+        self.short = short
+        self.frozen = frozen
+        self.kwargs = kwargs
+
+    def snapshot(self) -> Any:
+        """
+        Returns the object converted to JSON-compatible values,
+        which are rendered as JSON, unless the object is frozen.
+        """
+        if self.frozen:
+            return self
+        if self.short:
+            return _JsonSnapshot(_to_json_short(self.obj, **self.kwargs))
+        return _JsonSnapshot(_Serializer(**self.kwargs).convert(self.obj, 0))
+
+    def __str__(self) -> str:
+        if self.short:
+            return json_dumps_short(self.obj, **self.kwargs)
+        return json_dumps(self.obj, **self.kwargs)
+
+
+class _JsonSnapshot:
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value)
+
+
+def _skipped(count: int) -> str:
+    return f"...({count:_} skipped)..."
+
+
+def _bytes(size: int) -> str:
+    return f"<bytes>({size:_} B)"
+
+
+def _get_raw_message(obj: Any) -> Optional[proto.Message]:
+    """
+    The Vertex AI SDK wrappers (e.g. `Part`, `Content`, `GenerationResponse`)
+    keep the underlying proto-plus message in a `_raw_*` attribute.
+    """
+    for name, value in getattr(obj, "__dict__", {}).items():
+        if name.startswith("_raw_") and isinstance(value, proto.Message):
+            return value
+    return None
+
+
+class _Serializer:
+    string_limit: Optional[int]
+    list_len_limit: Optional[int]
+    depth_limit: Optional[int]
+    size_limit: Optional[int]
+    excluded_keys: List[str]
+
+    size: int
+    """Approximate size of the converted values"""
+
+    def __init__(
+        self,
+        *,
+        string_limit: Optional[int] = None,
+        list_len_limit: Optional[int] = None,
+        depth_limit: Optional[int] = None,
+        size_limit: Optional[int] = None,
+        excluded_keys: List[str] = [],
+    ):
+        self.string_limit = string_limit
+        self.list_len_limit = list_len_limit
+        self.depth_limit = depth_limit
+        self.size_limit = size_limit
+        self.excluded_keys = excluded_keys
+        self.size = 0
+
+    def _is_full(self) -> bool:
+        return self.size_limit is not None and self.size >= self.size_limit
+
+    def _string(self, obj: str) -> str:
+        limit = self.string_limit
+        if limit is not None and len(obj) > limit:
             obj = (
                 obj[: limit // 2]
-                + [f"...({skip:_} skipped)..."]
+                + _skipped(len(obj) - limit)
                 + obj[-limit // 2 :]
             )
-        return [rec(element) for element in obj]
-
-    if isinstance(obj, tuple):
-        return tuple(rec(element) for element in obj)
+        self.size += len(obj)
+        return obj
+
+    def _sequence(
+        self, obj: Sequence[Any], depth: int, convert: Converter
+    ) -> List[Any]:
+        limit = self.list_len_limit
+        if limit is not None and len(obj) > limit:
+            head, tail = obj[: limit // 2], obj[-limit // 2 :]
+            skipped = len(obj) - len(head) - len(tail)
+        else:
+            head, tail, skipped = obj, [], 0
+
+        ret: List[Any] = []
+        for idx, element in enumerate(head):
+            if self._is_full():
+                return ret + [_skipped(len(obj) - idx)]
+            ret.append(convert(element, depth + 1))
+
+        if skipped:
+            ret.append(_skipped(skipped))
+
+        for idx, element in enumerate(tail):
+            if self._is_full():
+                return ret + [_skipped(len(tail) - idx)]
+            ret.append(convert(element, depth + 1))
+
+        return ret
+
+    def _mapping(
+        self, items: Iterable[Tuple[str, Any]], depth: int, convert: Converter
+    ) -> dict:
+        ret: dict = {}
+        for key, value in items:
+            if self._is_full():
+                ret["..."] = "(skipped)"
+                break
+
+            key = str(key)
+            self.size += len(key) + 1
+            if key in self.excluded_keys:
+                ret[key] = "<excluded>"
+            else:
+                ret[key] = convert(value, depth + 1)
+        return ret
+
+    def convert(self, obj: Any, depth: int) -> Any:
+        if obj is None or isinstance(obj, (bool, int, float)):
+            self.size += 1
+            return obj
+
+        if isinstance(obj, str):
+            return self._string(obj)
+
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return _bytes(len(obj))
+
+        if isinstance(obj, Enum):
+            return self.convert(obj.value, depth)
+
+        if self.depth_limit is not None and depth >= self.depth_limit:
+            return "<max depth>"
+
+        if isinstance(obj, dict):
+            return self._mapping(obj.items(), depth, self.convert)
+
+        if isinstance(obj, (list, tuple)):
+            return self._sequence(obj, depth, self.convert)
+
+        if isinstance(obj, BaseModel):
+            return self._mapping(obj, depth, self.convert)
+
+        if isinstance(obj, proto.Message):
+            return self._message(obj._pb, depth, False)
+
+        if isinstance(obj, PbMessage):
+            return self._message(obj, depth, False)
+
+        if (message := _get_raw_message(obj)) is not None:
+            return self._message(message._pb, depth, True)
+
+        if hasattr(obj, "to_dict"):
+            return self.convert(obj.to_dict(), depth)
+
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            return self._mapping(
+                (
+                    (field.name, getattr(obj, field.name))
+                    for field in dataclasses.fields(obj)
+                ),
+                depth,
+                self.convert,
+            )
 
-    return obj
+        return self._string(str(obj))
+
+    def _message(
+        self, message: PbMessage, depth: int, preserve_names: bool
+    ) -> Any:
+        """
+        Converts a message like `json_format.MessageToDict` does.
+        """
+
+        def rec(value: Any, depth: int) -> Any:
+            return self._message(value, depth, preserve_names)
+
+        match message.DESCRIPTOR.full_name:
+            case "google.protobuf.Struct":
+                return self._mapping(message.fields.items(), depth, rec)  # type: ignore
+            case "google.protobuf.ListValue":
+                return self._sequence(message.values, depth, rec)  # type: ignore
+            case "google.protobuf.Value":
+                kind = message.WhichOneof("kind")
+                if kind is None or kind == "null_value":
+                    return None
+                value = getattr(message, kind)
+                if kind in ("struct_value", "list_value"):
+                    return rec(value, depth)
+                return self.convert(value, depth)
+            case name if name.startswith("google.protobuf."):
+                # The rest of the well-known types are small
+                return self.convert(json_format.MessageToDict(message), depth)
+
+        def convert_field(field: FieldDescriptor) -> Converter:
+            def _convert(value: Any, depth: int) -> Any:
+                if field.type == FieldDescriptor.TYPE_MESSAGE:
+                    return rec(value, depth)
+                if field.type == FieldDescriptor.TYPE_ENUM:
+                    enum_value = field.enum_type.values_by_number.get(value)
+                    return value if enum_value is None else enum_value.name
+                if field.type == FieldDescriptor.TYPE_BYTES:
+                    return _bytes(len(value))
+                return self.convert(value, depth)
+
+            return _convert
+
+        def convert_value(
+            field: FieldDescriptor, value: Any, depth: int
+        ) -> Any:
+            if field.label != FieldDescriptor.LABEL_REPEATED:
+                return convert_field(field)(value, depth)
+
+            if field.message_type and field.message_type.GetOptions().map_entry:
+                value_field = field.message_type.fields_by_name["value"]
+                return self._mapping(
+                    value.items(), depth, convert_field(value_field)
+                )
+
+            return self._sequence(value, depth, convert_field(field))
+
+        return self._mapping(
+            (
+                (
+                    field.name if preserve_names else field.json_name,
+                    (field, value),
+                )
+                for field, value in message.ListFields()
+            ),
+            depth,
+            lambda item, depth: convert_value(*item, depth),
+        )
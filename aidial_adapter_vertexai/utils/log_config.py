@@ -1,10 +1,19 @@
+import atexit
+import json
 import logging
 import os
+import random
 import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue, SimpleQueue
+from typing import Dict, Optional
 
 from aidial_sdk import logger as aidial_logger
 from uvicorn.logging import DefaultFormatter
 
+from aidial_adapter_vertexai.utils.env import get_env_int
+from aidial_adapter_vertexai.utils.json import LazyJson
+
 # By default (in prod) we don't want to print debug messages,
 # because they typically contain prompts.
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -12,6 +21,87 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 AIDIAL_LOG_LEVEL = os.getenv("AIDIAL_LOG_LEVEL", "WARNING")
 aidial_logger.setLevel(AIDIAL_LOG_LEVEL)
 
+# JSON object mapping a logger name to the fraction of its debug records
+# which are emitted, e.g. {"vertex-ai": 0.1}
+LOG_SAMPLING: Dict[str, float] = json.loads(os.getenv("LOG_SAMPLING", "{}"))
+
+# Maximum number of the log records waiting to be emitted,
+# the records beyond it are dropped
+LOG_QUEUE_SIZE = get_env_int("LOG_QUEUE_SIZE", 10000)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through the given fraction of the debug records
+    and all the records of the higher levels.
+    """
+
+    rate: float
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Passes the records to the listener thread unformatted,
+    so that their messages are rendered off the event loop.
+    The lazy payloads are only converted to snapshots, since the objects
+    they refer to may be changed by the event loop in the meantime.
+
+    The unformatted records reference their arguments, e.g. the prompts,
+    so the records are dropped when the queue is full.
+    The number of the dropped records is reported once there is room again.
+    """
+
+    dropped: int
+
+    def __init__(self, queue: Queue | SimpleQueue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                arg.snapshot() if isinstance(arg, LazyJson) else arg
+                for arg in record.args
+            )
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.dropped:
+                self.queue.put_nowait(_get_dropped_record(self.dropped))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+def _get_dropped_record(count: int) -> logging.LogRecord:
+    return logging.makeLogRecord(
+        {
+            "name": "app",
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": "%d log records were dropped, because the log queue was full",
+            "args": (count,),
+        }
+    )
+
+
+class _QueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Waiting for the room in the bounded queue
+        self.queue.put(self._sentinel)
+
+
+_listener: Optional[QueueListener] = None
+
 
 def configure_loggers():
     # Making the uvicorn and dial sdk loggers delegate logging to the root logger
@@ -26,7 +116,7 @@ def configure_loggers():
     # Configuring the root logger
     root = logging.getLogger()
 
-    root_has_stderr_handler = any(
+    root_has_stderr_handler = _listener is not None or any(
         isinstance(handler, logging.StreamHandler)
         and handler.stream == sys.stderr
         for handler in root.handlers
@@ -41,7 +131,33 @@ def configure_loggers():
 
         handler = logging.StreamHandler(sys.stderr)
         handler.setFormatter(formatter)
-        root.addHandler(handler)
+        root.addHandler(_start_listener(handler))
+
+    _configure_sampling(LOG_SAMPLING)
+
+
+def _configure_sampling(sampling: Dict[str, float]) -> None:
+    for name, rate in sampling.items():
+        logger = logging.getLogger(name)
+        # The loggers could be configured more than once
+        for filter in list(logger.filters):
+            if isinstance(filter, SamplingFilter):
+                logger.removeFilter(filter)
+        logger.addFilter(SamplingFilter(rate))
+
+
+def _start_listener(handler: logging.Handler) -> logging.Handler:
+    """
+    Moves the emission of the records by the handler to a separate thread.
+    """
+    global _listener
+
+    queue: Queue[logging.LogRecord] = Queue(LOG_QUEUE_SIZE)
+    _listener = _QueueListener(queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    return _DeferredQueueHandler(queue)
 
 
 # Loggers in order from high-level to low-level
@@ -0,0 +1,220 @@
+"""
+CPU and memory profiling of the running adapter.
+
+The CPU profiles cover the event loop thread only:
+* `cProfile` records every call, which is exact but slows the loop down,
+* the stack sampler inspects the loop thread from another thread
+  at a fixed interval, which is cheap and shows where the loop spends time.
+"""
+
+import asyncio
+import cProfile
+import marshal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+FrameKey = Tuple[str, str, int]
+
+
+async def profile_cpu(duration: float) -> bytes:
+    """
+    Returns the profile of the event loop thread in pstats format.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profiler.disable()
+
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)  # type: ignore
+
+
+class StackSampler:
+    thread_id: int
+    interval: float
+
+    samples: List[List[FrameKey]]
+    """Sampled stacks from the outermost frame to the innermost one"""
+    weights: List[float]
+    """Time in seconds represented by each sample"""
+
+    _stopped: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = []
+        self.weights = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+
+            stack: List[FrameKey] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                frame = frame.f_back
+            stack.reverse()
+
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """
+        See https://github.com/jlfwong/speedscope/wiki/Importing-from-custom-sources
+        """
+        frames: List[Dict[str, Any]] = []
+        frame_indices: Dict[FrameKey, int] = {}
+
+        def _get_frame_index(key: FrameKey) -> int:
+            index = frame_indices.get(key)
+            if index is None:
+                index = frame_indices[key] = len(frames)
+                func, file, line = key
+                frames.append({"name": func, "file": file, "line": line})
+            return index
+
+        samples = [
+            [_get_frame_index(key) for key in stack] for stack in self.samples
+        ]
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "aidial-adapter-vertexai",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(self.weights),
+                    "samples": samples,
+                    "weights": self.weights,
+                }
+            ],
+        }
+
+
+async def sample_cpu(duration: float, interval: float) -> Dict[str, Any]:
+    """
+    Returns the sampled profile of the event loop thread in speedscope format.
+    """
+    sampler = StackSampler(threading.get_ident(), interval)
+    sampler.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        sampler.stop()
+
+    return sampler.to_speedscope("event loop")
+
+
+def _stat_to_dict(stat: tracemalloc.Statistic) -> Dict[str, Any]:
+    return {
+        "traceback": [str(frame) for frame in stat.traceback],
+        "size": stat.size,
+        "count": stat.count,
+    }
+
+
+def _diff_to_dict(stat: tracemalloc.StatisticDiff) -> Dict[str, Any]:
+    return {
+        "traceback": [str(frame) for frame in stat.traceback],
+        "size": stat.size,
+        "size_diff": stat.size_diff,
+        "count": stat.count,
+        "count_diff": stat.count_diff,
+    }
+
+
+class MemoryTracer:
+    """
+    Tracks the allocation sites via tracemalloc.
+    The diff is computed against the snapshot taken on start
+    or on the last reset.
+    """
+
+    _baseline: Optional[tracemalloc.Snapshot]
+
+    def __init__(self):
+        self._baseline = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = self._take_snapshot()
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self._baseline = None
+
+    def get_top(self, group_by: str, limit: int) -> Dict[str, Any]:
+        stats = self._take_snapshot().statistics(group_by)
+        return {
+            **self._get_memory(),
+            "top": [_stat_to_dict(stat) for stat in stats[:limit]],
+        }
+
+    def get_diff(
+        self, group_by: str, limit: int, reset: bool
+    ) -> Dict[str, Any]:
+        snapshot = self._take_snapshot()
+        baseline = self._baseline or snapshot
+
+        stats = snapshot.compare_to(baseline, group_by)
+        if reset:
+            self._baseline = snapshot
+
+        return {
+            **self._get_memory(),
+            "top": [_diff_to_dict(stat) for stat in stats[:limit]],
+        }
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+
+    @staticmethod
+    def _get_memory() -> Dict[str, int]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {"traced_memory": current, "peak_traced_memory": peak}
+
+
+memory_tracer = MemoryTracer()
@@ -0,0 +1,247 @@
+"""
+Retries of the transient Vertex AI errors.
+
+The retries are done with a jittered exponential backoff which
+respects the retry hints sent by the server.
+
+The retries are limited by the process-wide retry budget,
+so that a degraded upstream isn't flooded with retried requests.
+"""
+
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    GoogleAPICallError,
+    InternalServerError,
+    ResourceExhausted,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+from google.rpc.error_details_pb2 import RetryInfo
+from pydantic import BaseModel
+
+from aidial_adapter_vertexai.telemetry.metrics import (
+    retry_budget_exhausted_counter,
+    retry_counter,
+)
+from aidial_adapter_vertexai.utils.env import get_env_float, get_env_int
+from aidial_adapter_vertexai.utils.log_config import vertex_ai_logger as log
+
+T = TypeVar("T")
+
+TRANSIENT_ERRORS = (
+    ResourceExhausted,
+    TooManyRequests,
+    ServiceUnavailable,
+    DeadlineExceeded,
+    InternalServerError,
+)
+
+
+def is_transient_error(e: Exception) -> bool:
+    return isinstance(e, TRANSIENT_ERRORS)
+
+
+def get_retry_hint(e: Exception) -> Optional[float]:
+    """
+    Returns the delay in seconds suggested by the server or None.
+    """
+    if not isinstance(e, GoogleAPICallError):
+        return None
+
+    for detail in e.details or []:
+        if isinstance(detail, RetryInfo) and detail.HasField("retry_delay"):
+            return detail.retry_delay.ToTimedelta().total_seconds()
+
+    headers = getattr(e.response, "headers", None)
+    if headers is not None:
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+
+    return None
+
+
+class RetryBudget:
+    """
+    Token bucket which limits the share of retried calls.
+
+    Every call deposits `ratio` tokens to the bucket and every retry withdraws a single token.
+    Additionally, `min_per_second` retries are always allowed,
+    so that the retries are possible under a low load.
+    """
+
+    ratio: float
+    min_per_second: float
+    capacity: float
+
+    _balance: float
+    _reserve: float
+    _last_refill: float
+
+    def __init__(
+        self, *, ratio: float, min_per_second: float, capacity: float = 100.0
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+
+        self._balance = 0.0
+        self._reserve = min_per_second
+        self._last_refill = time.monotonic()
+
+    def deposit(self) -> None:
+        self._balance = min(self._balance + self.ratio, self.capacity)
+
+    def try_withdraw(self) -> bool:
+        now = time.monotonic()
+        self._reserve = min(
+            self._reserve + (now - self._last_refill) * self.min_per_second,
+            max(self.min_per_second, 1.0),
+        )
+        self._last_refill = now
+
+        if self._reserve >= 1.0:
+            self._reserve -= 1.0
+            return True
+
+        if self._balance >= 1.0:
+            self._balance -= 1.0
+            return True
+
+        return False
+
+
+class RetryPolicy(BaseModel):
+    max_retries: int
+    initial_backoff: float
+    """The upper bound of the first backoff delay in seconds"""
+    max_backoff: float
+    """The upper bound of any backoff delay in seconds"""
+    max_retry_hint: float
+    """Retry hints longer than this number of seconds are not waited for"""
+
+    def get_backoff(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter.
+        """
+        cap = min(self.max_backoff, self.initial_backoff * 2**attempt)
+        return random.uniform(0, cap)
+
+
+default_retry_policy = RetryPolicy(
+    max_retries=get_env_int("RETRY_MAX_RETRIES", 3),
+    initial_backoff=get_env_float("RETRY_INITIAL_BACKOFF", 0.5),
+    max_backoff=get_env_float("RETRY_MAX_BACKOFF", 8.0),
+    max_retry_hint=get_env_float("RETRY_MAX_RETRY_HINT", 30.0),
+)
+
+retry_budget = RetryBudget(
+    ratio=get_env_float("RETRY_BUDGET_RATIO", 0.1),
+    min_per_second=get_env_float("RETRY_BUDGET_MIN_PER_SECOND", 1.0),
+)
+
+
+def _get_retry_delay(
+    policy: RetryPolicy,
+    budget: RetryBudget,
+    e: Exception,
+    attempt: int,
+    attributes: dict,
+) -> Optional[float]:
+    if not is_transient_error(e):
+        return None
+
+    if attempt >= policy.max_retries:
+        log.debug(f"max retries exceeded ({policy.max_retries})")
+        return None
+
+    hint = get_retry_hint(e)
+    if hint is not None and hint > policy.max_retry_hint:
+        log.debug(f"the retry hint is too long: {hint:.3f}s")
+        return None
+
+    if not budget.try_withdraw():
+        log.debug("the retry budget is exhausted")
+        retry_budget_exhausted_counter.add(1, attributes)
+        return None
+
+    delay = hint if hint is not None else policy.get_backoff(attempt)
+
+    log.debug(
+        f"retrying [{attempt + 1}/{policy.max_retries}] in {delay:.3f}s "
+        f"after {type(e).__name__}: {str(e)}"
+    )
+    retry_counter.add(1, {**attributes, "error": type(e).__name__})
+
+    return delay
+
+
+async def call_with_retries(
+    func: Callable[[], Awaitable[T]],
+    *,
+    operation: str,
+    deployment: str,
+    policy: RetryPolicy | None = None,
+    budget: RetryBudget | None = None,
+) -> T:
+    policy = policy or default_retry_policy
+    budget = budget or retry_budget
+    attributes = {"operation": operation, "deployment": deployment}
+
+    budget.deposit()
+
+    attempt = 0
+    while True:
+        try:
+            return await func()
+        except Exception as e:
+            delay = _get_retry_delay(policy, budget, e, attempt, attributes)
+            if delay is None:
+                raise e
+
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def stream_with_retries(
+    generator: Callable[[], AsyncIterator[T]],
+    *,
+    operation: str,
+    deployment: str,
+    policy: RetryPolicy | None = None,
+    budget: RetryBudget | None = None,
+) -> AsyncIterator[T]:
+    """
+    Retries the stream only if it failed before yielding the first element,
+    since the elements which were already yielded can't be taken back.
+    """
+    policy = policy or default_retry_policy
+    budget = budget or retry_budget
+    attributes = {"operation": operation, "deployment": deployment}
+
+    budget.deposit()
+
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async for item in generator():
+                started = True
+                yield item
+            return
+        except Exception as e:
+            if started:
+                raise e
+
+            delay = _get_retry_delay(policy, budget, e, attempt, attributes)
+            if delay is None:
+                raise e
+
+        attempt += 1
+        await asyncio.sleep(delay)
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+
+from aidial_adapter_vertexai.telemetry.metrics import coalesced_request_counter
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    task: asyncio.Task[T]
+    waiters: int
+
+    def __init__(self, task: asyncio.Task[T]):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces the concurrent calls with the same key into a single call,
+    whose result (or exception) is shared by all the callers.
+    The call is cancelled only when all its callers are cancelled.
+    """
+
+    operation: str
+    _calls: Dict[str, _Call[T]]
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._calls = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(func()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            log.debug(f"{self.operation}: joined in-flight request {key[:8]}")
+            coalesced_request_counter.add(1, {"operation": self.operation})
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,124 @@
+"""
+Bounded buffer between the upstream stream and the writer of the response.
+
+The upstream stream is read by a separate task at full speed,
+so that a slow client doesn't hold the upstream stream open longer
+than necessary, and a slow upstream doesn't leave the writer idle.
+
+When the buffer is full, the overflow policy applies:
+* `block` - the reader waits for the writer, i.e. the upstream is throttled,
+* `fail` - the stream fails, which protects the memory from stalled clients.
+
+The writer, in turn, waits for the client once there are too many events
+which aren't yet sent to the client.
+"""
+
+import asyncio
+import os
+from enum import Enum
+from typing import AsyncIterator, Generic, Optional, TypeVar, cast
+
+from aidial_adapter_vertexai.telemetry.metrics import (
+    stream_buffer_high_water_histogram,
+    stream_buffer_overflow_counter,
+)
+from aidial_adapter_vertexai.utils.env import get_env_int
+from aidial_adapter_vertexai.utils.log_config import app_logger as log
+
+T = TypeVar("T")
+
+
+class OverflowPolicy(str, Enum):
+    BLOCK = "block"
+    FAIL = "fail"
+
+
+# Maximum number of buffered chunks. 0 disables the buffering.
+STREAM_BUFFER_SIZE = get_env_int("STREAM_BUFFER_SIZE", 256)
+STREAM_BUFFER_OVERFLOW = OverflowPolicy(
+    os.getenv("STREAM_BUFFER_OVERFLOW", OverflowPolicy.BLOCK.value)
+)
+# Maximum number of the events not yet sent to the client
+# before the writer waits for it. 0 disables the waiting.
+STREAM_MAX_PENDING_EVENTS = get_env_int("STREAM_MAX_PENDING_EVENTS", 256)
+
+
+class StreamBufferOverflowError(Exception):
+    pass
+
+
+class _Item(Generic[T]):
+    value: Optional[T]
+    error: Optional[Exception]
+    end: bool
+
+    def __init__(
+        self,
+        value: Optional[T] = None,
+        error: Optional[Exception] = None,
+        end: bool = False,
+    ):
+        self.value = value
+        self.error = error
+        self.end = end
+
+
+async def buffered_stream(
+    stream: AsyncIterator[T],
+    *,
+    deployment: str,
+    max_size: int = STREAM_BUFFER_SIZE,
+    policy: OverflowPolicy = STREAM_BUFFER_OVERFLOW,
+) -> AsyncIterator[T]:
+    if max_size <= 0:
+        async for item in stream:
+            yield item
+        return
+
+    queue: asyncio.Queue[_Item[T]] = asyncio.Queue(
+        maxsize=max_size if policy == OverflowPolicy.BLOCK else 0
+    )
+    high_water = 0
+
+    async def _read() -> None:
+        nonlocal high_water
+        try:
+            async for value in stream:
+                if policy == OverflowPolicy.FAIL and queue.qsize() >= max_size:
+                    stream_buffer_overflow_counter.add(
+                        1, {"deployment": deployment, "policy": policy.value}
+                    )
+                    raise StreamBufferOverflowError(
+                        f"The client doesn't keep up with the stream: "
+                        f"more than {max_size} chunks are buffered"
+                    )
+
+                await queue.put(_Item(value=value))
+                high_water = max(high_water, queue.qsize())
+
+            await queue.put(_Item(end=True))
+        except Exception as e:
+            await queue.put(_Item(error=e))
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception as e:
+                    log.debug(f"failed to close the stream: {e}")
+
+    reader = asyncio.create_task(_read())
+    try:
+        while True:
+            item = await queue.get()
+            if item.error is not None:
+                raise item.error
+            if item.end:
+                break
+            yield cast(T, item.value)
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        stream_buffer_high_water_histogram.record(
+            high_water, {"deployment": deployment}
+        )
@@ -1,20 +1,34 @@
 import time
-from typing import Callable
+from typing import Callable, Optional
+
+from opentelemetry.metrics import Histogram
+
+from aidial_adapter_vertexai.telemetry.server_timing import record_server_timing
 
 
 class Timer:
     start: float
     format: str
     printer: Callable[[str], None]
+    histogram: Optional[Histogram]
+    attributes: Optional[dict]
+    stage: Optional[str]
+    """Stage of the Server-Timing breakdown"""
 
     def __init__(
         self,
         format: str = "Elapsed time: {time}",
         printer: Callable[[str], None] = print,
+        histogram: Optional[Histogram] = None,
+        attributes: Optional[dict] = None,
+        stage: Optional[str] = None,
     ):
         self.start = time.perf_counter()
         self.format = format
         self.printer = printer
+        self.histogram = histogram
+        self.attributes = attributes
+        self.stage = stage
 
     def stop(self) -> float:
         return time.perf_counter() - self.start
@@ -26,4 +40,9 @@ class Timer:
         return
 
     def __exit__(self, type, value, traceback):
+        elapsed = self.stop()
+        if self.histogram is not None:
+            self.histogram.record(elapsed * 1000, self.attributes)
+        if self.stage is not None:
+            record_server_timing(self.stage, elapsed)
         self.printer(self.format.format(time=self))
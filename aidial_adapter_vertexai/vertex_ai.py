@@ -1,4 +1,5 @@
 from aiocache import cached
+from google.cloud.aiplatform import initializer as aiplatform_initializer
 from vertexai.preview.language_models import (
     ChatModel,
     CodeChatModel,
@@ -47,3 +48,12 @@ async def get_image_generation_model(model_id: str) -> ImageGenerationModel:
     return await make_single_thread_async(
         ImageGenerationModel.from_pretrained, model_id
     )
+
+
+def get_model_resource_name(model_id: str, region: str) -> str:
+    """
+    The full resource name pins the model to the given region
+    regardless of the default location set by `vertexai.init`.
+    """
+    project = aiplatform_initializer.global_config.project
+    return f"projects/{project}/locations/{region}/publishers/google/models/{model_id}"
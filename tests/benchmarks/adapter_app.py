@@ -0,0 +1,22 @@
+"""
+The adapter application connected to the local Vertex AI stand-in
+at FAKE_VERTEX_ENDPOINT instead of Google Cloud.
+"""
+
+import os
+
+import vertexai
+from google.auth.credentials import AnonymousCredentials
+
+from tests.benchmarks.fake_vertex import insecure_channels
+
+FAKE_VERTEX_ENDPOINT = os.environ["FAKE_VERTEX_ENDPOINT"]
+
+insecure_channels(FAKE_VERTEX_ENDPOINT)
+vertexai.init(
+    api_endpoint=FAKE_VERTEX_ENDPOINT, credentials=AnonymousCredentials()
+)
+
+from aidial_adapter_vertexai.app import app  # noqa: E402
+
+__all__ = ["app"]
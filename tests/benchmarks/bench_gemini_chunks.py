@@ -0,0 +1,121 @@
+"""
+Per-chunk CPU cost of decoding the streamed Gemini responses.
+
+The streams are recorded in the format of `GenerationResponse.to_dict()`.
+
+Usage:
+    python -m tests.benchmarks.bench_gemini_chunks
+"""
+
+import json
+import timeit
+from typing import Any, Dict, List
+
+from vertexai.preview.generative_models import GenerationResponse
+
+from aidial_adapter_vertexai.chat.gemini.chunk import decode_chunk
+
+ITERATIONS = 200
+
+
+def text_chunk(text: str) -> Dict[str, Any]:
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "safety_ratings": [
+                    {"category": "HARM_CATEGORY_HATE_SPEECH"},
+                    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT"},
+                ],
+            }
+        ]
+    }
+
+
+def final_chunk(extra: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [extra]},
+                "finish_reason": "STOP",
+                "citation_metadata": {
+                    "citations": [
+                        {"uri": "https://example.com/page", "title": "Page"}
+                    ]
+                },
+            }
+        ],
+        "usage_metadata": {
+            "prompt_token_count": 1000,
+            "candidates_token_count": 300,
+            "total_token_count": 1300,
+        },
+    }
+
+
+ARGS = {
+    "query": "weather forecast",
+    "limit": 10,
+    "filters": [
+        {"field": f"field_{idx}", "value": {"nested": [1, 2, {"x": "y"}]}}
+        for idx in range(10)
+    ],
+}
+
+STREAMS: Dict[str, List[Dict[str, Any]]] = {
+    "text": [text_chunk("Lorem ipsum dolor sit amet, " * 3)] * 50
+    + [final_chunk({"text": ""})],
+    "function call": [
+        final_chunk({"function_call": {"name": "f", "args": ARGS}})
+    ],
+}
+
+
+def decode_with_wrappers(chunk: GenerationResponse) -> None:
+    if chunk.candidates:
+        candidate = chunk.candidates[0]
+        try:
+            candidate.text
+        except ValueError:
+            pass
+        for call in candidate.function_calls:
+            json.dumps(call.to_dict()["args"])
+        citation_metadata = candidate.citation_metadata
+        for citation in citation_metadata.citations:
+            (citation.uri, citation.title)
+        candidate.finish_reason
+    if chunk.usage_metadata:
+        usage = chunk.usage_metadata
+        (usage.prompt_token_count, usage.candidates_token_count)
+    if chunk.prompt_feedback:
+        pass
+
+
+def main() -> None:
+    print(
+        f"{'stream':>14} {'wrappers, us':>13} {'protobuf, us':>13} {'speedup':>8}"
+    )
+
+    for name, recorded in STREAMS.items():
+        chunks = [GenerationResponse.from_dict(chunk) for chunk in recorded]
+        n = len(chunks) * ITERATIONS
+
+        def run_wrappers() -> None:
+            for chunk in chunks:
+                decode_with_wrappers(chunk)
+
+        def run_protobuf() -> None:
+            for chunk in chunks:
+                decode_chunk(chunk)
+
+        wrappers = timeit.timeit(run_wrappers, number=ITERATIONS) / n
+        protobuf = timeit.timeit(run_protobuf, number=ITERATIONS) / n
+
+        print(
+            f"{name:>14} {wrappers * 1e6:>13.1f} {protobuf * 1e6:>13.1f} "
+            f"{wrappers / protobuf:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
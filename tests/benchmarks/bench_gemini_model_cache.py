@@ -0,0 +1,97 @@
+"""
+Per-request cost of preparing a Gemini model with large tool sets.
+
+Usage:
+    python -m tests.benchmarks.bench_gemini_model_cache
+"""
+
+import timeit
+from typing import List
+
+import vertexai
+from aidial_sdk.chat_completion import Function
+from vertexai.preview.generative_models import GenerativeModel, Part
+
+from aidial_adapter_vertexai.chat.gemini.model_cache import GenerativeModelCache
+from aidial_adapter_vertexai.chat.tools import ToolsConfig
+
+RESOURCE_NAME = "projects/project/locations/us-central1/publishers/google/models/gemini-1.5-pro-002"
+TOOL_COUNTS = [0, 10, 50, 200]
+ITERATIONS = 50
+MODELS_PER_REQUEST = 10
+
+
+def create_functions(n: int) -> List[Function]:
+    return [
+        Function(
+            name=f"function_{idx}",
+            description=f"Function number {idx} which does something useful",
+            parameters={
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Query"},
+                    "limit": {"type": "integer", "description": "Limit"},
+                    "filters": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "field": {"type": "string"},
+                                "value": {"type": "string"},
+                            },
+                        },
+                    },
+                },
+                "required": ["query"],
+            },
+        )
+        for idx in range(n)
+    ]
+
+
+def main() -> None:
+    vertexai.init(project="project", location="us-central1")
+    system_instruction = [Part.from_text("You are a helpful assistant.")]
+    functions = {n: create_functions(n) for n in TOOL_COUNTS}
+
+    cache = GenerativeModelCache(max_size=16)
+
+    def create_tools(n: int) -> ToolsConfig:
+        # The tools config is created anew for each request
+        return ToolsConfig(functions=functions[n], required=False, tool_ids={})
+
+    def uncached_request(n: int) -> None:
+        tools = create_tools(n)
+        for _ in range(MODELS_PER_REQUEST):
+            GenerativeModel(
+                RESOURCE_NAME,
+                tools=tools.to_gemini_tools(),
+                tool_config=tools.to_gemini_tool_config(),
+                system_instruction=system_instruction,  # type: ignore
+            )
+
+    def cached_request(n: int) -> None:
+        tools = create_tools(n)
+        for _ in range(MODELS_PER_REQUEST):
+            cache.get(RESOURCE_NAME, tools, system_instruction)
+
+    print(
+        f"Preparation of {MODELS_PER_REQUEST} models per request "
+        "(generation and token counting during truncation)"
+    )
+    print(
+        f"{'tools':>6} {'uncached, ms':>14} {'cached, ms':>12} {'speedup':>8}"
+    )
+
+    for n in TOOL_COUNTS:
+        uncached = timeit.timeit(lambda: uncached_request(n), number=ITERATIONS)
+        cached = timeit.timeit(lambda: cached_request(n), number=ITERATIONS)
+
+        print(
+            f"{n:>6} {uncached / ITERATIONS * 1000:>14.3f} "
+            f"{cached / ITERATIONS * 1000:>12.3f} {uncached / cached:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
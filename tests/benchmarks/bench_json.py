@@ -0,0 +1,143 @@
+"""
+Serialization of the debug payloads: the previous implementation,
+which converted the whole object to a dictionary and then truncated it
+in two more passes, vs. the single bounded pass.
+
+The prompts are Gemini conversations with large inline attachments.
+
+Usage:
+    python -m tests.benchmarks.bench_json
+"""
+
+import json
+import random
+import timeit
+from dataclasses import asdict, is_dataclass
+from enum import Enum
+from typing import Any, Dict
+
+import proto
+from pydantic import BaseModel
+from vertexai.preview.generative_models import Content, Part
+
+from aidial_adapter_vertexai.chat.gemini.prompt.base import GeminiPrompt
+from aidial_adapter_vertexai.utils.json import json_dumps, json_dumps_short
+from aidial_adapter_vertexai.utils.protobuf import message_to_dict
+
+ITERATIONS = 20
+
+
+def _to_dict(obj: Any) -> Any:
+    if isinstance(obj, bytes):
+        return f"<bytes>({len(obj):_} B)"
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, dict):
+        return {key: _to_dict(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_dict(element) for element in obj]
+    if isinstance(obj, BaseModel):
+        return _to_dict(obj.dict())
+    if isinstance(obj, proto.Message):
+        return _to_dict(message_to_dict(obj))
+    if hasattr(obj, "to_dict"):
+        return _to_dict(obj.to_dict())
+    if is_dataclass(type(obj)):
+        return _to_dict(asdict(obj))
+    return obj
+
+
+def _truncate(obj: Any, string_limit: int, list_len_limit: int) -> Any:
+    def rec(val: Any) -> Any:
+        return _truncate(val, string_limit, list_len_limit)
+
+    if isinstance(obj, dict):
+        return {key: rec(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        if len(obj) > list_len_limit:
+            skip = len(obj) - list_len_limit
+            obj = (
+                obj[: list_len_limit // 2]
+                + [f"...({skip:_} skipped)..."]
+                + obj[-list_len_limit // 2 :]
+            )
+        return [rec(element) for element in obj]
+    if isinstance(obj, str) and len(obj) > string_limit:
+        skip = len(obj) - string_limit
+        return (
+            obj[: string_limit // 2]
+            + f"...({skip:_} skipped)..."
+            + obj[-string_limit // 2 :]
+        )
+    return obj
+
+
+def previous_json_dumps(obj: Any) -> str:
+    return json.dumps(_to_dict(obj), default=str)
+
+
+def previous_json_dumps_short(obj: Any) -> str:
+    return json.dumps(_truncate(_to_dict(obj), 100, 10), default=str)
+
+
+def create_prompt(message_count: int, image_count: int) -> GeminiPrompt:
+    rnd = random.Random(0)
+    contents = [
+        Content(
+            role="user" if idx % 2 == 0 else "model",
+            parts=[Part.from_text(" ".join(["word"] * rnd.randint(5, 500)))],
+        )
+        for idx in range(message_count)
+    ]
+    contents.append(
+        Content(
+            role="user",
+            parts=[
+                Part.from_data(rnd.randbytes(1_000_000), "image/png")
+                for _ in range(image_count)
+            ]
+            + [Part.from_text("What's in the images?")],
+        )
+    )
+    return GeminiPrompt(
+        system_instruction=[Part.from_text("You are a helpful assistant.")],
+        contents=contents,
+    )
+
+
+PROMPTS: Dict[str, GeminiPrompt] = {
+    "short chat": create_prompt(2, 0),
+    "long chat": create_prompt(200, 0),
+    "1 image": create_prompt(2, 1),
+    "5 images": create_prompt(2, 5),
+    "long chat, 5 images": create_prompt(200, 5),
+}
+
+
+def main() -> None:
+    print(
+        f"{'prompt':>20} {'mode':>6} {'previous, ms':>13} "
+        f"{'single pass, ms':>16} {'speedup':>8}"
+    )
+
+    for name, prompt in PROMPTS.items():
+        for mode, previous, current in [
+            ("full", previous_json_dumps, json_dumps),
+            ("short", previous_json_dumps_short, json_dumps_short),
+        ]:
+            before = (
+                timeit.timeit(lambda: previous(prompt), number=ITERATIONS)
+                / ITERATIONS
+            )
+            after = (
+                timeit.timeit(lambda: current(prompt), number=ITERATIONS)
+                / ITERATIONS
+            )
+            print(
+                f"{name:>20} {mode:>6} {before * 1e3:>13.2f} "
+                f"{after * 1e3:>16.2f} {before / after:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
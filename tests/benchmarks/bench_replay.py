@@ -0,0 +1,369 @@
+"""
+Replay of the captured traffic against the adapter
+running with the local stand-ins of Vertex AI and DIAL file storage.
+
+The traffic is captured by the adapter when TRAFFIC_CAPTURE_FILE
+env variable is set. The captured shapes of the requests are turned into
+synthetic requests of the same structure: the same deployments, endpoints
+and parameters, the messages of the same roles and lengths, the attachments
+of the same types and sizes, the same number of tools and tool calls.
+
+The requests are sent at the recorded arrival times, which could be
+compressed or stretched by `--speed`. The results are reported per
+deployment and endpoint, along with the latencies recorded in the capture.
+
+The multi-modal embedding inputs (`custom_input`) aren't replayed.
+
+Usage:
+    python -m tests.benchmarks.bench_replay capture.jsonl --speed 2 \
+        --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import mimetypes
+import time
+from collections import defaultdict, deque
+from dataclasses import asdict
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from tests.benchmarks.bench_server import (
+    Result,
+    Samples,
+    Scenario,
+    add_local_adapter_args,
+    get_fake_vertex_config,
+    local_adapter,
+    percentile,
+    print_header,
+    print_result,
+    send_request,
+    write_results,
+)
+from tests.benchmarks.fake_dial import attachment_url
+
+LOREM = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+DEFAULT_ATTACHMENT_SIZE = 100_000
+"""Size of the attachments which weren't downloaded when captured"""
+
+
+def synthetic_text(length: int) -> str:
+    return (LOREM * (length // len(LOREM) + 1))[:length]
+
+
+def _function(idx: int) -> Dict[str, Any]:
+    return {
+        "name": f"function_{idx}",
+        "description": f"Function number {idx}",
+        "parameters": {
+            "type": "object",
+            "properties": {"query": {"type": "string"}},
+        },
+    }
+
+
+def build_attachment(shape: Dict[str, Any]) -> Dict[str, Any]:
+    type = shape.get("type")
+    ext = shape.get("ext")
+    if type is None:
+        type = mimetypes.guess_type(f"file.{ext}")[0] or "image/png"
+    if ext is None:
+        ext = (mimetypes.guess_extension(type) or ".png").lstrip(".")
+
+    size = shape.get("size") or DEFAULT_ATTACHMENT_SIZE
+    return {"type": type, "url": attachment_url(size, ext)}
+
+
+def build_chat_request(shape: Dict[str, Any]) -> Dict[str, Any]:
+    messages: List[Dict[str, Any]] = []
+    tool_call_ids: Deque[str] = deque()
+
+    for idx, message_shape in enumerate(shape["messages"]):
+        role = message_shape["role"]
+        length = message_shape["content_length"]
+        message: Dict[str, Any] = {
+            "role": role,
+            "content": synthetic_text(length) if length else None,
+        }
+
+        if role not in ("assistant", "tool", "function") and length == 0:
+            message["content"] = ""
+
+        if attachments := message_shape["attachments"]:
+            message["custom_content"] = {
+                "attachments": [build_attachment(a) for a in attachments]
+            }
+
+        if count := message_shape["tool_calls"]:
+            ids = [f"call_{idx}_{n}" for n in range(count)]
+            tool_call_ids.extend(ids)
+            message["tool_calls"] = [
+                {
+                    "id": id,
+                    "type": "function",
+                    "function": {"name": "function_0", "arguments": "{}"},
+                }
+                for id in ids
+            ]
+
+        if message_shape["function_call"]:
+            message["function_call"] = {"name": "function_0", "arguments": "{}"}
+
+        if role == "tool":
+            message["tool_call_id"] = (
+                tool_call_ids.popleft() if tool_call_ids else "call"
+            )
+            message["content"] = message["content"] or ""
+
+        if role == "function":
+            message["name"] = "function_0"
+            message["content"] = message["content"] or ""
+
+        messages.append(message)
+
+    request: Dict[str, Any] = {"messages": messages, **shape["parameters"]}
+
+    if shape["stop"]:
+        request["stop"] = [f"STOP{idx}" for idx in range(shape["stop"])]
+
+    has_tool_calls = any(m["tool_calls"] for m in shape["messages"])
+    if tools := max(shape["tools"], int(has_tool_calls)):
+        request["tools"] = [
+            {"type": "function", "function": _function(idx)}
+            for idx in range(tools)
+        ]
+
+    has_function_call = any(m["function_call"] for m in shape["messages"])
+    if functions := max(shape["functions"], int(has_function_call)):
+        request["functions"] = [_function(idx) for idx in range(functions)]
+
+    if (choice := shape["tool_choice"]) is not None:
+        if "tools" in request:
+            request["tool_choice"] = (
+                {"type": "function", "function": {"name": "function_0"}}
+                if choice == "function"
+                else choice
+            )
+        elif "functions" in request:
+            request["function_call"] = (
+                {"name": "function_0"} if choice == "function" else choice
+            )
+
+    return request
+
+
+def build_embeddings_request(shape: Dict[str, Any]) -> Dict[str, Any]:
+    request: Dict[str, Any] = {
+        "input": [synthetic_text(length) for length in shape["inputs"]]
+    }
+
+    for name in ("dimensions", "encoding_format"):
+        if shape.get(name) is not None:
+            request[name] = shape[name]
+
+    custom_fields: Dict[str, Any] = {}
+    if shape.get("type") is not None:
+        custom_fields["type"] = shape["type"]
+    if shape.get("instruction_length"):
+        custom_fields["instruction"] = synthetic_text(
+            shape["instruction_length"]
+        )
+    if custom_fields:
+        request["custom_fields"] = custom_fields
+
+    return request
+
+
+def build_request(endpoint: str, shape: Dict[str, Any]) -> Dict[str, Any]:
+    match endpoint:
+        case "chat/completions":
+            return build_chat_request(shape)
+        case "embeddings":
+            return build_embeddings_request(shape)
+        case "tokenize":
+            return {
+                "inputs": [
+                    (
+                        {
+                            "type": "request",
+                            "value": build_chat_request(input["request"]),
+                        }
+                        if input["type"] == "request"
+                        else {
+                            "type": "string",
+                            "value": synthetic_text(input["length"]),
+                        }
+                    )
+                    for input in shape["inputs"]
+                ]
+            }
+        case "truncate_prompt":
+            return {"inputs": [build_chat_request(s) for s in shape["inputs"]]}
+        case _:
+            raise ValueError(f"Unsupported endpoint: {endpoint}")
+
+
+def build_scenario(
+    record: Dict[str, Any], deployment_map: Dict[str, str]
+) -> Scenario:
+    deployment = deployment_map.get(record["deployment"], record["deployment"])
+    endpoint = record["endpoint"]
+    body = build_request(endpoint, record["request"])
+    stream = bool(body.get("stream"))
+    return Scenario(
+        name=f"{deployment} {endpoint}" + (" stream" if stream else ""),
+        path=f"/openai/deployments/{deployment}/{endpoint}",
+        body=body,
+        stream=stream,
+    )
+
+
+def read_capture(path: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["timestamp"])
+    return records[:limit] if limit else records
+
+
+async def replay(
+    url: str, records: List[Tuple[float, Scenario]], speed: float
+) -> Tuple[Dict[str, Samples], float, int]:
+    """
+    Sends the requests at the given times (in seconds from the first one),
+    returns the samples by scenario, the duration and the peak concurrency.
+    """
+    samples: Dict[str, Samples] = defaultdict(Samples)
+    in_flight = peak = 0
+
+    async def send(session: aiohttp.ClientSession, scenario: Scenario):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await send_request(session, url, scenario, samples[scenario.name])
+        finally:
+            in_flight -= 1
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout
+    ) as session:
+        tasks: List[asyncio.Task] = []
+        start = time.perf_counter()
+        for offset, scenario in records:
+            delay = offset / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(session, scenario)))
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+
+    return samples, duration, peak
+
+
+def get_recorded_latencies(
+    records: List[Dict[str, Any]], scenarios: List[Scenario]
+) -> Dict[str, Dict[str, Optional[float]]]:
+    durations: Dict[str, List[float]] = defaultdict(list)
+    for record, scenario in zip(records, scenarios):
+        if record.get("status") == 200 and record.get("duration") is not None:
+            durations[scenario.name].append(record["duration"])
+
+    return {
+        name: {
+            "latency_p50": percentile(values, 0.5),
+            "latency_p99": percentile(values, 0.99),
+        }
+        for name, values in durations.items()
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="File captured by the adapter")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Multiplier of the recorded arrival rate",
+    )
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--deployment-map",
+        type=json.loads,
+        default={},
+        help="JSON object mapping the recorded deployments to the replayed ones",
+    )
+    parser.add_argument("--output", default=None)
+    add_local_adapter_args(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    records = read_capture(args.capture, args.limit)
+    if not records:
+        print("The capture is empty")
+        return
+
+    scenarios = [build_scenario(r, args.deployment_map) for r in records]
+    first = records[0]["timestamp"]
+    schedule = [
+        (record["timestamp"] - first, scenario)
+        for record, scenario in zip(records, scenarios)
+    ]
+
+    with local_adapter(args) as url:
+        samples, duration, peak = asyncio.run(replay(url, schedule, args.speed))
+
+    results = [
+        Result(
+            scenario=name,
+            concurrency=peak,
+            requests=len(s.latencies) + s.errors,
+            errors=s.errors,
+            duration=duration,
+            throughput=len(s.latencies) / duration,
+            latency_p50=percentile(s.latencies, 0.5),
+            latency_p99=percentile(s.latencies, 0.99),
+            ttft_p50=percentile(s.ttfts, 0.5),
+            ttft_p99=percentile(s.ttfts, 0.99),
+        )
+        for name, s in sorted(samples.items())
+    ]
+    recorded = get_recorded_latencies(records, scenarios)
+
+    print(
+        f"Replayed {len(records)} requests in {duration:.1f}s "
+        f"at {args.speed}x speed, peak concurrency {peak}"
+    )
+    print_header()
+    for result in results:
+        print_result(result)
+
+    print("\nRecorded latencies:")
+    for name, latencies in sorted(recorded.items()):
+        p50, p99 = latencies["latency_p50"], latencies["latency_p99"]
+        print(
+            f"{name:>40} p50 {(p50 or 0) * 1e3:>9.1f} ms "
+            f"p99 {(p99 or 0) * 1e3:>9.1f} ms"
+        )
+
+    if args.output:
+        write_results(
+            args.output,
+            results,
+            capture=args.capture,
+            speed=args.speed,
+            fake_vertex=asdict(get_fake_vertex_config(args)),
+            recorded=recorded,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""
+End-to-end load benchmark of the adapter server.
+
+The adapter is started against local stand-ins of the Vertex AI endpoint
+(see `fake_vertex.py`) and the DIAL file storage (see `fake_dial.py`),
+so no Google Cloud access is needed.
+
+The identical requests of a scenario would be served by the request
+coalescing and the truncation hint cache instead of being processed,
+so both are disabled unless REQUEST_COALESCING and
+TRUNCATION_HINT_CACHE_SIZE are set explicitly. The effective settings
+are recorded in the results.
+
+Each scenario is run at every concurrency level of the sweep.
+The throughput, the latency and, for the streaming scenarios,
+the time to the first content chunk are reported and written as JSON,
+so that the results of different versions could be compared
+with `--compare`.
+
+Usage:
+    python -m tests.benchmarks.bench_server --concurrency 1,8,32 \
+        --output results.json [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from multiprocessing import Process
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+
+from tests.benchmarks.fake_dial import attachment_url, start_fake_dial
+from tests.benchmarks.fake_vertex import FakeVertexConfig, start_fake_vertex
+from tests.server import server_generator, terminate_process
+
+CHAT_DEPLOYMENT = "gemini-1.5-flash-002"
+EMBEDDINGS_DEPLOYMENT = "text-embedding-004"
+HEADERS = {"api-key": "benchmark"}
+HOST = "127.0.0.1"
+
+CACHE_SETTINGS = {
+    "REQUEST_COALESCING": "false",
+    "TRUNCATION_HINT_CACHE_SIZE": "0",
+}
+"""Defaults of the adapter settings which let it skip the repeated work"""
+
+
+def get_cache_settings() -> Dict[str, str]:
+    return {
+        name: os.getenv(name, default)
+        for name, default in CACHE_SETTINGS.items()
+    }
+
+
+@dataclass
+class Scenario:
+    name: str
+    path: str
+    body: Dict[str, Any]
+    stream: bool = False
+
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    requests: int
+    errors: int
+    duration: float
+    throughput: float
+    """Successful requests per second"""
+    latency_p50: Optional[float]
+    latency_p99: Optional[float]
+    ttft_p50: Optional[float] = None
+    ttft_p99: Optional[float] = None
+
+
+@dataclass
+class Samples:
+    latencies: List[float] = field(default_factory=list)
+    ttfts: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+def conversation(message_count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "role": "user" if idx % 2 == 0 else "assistant",
+            "content": f"Message number {idx}. " + "Lorem ipsum dolor. " * 20,
+        }
+        for idx in range(message_count - message_count % 2 + 1)
+    ]
+
+
+def create_scenarios(attachment_size: int) -> List[Scenario]:
+    chat = f"/openai/deployments/{CHAT_DEPLOYMENT}"
+    messages = conversation(10)
+    long_messages = conversation(100)
+
+    with_attachment = [
+        {
+            "role": "user",
+            "content": "What is in the image?",
+            "custom_content": {
+                "attachments": [
+                    {
+                        "type": "image/png",
+                        "url": attachment_url(attachment_size),
+                    }
+                ]
+            },
+        }
+    ]
+
+    return [
+        Scenario(
+            "chat_stream",
+            f"{chat}/chat/completions",
+            {"messages": messages, "stream": True},
+            stream=True,
+        ),
+        Scenario(
+            "chat",
+            f"{chat}/chat/completions",
+            {"messages": messages, "stream": False},
+        ),
+        Scenario(
+            "chat_stream_attachment",
+            f"{chat}/chat/completions",
+            {"messages": with_attachment, "stream": True},
+            stream=True,
+        ),
+        Scenario(
+            "tokenize",
+            f"{chat}/tokenize",
+            {"inputs": [{"type": "request", "value": {"messages": messages}}]},
+        ),
+        Scenario(
+            "truncate",
+            f"{chat}/truncate_prompt",
+            {
+                "inputs": [
+                    {"messages": long_messages, "max_prompt_tokens": 2_000}
+                ]
+            },
+        ),
+        Scenario(
+            "embeddings",
+            f"/openai/deployments/{EMBEDDINGS_DEPLOYMENT}/embeddings",
+            {"input": [f"Text number {idx}" for idx in range(16)]},
+        ),
+    ]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def send_request(
+    session: aiohttp.ClientSession,
+    url: str,
+    scenario: Scenario,
+    samples: Samples,
+) -> None:
+    start = time.perf_counter()
+    ttft: Optional[float] = None
+    ok = True
+
+    try:
+        async with session.post(
+            url + scenario.path, json=scenario.body, headers=HEADERS
+        ) as response:
+            ok = response.status == 200
+            if scenario.stream:
+                async for line in response.content:
+                    if not line.startswith(b"data:"):
+                        continue
+                    if b'"error"' in line:
+                        ok = False
+                    elif ttft is None and b'"content"' in line:
+                        ttft = time.perf_counter() - start
+            else:
+                await response.read()
+    except aiohttp.ClientError:
+        ok = False
+
+    if not ok:
+        samples.errors += 1
+        return
+
+    samples.latencies.append(time.perf_counter() - start)
+    if ttft is not None:
+        samples.ttfts.append(ttft)
+
+
+async def run_level(
+    url: str, scenario: Scenario, concurrency: int, request_count: int
+) -> Result:
+    samples = Samples()
+    remaining = request_count
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await send_request(session, url, scenario, samples)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout
+    ) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+
+    return Result(
+        scenario=scenario.name,
+        concurrency=concurrency,
+        requests=request_count,
+        errors=samples.errors,
+        duration=duration,
+        throughput=len(samples.latencies) / duration,
+        latency_p50=percentile(samples.latencies, 0.5),
+        latency_p99=percentile(samples.latencies, 0.99),
+        ttft_p50=percentile(samples.ttfts, 0.5),
+        ttft_p99=percentile(samples.ttfts, 0.99),
+    )
+
+
+def _run_fakes(config: FakeVertexConfig, vertex_port: int, dial_port: int):
+    async def run() -> None:
+        vertex = await start_fake_vertex(config, f"{HOST}:{vertex_port}")
+        dial = await start_fake_dial(HOST, dial_port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await dial.cleanup()
+            await vertex.stop(None)
+
+    asyncio.run(run())
+
+
+def _wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with socket.create_connection((HOST, port), timeout=1):
+                return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _get_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def _format(value: Optional[float], scale: float = 1e3) -> str:
+    return "-" if value is None else f"{value * scale:.1f}"
+
+
+def print_header() -> None:
+    print(
+        f"{'scenario':>40} {'conc':>5} {'rps':>8} {'errors':>7} "
+        f"{'p50, ms':>9} {'p99, ms':>9} {'ttft p50':>9} {'ttft p99':>9}"
+    )
+
+
+def print_result(r: Result) -> None:
+    print(
+        f"{r.scenario:>40} {r.concurrency:>5} {r.throughput:>8.1f} "
+        f"{r.errors:>7} {_format(r.latency_p50):>9} "
+        f"{_format(r.latency_p99):>9} {_format(r.ttft_p50):>9} "
+        f"{_format(r.ttft_p99):>9}"
+    )
+
+
+def print_comparison(results: List[Result], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {
+            (r["scenario"], r["concurrency"]): r
+            for r in json.load(f)["results"]
+        }
+
+    def ratio(new: Optional[float], old: Optional[float]) -> str:
+        return "-" if not new or not old else f"{new / old:.2f}x"
+
+    print(f"\nCompared to {baseline_path} (new / baseline):")
+    print(
+        f"{'scenario':>40} {'conc':>5} {'rps':>8} {'p50':>8} {'p99':>8} "
+        f"{'ttft p50':>9}"
+    )
+    for r in results:
+        old = baseline.get((r.scenario, r.concurrency))
+        if old is None:
+            continue
+        print(
+            f"{r.scenario:>40} {r.concurrency:>5} "
+            f"{ratio(r.throughput, old['throughput']):>8} "
+            f"{ratio(r.latency_p50, old['latency_p50']):>8} "
+            f"{ratio(r.latency_p99, old['latency_p99']):>8} "
+            f"{ratio(r.ttft_p50, old['ttft_p50']):>9}"
+        )
+
+
+def add_local_adapter_args(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeVertexConfig()
+    parser.add_argument("--port", type=int, default=5011)
+    parser.add_argument("--vertex-port", type=int, default=5012)
+    parser.add_argument("--dial-port", type=int, default=5013)
+    parser.add_argument("--latency", type=float, default=defaults.latency)
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size)
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=defaults.tokens_per_second
+    )
+    parser.add_argument(
+        "--completion-tokens", type=int, default=defaults.completion_tokens
+    )
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+
+
+def get_fake_vertex_config(args: argparse.Namespace) -> FakeVertexConfig:
+    return FakeVertexConfig(
+        latency=args.latency,
+        chunk_size=args.chunk_size,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+    )
+
+
+@contextmanager
+def local_adapter(args: argparse.Namespace) -> Iterator[str]:
+    """
+    Runs the adapter against the local stand-ins and yields its URL.
+    """
+    fakes = Process(
+        target=_run_fakes,
+        args=(get_fake_vertex_config(args), args.vertex_port, args.dial_port),
+    )
+    fakes.start()
+
+    os.environ.update(
+        {
+            "FAKE_VERTEX_ENDPOINT": f"{HOST}:{args.vertex_port}",
+            "DIAL_URL": f"http://{HOST}:{args.dial_port}",
+            "GCP_PROJECT_ID": "benchmark",
+            "DEFAULT_REGION": "us-central1",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+            **get_cache_settings(),
+        }
+    )
+    url = f"http://{HOST}:{args.port}"
+    server = server_generator("tests.benchmarks.adapter_app:app", url)
+
+    try:
+        _wait_for_port(args.vertex_port)
+        _wait_for_port(args.dial_port)
+        next(server)
+        yield url
+    finally:
+        next(server, None)
+        terminate_process(fakes)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument(
+        "--requests", type=int, default=4, help="Requests per worker"
+    )
+    parser.add_argument(
+        "--scenarios", default=None, help="Comma-separated, all by default"
+    )
+    parser.add_argument("--attachment-size", type=int, default=1_000_000)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    add_local_adapter_args(parser)
+    return parser.parse_args()
+
+
+def write_results(path: str, results: List[Any], **extra: Any) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "revision": _get_revision(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "cache_settings": get_cache_settings(),
+                **extra,
+                "results": [asdict(r) for r in results],
+            },
+            f,
+            indent=2,
+        )
+
+
+def main() -> None:
+    args = parse_args()
+
+    scenarios = create_scenarios(args.attachment_size)
+    if args.scenarios:
+        names = args.scenarios.split(",")
+        scenarios = [s for s in scenarios if s.name in names]
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    results: List[Result] = []
+    with local_adapter(args) as url:
+        print_header()
+        for scenario in scenarios:
+            # Warm-up: model clients, connection pools
+            asyncio.run(run_level(url, scenario, 1, 2))
+            for concurrency in levels:
+                result = asyncio.run(
+                    run_level(
+                        url, scenario, concurrency, concurrency * args.requests
+                    )
+                )
+                print_result(result)
+                results.append(result)
+
+    if args.output:
+        write_results(
+            args.output,
+            results,
+            fake_vertex=asdict(get_fake_vertex_config(args)),
+        )
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Prompt truncation of long Gemini conversations by different strategies.
+
+The token counting is emulated by a tokenizer with the latency
+of a remote count_tokens call.
+
+Usage:
+    python -m tests.benchmarks.bench_truncation
+"""
+
+import asyncio
+import random
+import time
+from typing import List, Tuple
+
+from vertexai.preview.generative_models import Content, Part
+
+from aidial_adapter_vertexai.chat.gemini.prompt.base import GeminiPrompt
+from aidial_adapter_vertexai.chat.truncate_prompt import TruncationStrategy
+from aidial_adapter_vertexai.chat.truncation_hints import (
+    partition_token_counts,
+    truncation_hints,
+)
+
+MESSAGE_COUNT = 500
+COUNT_TOKENS_LATENCY = 0.02
+KEPT_FRACTIONS = [0.1, 0.5, 0.9]
+
+
+def create_prompt(message_count: int) -> GeminiPrompt:
+    rnd = random.Random(0)
+    contents = [
+        Content(
+            role="user" if idx % 2 == 0 else "model",
+            parts=[Part.from_text(" ".join(["word"] * rnd.randint(5, 100)))],
+        )
+        for idx in range(message_count + 1)
+    ]
+    return GeminiPrompt(
+        system_instruction=[Part.from_text("You are a helpful assistant.")],
+        contents=contents,
+    )
+
+
+class Tokenizer:
+    calls: int = 0
+
+    async def __call__(self, prompt: GeminiPrompt) -> int:
+        self.calls += 1
+        await asyncio.sleep(COUNT_TOKENS_LATENCY)
+        parts = [*(prompt.system_instruction or [])] + [
+            part for content in prompt.contents for part in content.parts
+        ]
+        return sum(len(part.text.split()) for part in parts)
+
+
+async def measure(
+    prompt: GeminiPrompt,
+    user_limit: int,
+    strategy: TruncationStrategy,
+    hint_scope: str | None = None,
+) -> Tuple[int, float]:
+    tokenizer = Tokenizer()
+    start = time.perf_counter()
+    await prompt.truncate(
+        tokenizer=tokenizer,
+        user_limit=user_limit,
+        strategy=strategy,
+        hint_scope=hint_scope,
+    )
+    return tokenizer.calls, time.perf_counter() - start
+
+
+async def main() -> None:
+    prompt = create_prompt(MESSAGE_COUNT)
+    next_turn = create_prompt(MESSAGE_COUNT + 2)
+    total = await Tokenizer()(prompt)
+
+    print(
+        f"Truncation of {MESSAGE_COUNT} messages ({total} tokens), "
+        f"count_tokens latency {COUNT_TOKENS_LATENCY * 1000:.0f}ms"
+    )
+    print(f"{'kept':>5} {'strategy':>32} {'calls':>6} {'time, s':>8}")
+
+    for fraction in KEPT_FRACTIONS:
+        user_limit = int(total * fraction)
+        rows: List[Tuple[str, Tuple[int, float]]] = []
+
+        rows.append(
+            (
+                "greedy",
+                await measure(prompt, user_limit, TruncationStrategy.GREEDY),
+            )
+        )
+        rows.append(
+            (
+                "prefix sums",
+                await measure(
+                    prompt, user_limit, TruncationStrategy.PREFIX_SUM
+                ),
+            )
+        )
+
+        for strategy in TruncationStrategy:
+            truncation_hints.clear()
+            partition_token_counts.clear()
+            await measure(prompt, user_limit, strategy, "model")
+            rows.append(
+                (
+                    f"{strategy.value}, next turn",
+                    await measure(next_turn, user_limit, strategy, "model"),
+                )
+            )
+
+        for name, (calls, elapsed) in rows:
+            print(f"{fraction:>5.0%} {name:>32} {calls:>6} {elapsed:>8.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
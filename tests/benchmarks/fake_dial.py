@@ -0,0 +1,45 @@
+"""
+Local stand-in for the DIAL file storage.
+
+Serves the bucket of the application and synthetic files:
+`files/<bucket>/<name>_<size>.<ext>` is a file of `size` random bytes.
+"""
+
+import random
+
+from aiohttp import web
+
+BUCKET = "benchmark"
+APPDATA = f"{BUCKET}/appdata/vertexai"
+
+
+def attachment_url(size: int, ext: str = "png") -> str:
+    return f"files/{BUCKET}/attachment_{size}.{ext}"
+
+
+async def get_bucket(request: web.Request) -> web.Response:
+    return web.json_response({"bucket": BUCKET, "appdata": APPDATA})
+
+
+async def get_file(request: web.Request) -> web.Response:
+    name = request.match_info["path"].rsplit("/", 1)[-1]
+    size = int(name.rsplit(".", 1)[0].rsplit("_", 1)[-1])
+    return web.Response(body=random.Random(size).randbytes(size))
+
+
+async def put_file(request: web.Request) -> web.Response:
+    await request.read()
+    path = request.match_info["path"]
+    return web.json_response({"url": f"files/{path}", "name": path})
+
+
+async def start_fake_dial(host: str, port: int) -> web.AppRunner:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_get("/v1/bucket", get_bucket)
+    app.router.add_get("/v1/files/{path:.+}", get_file)
+    app.router.add_put("/v1/files/{path:.+}", put_file)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
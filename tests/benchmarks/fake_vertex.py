@@ -0,0 +1,286 @@
+"""
+Local stand-in for the Vertex AI prediction endpoint.
+
+A gRPC server implementing the calls the adapter makes:
+* `GenerateContent` and `StreamGenerateContent` for Gemini,
+* `CountTokens` for Gemini tokenization and prompt truncation,
+* `Predict` for the text embeddings,
+* `GetPublisherModel` for `*.from_pretrained`.
+
+The responses are synthetic; the latency, the streaming speed
+and the fraction of failed calls are configurable.
+"""
+
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Type
+
+import grpc
+import proto
+from google.cloud import aiplatform_v1, aiplatform_v1beta1
+from vertexai.preview.language_models import TextEmbeddingModel
+
+WORD = "lorem "
+TOKENS_PER_IMAGE = 258
+
+
+@dataclass
+class FakeVertexConfig:
+    latency: float = 0.1
+    """Delay in seconds before the response or the first chunk"""
+    chunk_size: int = 8
+    """Number of tokens in a streamed chunk"""
+    tokens_per_second: float = 200
+    """Generation speed, which sets the delay between the chunks"""
+    completion_tokens: int = 256
+    """Number of tokens in a generated response"""
+    error_rate: float = 0.0
+    """Fraction of the calls failing with UNAVAILABLE"""
+    embedding_dimensions: int = 768
+
+
+class FakeVertexServer:
+    config: FakeVertexConfig
+    _rnd: random.Random
+
+    def __init__(self, config: FakeVertexConfig):
+        self.config = config
+        self._rnd = random.Random(0)
+
+    async def _fail_sometimes(self, context: grpc.aio.ServicerContext) -> None:
+        if self._rnd.random() < self.config.error_rate:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+
+    def _usage(self, types: Any, request: Any, completion_tokens: int) -> Any:
+        prompt_tokens = _count_tokens(request.contents)
+        return types.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            total_token_count=prompt_tokens + completion_tokens,
+        )
+
+    @staticmethod
+    def _response(
+        types: Any, text: str, finish: bool, usage: Any = None
+    ) -> Any:
+        candidate = types.Candidate(
+            index=0,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            finish_reason=(
+                types.Candidate.FinishReason.STOP
+                if finish
+                else types.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED
+            ),
+        )
+        return types.GenerateContentResponse(
+            candidates=[candidate], usage_metadata=usage
+        )
+
+    async def generate_content(
+        self, types: Any, request: Any, context: grpc.aio.ServicerContext
+    ) -> Any:
+        config = self.config
+        await asyncio.sleep(config.latency)
+        await self._fail_sometimes(context)
+        await asyncio.sleep(config.completion_tokens / config.tokens_per_second)
+
+        return self._response(
+            types,
+            WORD * config.completion_tokens,
+            True,
+            self._usage(types, request, config.completion_tokens),
+        )
+
+    async def stream_generate_content(
+        self, types: Any, request: Any, context: grpc.aio.ServicerContext
+    ) -> AsyncIterator[Any]:
+        config = self.config
+        await asyncio.sleep(config.latency)
+        await self._fail_sometimes(context)
+
+        remaining = config.completion_tokens
+        while remaining > 0:
+            size = min(config.chunk_size, remaining)
+            remaining -= size
+            if remaining == 0:
+                usage = self._usage(types, request, config.completion_tokens)
+                yield self._response(types, WORD * size, True, usage)
+            else:
+                yield self._response(types, WORD * size, False)
+            await asyncio.sleep(size / config.tokens_per_second)
+
+    async def count_tokens(
+        self, types: Any, request: Any, context: grpc.aio.ServicerContext
+    ) -> Any:
+        await asyncio.sleep(self.config.latency)
+        await self._fail_sometimes(context)
+        tokens = _count_tokens(request.contents)
+        return types.CountTokensResponse(
+            total_tokens=tokens, total_billable_characters=tokens * 5
+        )
+
+    async def predict(
+        self, types: Any, request: Any, context: grpc.aio.ServicerContext
+    ) -> Any:
+        await asyncio.sleep(self.config.latency)
+        await self._fail_sometimes(context)
+
+        response = types.PredictResponse()
+        for instance in request.instances:
+            response.predictions.append(
+                {
+                    "embeddings": {
+                        "values": [
+                            self._rnd.random()
+                            for _ in range(self.config.embedding_dimensions)
+                        ],
+                        "statistics": {
+                            "token_count": len(instance["content"].split()),
+                            "truncated": False,
+                        },
+                    }
+                }
+            )
+        return response
+
+    async def get_publisher_model(
+        self, types: Any, request: Any, context: grpc.aio.ServicerContext
+    ) -> Any:
+        model_id = request.name.rsplit("/", 1)[-1]
+        return types.PublisherModel(
+            name=f"publishers/google/models/{model_id}",
+            version_id=model_id.partition("@")[2] or "001",
+            launch_stage=types.PublisherModel.LaunchStage.GA,
+            publisher_model_template=(
+                "projects/{user-project}/locations/{location}"
+                f"/publishers/google/models/{model_id}"
+            ),
+            predict_schemata=types.PredictSchemata(
+                instance_schema_uri=TextEmbeddingModel._INSTANCE_SCHEMA_URI
+            ),
+        )
+
+    def handlers(self) -> list[grpc.GenericRpcHandler]:
+        ret: list[grpc.GenericRpcHandler] = []
+        for version, types in [
+            ("v1", aiplatform_v1),
+            ("v1beta1", aiplatform_v1beta1),
+        ]:
+            prediction = {
+                "GenerateContent": _unary(
+                    self.generate_content,
+                    types,
+                    types.GenerateContentRequest,
+                    types.GenerateContentResponse,
+                ),
+                "StreamGenerateContent": _stream(
+                    self.stream_generate_content,
+                    types,
+                    types.GenerateContentRequest,
+                    types.GenerateContentResponse,
+                ),
+                "CountTokens": _unary(
+                    self.count_tokens,
+                    types,
+                    types.CountTokensRequest,
+                    types.CountTokensResponse,
+                ),
+                "Predict": _unary(
+                    self.predict,
+                    types,
+                    types.PredictRequest,
+                    types.PredictResponse,
+                ),
+            }
+            model_garden = {
+                "GetPublisherModel": _unary(
+                    self.get_publisher_model,
+                    types,
+                    types.GetPublisherModelRequest,
+                    types.PublisherModel,
+                )
+            }
+            ret += [
+                grpc.method_handlers_generic_handler(
+                    f"google.cloud.aiplatform.{version}.PredictionService",
+                    prediction,
+                ),
+                grpc.method_handlers_generic_handler(
+                    f"google.cloud.aiplatform.{version}.ModelGardenService",
+                    model_garden,
+                ),
+            ]
+        return ret
+
+
+def _count_tokens(contents: Any) -> int:
+    tokens = 0
+    for content in contents:
+        for part in content.parts:
+            if part.text:
+                tokens += len(part.text.split())
+            elif part.inline_data.data or part.file_data.file_uri:
+                tokens += TOKENS_PER_IMAGE
+    return tokens
+
+
+def _unary(
+    handler: Callable, types: Any, request: Type[proto.Message], response: Any
+) -> grpc.RpcMethodHandler:
+    async def _handle(message: Any, context: grpc.aio.ServicerContext) -> Any:
+        return await handler(types, message, context)
+
+    return grpc.unary_unary_rpc_method_handler(
+        _handle,
+        request_deserializer=request.deserialize,
+        response_serializer=response.serialize,
+    )
+
+
+def _stream(
+    handler: Callable, types: Any, request: Type[proto.Message], response: Any
+) -> grpc.RpcMethodHandler:
+    async def _handle(
+        message: Any, context: grpc.aio.ServicerContext
+    ) -> AsyncIterator[Any]:
+        async for chunk in handler(types, message, context):
+            yield chunk
+
+    return grpc.unary_stream_rpc_method_handler(
+        _handle,
+        request_deserializer=request.deserialize,
+        response_serializer=response.serialize,
+    )
+
+
+async def start_fake_vertex(
+    config: FakeVertexConfig, address: str
+) -> grpc.aio.Server:
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers(FakeVertexServer(config).handlers())
+    server.add_insecure_port(address)
+    await server.start()
+    return server
+
+
+def insecure_channels(endpoint: str) -> None:
+    """
+    Makes the Vertex AI SDK connect to the given endpoint
+    over plain-text gRPC.
+    """
+
+    from google.api_core import grpc_helpers, grpc_helpers_async
+
+    def patch(module: Any, create: Callable[[str], Any]) -> None:
+        original = module.create_channel
+
+        def create_channel(target: str, *args, **kwargs) -> Any:
+            if target == endpoint:
+                return create(target)
+            return original(target, *args, **kwargs)
+
+        module.create_channel = create_channel
+
+    patch(grpc_helpers, grpc.insecure_channel)
+    patch(grpc_helpers_async, grpc.aio.insecure_channel)
@@ -7,17 +7,7 @@ from vertexai.preview.language_models import ChatMessage
 
 from aidial_adapter_vertexai.chat.bison.prompt import BisonPrompt, ChatAuthor
 from tests.unit_tests.prompt_truncation.utils import get_discarded_messages
-
-
-async def tokenize_by_words(prompt: BisonPrompt) -> int:
-    text = " ".join(
-        [
-            prompt.system_instruction or "",
-            *[msg.content for msg in prompt.history],
-            prompt.last_user_message,
-        ]
-    )
-    return len(text.split())
+from tests.utils.bison import tokenize_by_words
 
 
 def user(s: str) -> ChatMessage:
@@ -205,3 +195,31 @@ async def test_history_truncation_last_message_is_too_big(mock_tokenize):
         exc_info.value.message
         == "The requested maximum prompt tokens is 1. However, the system messages and the last user message resulted in 2 tokens. Please reduce the length of the messages or increase the maximum prompt tokens."
     )
+
+
+@pytest.mark.parametrize(
+    "max_prompt_tokens, discarded_messages, prompt_tokens",
+    [(10, [], 6), (5, [1, 2], 4), (3, [1, 2, 3, 4], 2)],
+)
+@pytest.mark.asyncio
+async def test_truncated_prompt_token_count(
+    mock_tokenize, max_prompt_tokens, discarded_messages, prompt_tokens
+):
+    prompt = BisonPrompt(
+        system_instruction="message1",
+        history=[
+            user("message2"),
+            bot("message3"),
+            user("message4"),
+            bot("message5"),
+        ],
+        last_user_message="message6",
+    )
+
+    truncated_prompt = await prompt.truncate(
+        tokenizer=mock_tokenize, user_limit=max_prompt_tokens
+    )
+
+    assert truncated_prompt.discarded_messages == discarded_messages
+    assert truncated_prompt.prompt_tokens == prompt_tokens
+    assert await tokenize_by_words(truncated_prompt.prompt) == prompt_tokens
@@ -0,0 +1,60 @@
+from unittest.mock import AsyncMock
+
+import pytest
+
+from aidial_adapter_vertexai.chat.truncation_hints import truncation_hints
+from tests.utils.bison import create_prompt, tokenize_by_words
+
+
+@pytest.fixture(autouse=True)
+def clear_hints():
+    truncation_hints.clear()
+    yield
+    truncation_hints.clear()
+
+
+@pytest.mark.asyncio
+async def test_growing_conversation_reuses_cut():
+    user_limit = 6
+
+    for turns in range(3, 10):
+        prompt = create_prompt(turns)
+
+        expected = await prompt.truncate(
+            tokenizer=tokenize_by_words, user_limit=user_limit
+        )
+
+        tokenizer = AsyncMock(side_effect=tokenize_by_words)
+        actual = await prompt.truncate(
+            tokenizer=tokenizer, user_limit=user_limit, hint_scope="model"
+        )
+
+        assert actual == expected
+        if turns > 3:
+            # Confirmation of the cut of the previous turn
+            # and the move to the next turn
+            assert tokenizer.call_count == 2
+
+    # The same prompt is truncated without counting tokens
+    tokenizer = AsyncMock(side_effect=tokenize_by_words)
+    await prompt.truncate(
+        tokenizer=tokenizer, user_limit=user_limit, hint_scope="model"
+    )
+    assert tokenizer.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_hints_are_scoped():
+    prompt = create_prompt(5)
+    await prompt.truncate(
+        tokenizer=tokenize_by_words, user_limit=6, hint_scope="model"
+    )
+
+    for kwargs in [
+        {"user_limit": 7, "hint_scope": "model"},
+        {"user_limit": 6, "hint_scope": "other"},
+    ]:
+        tokenizer = AsyncMock(side_effect=tokenize_by_words)
+        await create_prompt(6).truncate(tokenizer=tokenizer, **kwargs)
+        # The full prompt is counted first without a hint
+        assert tokenizer.call_args_list[0].args[0] == create_prompt(6)
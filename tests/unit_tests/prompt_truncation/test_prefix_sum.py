@@ -0,0 +1,96 @@
+from unittest.mock import AsyncMock
+
+import pytest
+
+from aidial_adapter_vertexai.chat.bison.prompt import BisonPrompt
+from aidial_adapter_vertexai.chat.truncate_prompt import TruncationStrategy
+from aidial_adapter_vertexai.chat.truncation_hints import (
+    partition_token_counts,
+    truncation_hints,
+)
+from tests.utils.bison import create_prompt, tokenize_by_words
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    truncation_hints.clear()
+    partition_token_counts.clear()
+    yield
+    truncation_hints.clear()
+    partition_token_counts.clear()
+
+
+async def tokenize_with_overhead(prompt: BisonPrompt) -> int:
+    # Long histories cost more than the sum of their messages
+    return await tokenize_by_words(prompt) + (len(prompt.history) > 4)
+
+
+async def tokenize_with_shared_overhead(prompt: BisonPrompt) -> int:
+    # The overhead is counted once per prompt,
+    # so the sum of the turns overcounts the history
+    return await tokenize_by_words(prompt) + 2 * bool(prompt.history)
+
+
+@pytest.mark.parametrize(
+    "tokenizer",
+    [tokenize_by_words, tokenize_with_overhead, tokenize_with_shared_overhead],
+)
+@pytest.mark.parametrize("user_limit", [3, 5, 8, 30])
+@pytest.mark.asyncio
+async def test_prefix_sums_match_greedy(tokenizer, user_limit):
+    prompt = create_prompt(8)
+
+    expected = await prompt.truncate(tokenizer=tokenizer, user_limit=user_limit)
+    actual = await prompt.truncate(
+        tokenizer=tokenizer,
+        user_limit=user_limit,
+        strategy=TruncationStrategy.PREFIX_SUM,
+    )
+
+    assert actual == expected
+
+
+@pytest.mark.asyncio
+async def test_fitting_prompt_is_kept():
+    prompt = create_prompt(8)
+    user_limit = await tokenize_with_shared_overhead(prompt)
+
+    # The sum of the turns overestimates the prompt,
+    # but the whole prompt is counted too
+    tokenizer = AsyncMock(side_effect=tokenize_with_shared_overhead)
+    result = await prompt.truncate(
+        tokenizer=tokenizer,
+        user_limit=user_limit,
+        strategy=TruncationStrategy.PREFIX_SUM,
+    )
+
+    assert result.discarded_messages == []
+    assert result.prompt_tokens == user_limit
+    # The whole prompt, the required messages and 8 turns
+    assert tokenizer.call_count == 10
+
+
+@pytest.mark.asyncio
+async def test_partition_counts_are_reused():
+    tokenizer = AsyncMock(side_effect=tokenize_by_words)
+    await create_prompt(8).truncate(
+        tokenizer=tokenizer,
+        user_limit=8,
+        hint_scope="model",
+        strategy=TruncationStrategy.PREFIX_SUM,
+    )
+    # The whole prompt, the required messages, 8 turns,
+    # the check of the cut and the check of the preceding one
+    assert tokenizer.call_count == 12
+
+    truncation_hints.clear()
+    tokenizer.reset_mock()
+    await create_prompt(9).truncate(
+        tokenizer=tokenizer,
+        user_limit=8,
+        hint_scope="model",
+        strategy=TruncationStrategy.PREFIX_SUM,
+    )
+    # Only the whole prompt, the required messages and the new turn
+    # are counted before the checks
+    assert tokenizer.call_count == 5
@@ -0,0 +1,88 @@
+import pstats
+
+import pytest
+from aidial_sdk import DIALApp
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import aidial_adapter_vertexai.admin as admin_module
+from aidial_adapter_vertexai.admin import router
+
+ADMIN_KEY = "secret"
+
+
+@pytest.fixture
+def client(monkeypatch) -> TestClient:
+    monkeypatch.setattr(admin_module, "ADMIN_API_KEY", ADMIN_KEY)
+    app: FastAPI = DIALApp()
+    app.include_router(router)
+    return TestClient(app, headers={"X-Admin-Key": ADMIN_KEY})
+
+
+def test_admin_key_is_required(client: TestClient):
+    response = client.post(
+        "/admin/tracemalloc/start", headers={"X-Admin-Key": "wrong"}
+    )
+    assert response.status_code == 401
+
+
+def test_empty_admin_key_is_rejected(client: TestClient, monkeypatch):
+    monkeypatch.setattr(admin_module, "ADMIN_API_KEY", "")
+    response = client.post(
+        "/admin/tracemalloc/start", headers={"X-Admin-Key": ""}
+    )
+    assert response.status_code == 401
+
+
+def test_tracemalloc_frames_are_limited(client: TestClient):
+    response = client.post("/admin/tracemalloc/start?frames=100000")
+    assert response.status_code == 422
+
+
+def test_cpu_profile_pstats(client: TestClient, tmp_path):
+    response = client.get("/admin/profile/cpu?duration=0.05")
+    assert response.status_code == 200
+
+    path = tmp_path / "cpu.pstats"
+    path.write_bytes(response.content)
+    stats = pstats.Stats(str(path))
+    assert stats.total_calls > 0  # type: ignore
+
+
+def test_cpu_profile_speedscope(client: TestClient):
+    response = client.get(
+        "/admin/profile/cpu?duration=0.05&format=speedscope&interval=0.001"
+    )
+    assert response.status_code == 200
+
+    profile = response.json()
+    [sampled] = profile["profiles"]
+    assert sampled["type"] == "sampled"
+    assert len(sampled["samples"]) == len(sampled["weights"]) > 0
+
+    frame_count = len(profile["shared"]["frames"])
+    assert all(idx < frame_count for s in sampled["samples"] for idx in s)
+
+
+def test_cpu_profile_duration_is_limited(client: TestClient):
+    response = client.get("/admin/profile/cpu?duration=3600")
+    assert response.status_code == 400
+
+
+def test_tracemalloc(client: TestClient):
+    assert client.get("/admin/tracemalloc/snapshot").status_code == 400
+
+    try:
+        assert client.post("/admin/tracemalloc/start").status_code == 200
+
+        allocated = [bytearray(1024) for _ in range(100)]
+
+        snapshot = client.get("/admin/tracemalloc/snapshot?limit=5").json()
+        assert len(snapshot["top"]) == 5
+        assert snapshot["traced_memory"] > 0
+
+        diff = client.get("/admin/tracemalloc/diff?limit=5").json()
+        assert any(stat["size_diff"] > 0 for stat in diff["top"])
+        del allocated
+    finally:
+        assert client.post("/admin/tracemalloc/stop").status_code == 200
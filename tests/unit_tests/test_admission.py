@@ -0,0 +1,122 @@
+import asyncio
+from typing import List
+
+import pytest
+from aidial_sdk import DIALApp
+from aidial_sdk.chat_completion import ChatCompletion, Request, Response
+from fastapi import HTTPException as FastAPIException
+from fastapi.testclient import TestClient
+
+from aidial_adapter_vertexai.admission import (
+    AdmissionController,
+    DeploymentLimits,
+)
+from aidial_adapter_vertexai.dial_api.exceptions import (
+    RateLimitError,
+    fastapi_exception_handler,
+)
+
+
+@pytest.mark.asyncio
+async def test_admission_within_limits():
+    controller = AdmissionController(
+        "model", DeploymentLimits(tokens_per_minute=1000)
+    )
+
+    ticket = await controller.admit("key", 500)
+    ticket.settle(100)
+
+    assert controller.tokens is not None
+    assert controller.tokens.tokens == pytest.approx(900, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected():
+    controller = AdmissionController(
+        "model",
+        DeploymentLimits(requests_per_minute=1),
+        max_queue_size=1,
+    )
+
+    await controller.admit("key", 1)
+    waiting = asyncio.create_task(controller.admit("key", 1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(RateLimitError) as exc_info:
+        await controller.admit("key", 1)
+
+    assert exc_info.value.retry_after > 0
+
+    waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_withdrawn_waiters_free_the_queue():
+    controller = AdmissionController(
+        "model",
+        DeploymentLimits(requests_per_minute=1),
+        max_queue_size=1,
+        max_queue_time=0.01,
+    )
+
+    await controller.admit("key", 1)
+
+    waiting = asyncio.create_task(controller.admit("key", 1))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert controller._queue == []
+
+    with pytest.raises(RateLimitError, match="timed out"):
+        await controller.admit("key", 1)
+    assert controller._queue == []
+
+
+class _OverloadedChatCompletion(ChatCompletion):
+    async def chat_completion(self, request: Request, response: Response):
+        raise RateLimitError("overloaded", retry_after=2.5)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_chat_rate_limit_error_has_retry_after(stream: bool):
+    app = DIALApp()
+    app.add_exception_handler(FastAPIException, fastapi_exception_handler)
+    app.add_chat_completion("model", _OverloadedChatCompletion())
+
+    response = TestClient(app).post(
+        "/openai/deployments/model/chat/completions",
+        json={
+            "messages": [{"role": "user", "content": "ping"}],
+            "stream": stream,
+        },
+        headers={"api-key": "key"},
+    )
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+
+
+@pytest.mark.asyncio
+async def test_fair_queueing_across_api_keys():
+    # 6000 requests per minute = one request every 10 ms
+    controller = AdmissionController(
+        "model", DeploymentLimits(requests_per_minute=6000)
+    )
+    assert controller.requests is not None
+    controller.requests.tokens = 0
+
+    order: List[str] = []
+
+    async def request(api_key: str):
+        await controller.admit(api_key, 1)
+        order.append(api_key)
+
+    tasks = [asyncio.create_task(request("greedy")) for _ in range(3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(request("modest")))
+
+    await asyncio.gather(*tasks)
+
+    # The modest client isn't stuck behind the whole burst of the greedy one
+    assert order == ["greedy", "modest", "greedy", "greedy"]
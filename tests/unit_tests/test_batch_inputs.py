@@ -0,0 +1,146 @@
+import asyncio
+from typing import List
+
+import pytest
+from aidial_sdk.chat_completion import Message, Role
+from aidial_sdk.chat_completion.request import ChatCompletionRequest
+from aidial_sdk.deployment.tokenize import (
+    TokenizeError,
+    TokenizeInputRequest,
+    TokenizeInputString,
+    TokenizeRequest,
+    TokenizeSuccess,
+)
+from aidial_sdk.deployment.truncate_prompt import (
+    TruncatePromptError,
+    TruncatePromptRequest,
+    TruncatePromptSuccess,
+)
+from pydantic import SecretStr
+
+from aidial_adapter_vertexai.chat.chat_completion_adapter import (
+    ChatCompletionAdapter,
+)
+from aidial_adapter_vertexai.chat.tools import ToolsConfig
+from aidial_adapter_vertexai.chat.truncate_prompt import TruncatedPrompt
+from aidial_adapter_vertexai.chat_completion import VertexAIChatCompletion
+from aidial_adapter_vertexai.utils.concurrency import gather_with_limit
+
+
+class FakeAdapter(ChatCompletionAdapter[str]):
+    parsed: List[str]
+
+    def __init__(self):
+        self.parsed = []
+
+    async def parse_prompt(
+        self, tools: ToolsConfig, messages: List[Message]
+    ) -> str:
+        text = str(messages[-1].content)
+        self.parsed.append(text)
+        await asyncio.sleep(0.01)
+        return text
+
+    async def chat(self, params, consumer, prompt, prompt_tokens=None):
+        raise NotImplementedError()
+
+    async def count_prompt_tokens(self, prompt: str) -> int:
+        await asyncio.sleep(0.01)
+        return len(prompt.split())
+
+    async def truncate_prompt(
+        self, prompt: str, max_prompt_tokens: int
+    ) -> TruncatedPrompt[str]:
+        if await self.count_prompt_tokens(prompt) > max_prompt_tokens:
+            raise ValueError("prompt is too long")
+        return TruncatedPrompt(prompt=prompt, discarded_messages=[])
+
+    async def count_completion_tokens(self, string: str) -> int:
+        if not string:
+            raise ValueError("empty string")
+        return len(string.split())
+
+
+class FakeChatCompletion(VertexAIChatCompletion):
+    def __init__(self, model: FakeAdapter):
+        self.model = model
+
+    async def _get_model(self, request) -> ChatCompletionAdapter:
+        return self.model
+
+
+@pytest.mark.asyncio
+async def test_gather_with_limit():
+    running = 0
+    max_running = 0
+
+    async def run(value: int) -> int:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01 * (5 - value))
+        running -= 1
+        return value
+
+    results = await gather_with_limit(
+        2, (lambda value=value: run(value) for value in range(5))
+    )
+
+    assert results == [0, 1, 2, 3, 4]
+    assert max_running == 2
+
+
+def _request(text: str, **kwargs) -> ChatCompletionRequest:
+    return ChatCompletionRequest(
+        messages=[Message(role=Role.USER, content=text)], **kwargs
+    )
+
+
+def _batch_request(cls, inputs):
+    return cls.construct(
+        inputs=inputs,
+        deployment_id="model",
+        api_key_secret=SecretStr("key"),
+    )
+
+
+@pytest.mark.asyncio
+async def test_tokenize_isolates_errors():
+    model = FakeAdapter()
+    request = _batch_request(
+        TokenizeRequest,
+        [
+            TokenizeInputRequest(value=_request("one two three")),
+            TokenizeInputString(value=""),
+            TokenizeInputString(value="four five"),
+        ],
+    )
+
+    response = await FakeChatCompletion(model).tokenize(request)
+
+    assert response.outputs == [
+        TokenizeSuccess(token_count=3),
+        TokenizeError(error="empty string"),
+        TokenizeSuccess(token_count=2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_truncate_prompt_shares_parsed_prompts():
+    model = FakeAdapter()
+    request = _batch_request(
+        TruncatePromptRequest,
+        [
+            _request("one two three", max_prompt_tokens=limit)
+            for limit in [3, 2, 5]
+        ],
+    )
+
+    response = await FakeChatCompletion(model).truncate_prompt(request)
+
+    assert [type(output) for output in response.outputs] == [
+        TruncatePromptSuccess,
+        TruncatePromptError,
+        TruncatePromptSuccess,
+    ]
+    assert model.parsed == ["one two three"]
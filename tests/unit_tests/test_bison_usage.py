@@ -0,0 +1,80 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+from aidial_sdk.chat_completion import FinishReason
+
+from aidial_adapter_vertexai.chat.bison.base import BisonChatCompletionAdapter
+from aidial_adapter_vertexai.chat.bison.prompt import BisonPrompt
+from aidial_adapter_vertexai.chat.result import RecordingConsumer
+from aidial_adapter_vertexai.dial_api.request import ModelParameters
+from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+
+
+class FakeBisonAdapter(BisonChatCompletionAdapter):
+    events: List[str]
+
+    def __init__(self):
+        super().__init__("chat-bison@002", None)  # type: ignore
+        self.events = []
+
+    async def send_message_async(
+        self, params: ModelParameters, prompt: BisonPrompt
+    ) -> AsyncIterator[str]:
+        for chunk in ["Hello", " world"]:
+            await asyncio.sleep(0.01)
+            self.events.append(f"chunk:{chunk}")
+            yield chunk
+
+    async def count_prompt_tokens(self, prompt: BisonPrompt) -> int:
+        self.events.append("count_prompt:start")
+        await asyncio.sleep(0.015)
+        self.events.append("count_prompt:end")
+        return 7
+
+    async def count_completion_tokens(self, string: str) -> int:
+        self.events.append("count_completion")
+        return 2
+
+
+@pytest.mark.asyncio
+async def test_prompt_tokens_are_counted_during_generation():
+    adapter = FakeBisonAdapter()
+    consumer = RecordingConsumer()
+
+    await adapter.chat(
+        ModelParameters(max_tokens=2),
+        consumer,
+        BisonPrompt(last_user_message="Hi"),
+    )
+
+    assert adapter.events == [
+        "count_prompt:start",
+        "chunk:Hello",
+        "count_prompt:end",
+        "chunk: world",
+        "count_completion",
+    ]
+    assert consumer.result.content == "Hello world"
+    assert consumer.result.usage == TokenUsage(
+        prompt_tokens=7, completion_tokens=2
+    )
+    assert consumer.result.finish_reason == FinishReason.LENGTH
+
+
+@pytest.mark.asyncio
+async def test_known_prompt_tokens_are_not_counted():
+    adapter = FakeBisonAdapter()
+    consumer = RecordingConsumer()
+
+    await adapter.chat(
+        ModelParameters(),
+        consumer,
+        BisonPrompt(last_user_message="Hi"),
+        prompt_tokens=5,
+    )
+
+    assert "count_prompt:start" not in adapter.events
+    assert consumer.result.usage == TokenUsage(
+        prompt_tokens=5, completion_tokens=2
+    )
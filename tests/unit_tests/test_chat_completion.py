@@ -0,0 +1,124 @@
+from typing import List
+
+import pytest
+from aidial_sdk import DIALApp
+from aidial_sdk.chat_completion import FinishReason, Message
+from fastapi.testclient import TestClient
+
+import aidial_adapter_vertexai.chat_completion as chat_completion_module
+from aidial_adapter_vertexai.chat.chat_completion_adapter import (
+    ChatCompletionAdapter,
+)
+from aidial_adapter_vertexai.chat.tools import ToolsConfig
+from aidial_adapter_vertexai.chat.truncate_prompt import TruncatedPrompt
+from aidial_adapter_vertexai.chat_completion import VertexAIChatCompletion
+from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+
+
+class EchoAdapter(ChatCompletionAdapter[str]):
+    events: List[str]
+
+    def __init__(self, events: List[str] | None = None):
+        self.events = [] if events is None else events
+
+    async def truncate_prompt(
+        self, prompt: str, max_prompt_tokens: int
+    ) -> TruncatedPrompt[str]:
+        self.events.append("truncate")
+        return TruncatedPrompt(
+            prompt=prompt,
+            discarded_messages=[],
+            prompt_tokens=len(prompt.split()),
+        )
+
+    async def parse_prompt(
+        self, tools: ToolsConfig, messages: List[Message]
+    ) -> str:
+        return str(messages[-1].content)
+
+    async def chat(self, params, consumer, prompt, prompt_tokens=None):
+        self.events.append("chat")
+        if prompt == "fail":
+            raise RuntimeError("the model is unavailable")
+        await consumer.append_content(prompt.upper())
+        await consumer.set_usage(
+            TokenUsage(prompt_tokens=len(prompt.split()), completion_tokens=1)
+        )
+        await consumer.set_finish_reason(FinishReason.STOP)
+
+
+class EchoChatCompletion(VertexAIChatCompletion):
+    model: EchoAdapter
+
+    def __init__(self, model: EchoAdapter | None = None):
+        self.model = model or EchoAdapter()
+
+    async def _get_model(self, request) -> ChatCompletionAdapter:
+        return self.model
+
+
+class SpyTicket:
+    events: List[str]
+
+    def __init__(self, events: List[str]):
+        self.events = events
+
+    def settle(self, actual_tokens: int) -> None:
+        self.events.append(f"settle {actual_tokens}")
+
+
+def chat(app: DIALApp, text: str, **params) -> dict:
+    response = TestClient(app).post(
+        "/openai/deployments/model/chat/completions",
+        json={"messages": [{"role": "user", "content": text}], **params},
+        headers={"api-key": "key"},
+    )
+    return {"status_code": response.status_code, **response.json()}
+
+
+@pytest.mark.parametrize(
+    "temperature",
+    [
+        pytest.param(0.0, id="coalesced"),
+        pytest.param(1.0, id="streamed to the response"),
+    ],
+)
+def test_chat_completion(temperature: float):
+    app = DIALApp()
+    app.add_chat_completion("model", EchoChatCompletion())
+
+    body = chat(app, "hello world", temperature=temperature, n=2)
+
+    assert body["status_code"] == 200
+    assert [choice["message"]["content"] for choice in body["choices"]] == [
+        "HELLO WORLD",
+        "HELLO WORLD",
+    ]
+    assert {choice["finish_reason"] for choice in body["choices"]} == {"stop"}
+    assert body["usage"]["prompt_tokens"] == 4
+    assert body["usage"]["completion_tokens"] == 2
+
+
+@pytest.mark.parametrize(
+    "text, expected_settle",
+    [
+        pytest.param("hello world", "settle 3", id="success"),
+        pytest.param("fail", "settle 1", id="failure"),
+    ],
+)
+def test_truncation_is_admitted_and_ticket_is_settled(
+    monkeypatch, text: str, expected_settle: str
+):
+    events: List[str] = []
+
+    async def admit(deployment: str, api_key: str, cost: int) -> SpyTicket:
+        events.append("admit")
+        return SpyTicket(events)
+
+    monkeypatch.setattr(chat_completion_module, "admit", admit)
+
+    app = DIALApp()
+    app.add_chat_completion("model", EchoChatCompletion(EchoAdapter(events)))
+    chat(app, text, max_prompt_tokens=10, temperature=1.0)
+
+    assert events == ["admit", "truncate", "chat", expected_settle]
@@ -0,0 +1,88 @@
+import json
+
+from vertexai.preview.generative_models import FinishReason as GenFinishReason
+from vertexai.preview.generative_models import GenerationResponse
+
+from aidial_adapter_vertexai.chat.gemini.chunk import Citation, decode_chunk
+from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+
+
+def test_text_chunk():
+    chunk = decode_chunk(
+        GenerationResponse.from_dict(
+            {
+                "candidates": [
+                    {
+                        "content": {
+                            "role": "model",
+                            "parts": [{"text": "Hello"}, {"text": ", world"}],
+                        },
+                        "citation_metadata": {
+                            "citations": [
+                                {"uri": "https://example.com", "title": "Ex"},
+                                {"start_index": 1},
+                            ]
+                        },
+                    }
+                ]
+            }
+        )
+    )
+
+    assert chunk.has_candidate
+    assert chunk.text == "Hello, world"
+    assert chunk.citations == [Citation(uri="https://example.com", title="Ex")]
+    assert chunk.finish_reason == GenFinishReason.FINISH_REASON_UNSPECIFIED
+    assert chunk.usage is None and not chunk.is_blocked
+
+
+def test_function_call_chunk():
+    args = {"query": "weather", "limit": 0, "filters": [{"city": "Paris"}]}
+    chunk = decode_chunk(
+        GenerationResponse.from_dict(
+            {
+                "candidates": [
+                    {
+                        "content": {
+                            "role": "model",
+                            "parts": [
+                                {"function_call": {"name": "f", "args": args}}
+                            ],
+                        },
+                        "finish_reason": "STOP",
+                    }
+                ],
+                "usage_metadata": {
+                    "prompt_token_count": 10,
+                    "candidates_token_count": 5,
+                },
+            }
+        )
+    )
+
+    assert chunk.text == ""
+    [call] = chunk.function_calls
+    # The zero values are preserved
+    assert call.name == "f" and json.loads(call.arguments) == args
+    assert chunk.finish_reason == GenFinishReason.STOP
+    assert chunk.usage == TokenUsage(prompt_tokens=10, completion_tokens=5)
+
+
+def test_blocked_prompt_chunk():
+    chunk = decode_chunk(
+        GenerationResponse.from_dict(
+            {"prompt_feedback": {"block_reason": "SAFETY"}}
+        )
+    )
+
+    assert not chunk.has_candidate
+    assert chunk.is_blocked
+
+
+def test_unknown_finish_reason():
+    response = GenerationResponse.from_dict({"candidates": [{}]})
+    response._raw_response._pb.candidates[0].finish_reason = 1000
+
+    chunk = decode_chunk(response)
+
+    assert chunk.finish_reason == GenFinishReason.FINISH_REASON_UNSPECIFIED
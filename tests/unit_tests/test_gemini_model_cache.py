@@ -0,0 +1,41 @@
+import vertexai
+from aidial_sdk.chat_completion import Function
+from vertexai.preview.generative_models import Part
+
+from aidial_adapter_vertexai.chat.gemini.model_cache import GenerativeModelCache
+from aidial_adapter_vertexai.chat.tools import ToolsConfig
+
+RESOURCE_NAME = "projects/dummy_project_id/locations/us-central1/publishers/google/models/gemini-1.5-pro-002"
+
+
+def create_tools(*names: str, tool_ids=None) -> ToolsConfig:
+    return ToolsConfig(
+        functions=[Function(name=name, parameters={}) for name in names],
+        required=False,
+        tool_ids=tool_ids,
+    )
+
+
+def test_declarations_hash_ignores_tool_call_ids():
+    assert (
+        create_tools("a", "b").declarations_hash
+        == create_tools("a", "b", tool_ids={"a_1": "a"}).declarations_hash
+    )
+    assert create_tools("a").declarations_hash != (
+        create_tools("b").declarations_hash
+    )
+
+
+def test_models_are_reused():
+    vertexai.init(project="dummy_project_id", location="us-central1")
+    cache = GenerativeModelCache(max_size=2)
+    system = [Part.from_text("system")]
+
+    model = cache.get(RESOURCE_NAME, create_tools("a"), system)
+
+    assert cache.get(RESOURCE_NAME, create_tools("a"), system) is model
+    assert cache.get(RESOURCE_NAME, create_tools("b"), system) is not model
+    assert cache.get(RESOURCE_NAME, create_tools("a"), None) is not model
+
+    # The least recently used model is evicted
+    assert cache.get(RESOURCE_NAME, create_tools("a"), system) is not model
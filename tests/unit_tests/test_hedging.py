@@ -0,0 +1,87 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+
+from aidial_adapter_vertexai.hedging import (
+    Hedger,
+    HedgingConfig,
+    LatencyTracker,
+)
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100)
+    for latency in range(1, 101):
+        tracker.record(latency / 100)
+
+    assert tracker.get_percentile(50) == pytest.approx(0.5, abs=0.02)
+    assert tracker.get_percentile(95) == pytest.approx(0.95, abs=0.02)
+
+
+def create_hedger(max_rate: float) -> Hedger:
+    hedger = Hedger(
+        "model", HedgingConfig(percentile=50, min_samples=1, max_rate=max_rate)
+    )
+    hedger.latency.record(0.01)
+    return hedger
+
+
+def create_generator(delays: List[float], cancelled: List[int]):
+    attempts = 0
+
+    async def generator() -> AsyncIterator[str]:
+        nonlocal attempts
+        attempt = attempts
+        attempts += 1
+        try:
+            await asyncio.sleep(delays[attempt])
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        yield f"{attempt}:a"
+        yield f"{attempt}:b"
+
+    return generator
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_over_slow_request():
+    hedger = create_hedger(max_rate=1.0)
+    cancelled: List[int] = []
+
+    items = [
+        item
+        async for item in hedger.stream(create_generator([1.0, 0.0], cancelled))
+    ]
+
+    assert items == ["1:a", "1:b"]
+    assert cancelled == [0]
+
+
+@pytest.mark.asyncio
+async def test_hedge_rate_is_limited():
+    hedger = create_hedger(max_rate=0.0)
+    cancelled: List[int] = []
+
+    items = [
+        item
+        async for item in hedger.stream(
+            create_generator([0.05, 0.0], cancelled)
+        )
+    ]
+
+    assert items == ["0:a", "0:b"]
+    assert cancelled == []
+
+
+def test_hedge_burst_is_limited():
+    hedger = Hedger("model", HedgingConfig(max_rate=0.05, window=100))
+    for _ in range(10_000):
+        hedger.budget.deposit()
+
+    hedges = 0
+    while hedger.budget.try_withdraw():
+        hedges += 1
+
+    assert hedges == 5
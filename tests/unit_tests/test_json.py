@@ -0,0 +1,59 @@
+import json
+
+from pydantic import BaseModel
+from vertexai.preview.generative_models import Content, Part
+
+from aidial_adapter_vertexai.utils.json import json_dumps, json_dumps_short
+
+
+def test_truncation():
+    obj = {"text": "a" * 50 + "b" * 50, "list": list(range(30))}
+    assert json.loads(
+        json_dumps_short(obj, string_limit=10, list_len_limit=4)
+    ) == {
+        "text": "aaaaa...(90 skipped)...bbbbb",
+        "list": [0, 1, "...(26 skipped)...", 28, 29],
+    }
+
+
+def test_bytes_are_not_encoded():
+    part = Part.from_data(b"x" * 1_000_000, mime_type="image/png")
+    content = Content(role="user", parts=[Part.from_text("hi"), part])
+
+    assert json.loads(json_dumps(content)) == {
+        "role": "user",
+        "parts": [
+            {"text": "hi"},
+            {
+                "inline_data": {
+                    "mime_type": "image/png",
+                    "data": "<bytes>(1_000_000 B)",
+                }
+            },
+        ],
+    }
+
+
+def test_excluded_keys():
+    class Model(BaseModel):
+        name: str
+        secret: str
+
+    assert json.loads(
+        json_dumps(Model(name="n", secret="s"), excluded_keys=["secret"])
+    ) == {"name": "n", "secret": "<excluded>"}
+
+
+def test_depth_limit():
+    obj: list = []
+    for _ in range(10):
+        obj = [obj]
+
+    assert json.loads(json_dumps(obj, depth_limit=2)) == [["<max depth>"]]
+
+
+def test_size_limit():
+    obj = ["a" * 10] * 100
+
+    result = json.loads(json_dumps(obj, size_limit=25))
+    assert result == ["a" * 10] * 3 + ["...(97 skipped)..."]
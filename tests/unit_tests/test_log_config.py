@@ -0,0 +1,132 @@
+import logging
+import threading
+from logging.handlers import QueueListener
+from queue import Queue, SimpleQueue
+from typing import List
+
+from aidial_adapter_vertexai.utils.json import LazyJson
+from aidial_adapter_vertexai.utils.log_config import (
+    SamplingFilter,
+    _configure_sampling,
+    _DeferredQueueHandler,
+)
+
+
+class Payload:
+    rendered_in: List[str]
+
+    def __init__(self):
+        self.rendered_in = []
+
+    def to_dict(self):
+        self.rendered_in.append(threading.current_thread().name)
+        return {"key": "value"}
+
+
+class CollectingHandler(logging.Handler):
+    messages: List[str]
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(self.format(record))
+
+
+def create_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_payload_is_rendered_by_listener_thread():
+    queue: SimpleQueue = SimpleQueue()
+    handler = CollectingHandler()
+    listener = QueueListener(queue, handler)
+    logger = create_logger("test-deferred", _DeferredQueueHandler(queue))
+
+    payload = Payload()
+    listener.start()
+    try:
+        logger.debug("payload: %s", LazyJson(payload, frozen=True))
+    finally:
+        listener.stop()
+
+    assert handler.messages == ['payload: {"key": "value"}']
+    assert payload.rendered_in and payload.rendered_in[0] != (
+        threading.current_thread().name
+    )
+
+
+def test_mutable_payload_is_snapshotted():
+    queue: SimpleQueue = SimpleQueue()
+    handler = CollectingHandler()
+    listener = QueueListener(queue, handler)
+    logger = create_logger("test-snapshot", _DeferredQueueHandler(queue))
+
+    payload = {"tool_ids": {"call_0": "search"}}
+    logger.debug("payload: %s", LazyJson(payload))
+    payload["tool_ids"]["call_1"] = "search"
+
+    listener.start()
+    listener.stop()
+
+    assert handler.messages == ['payload: {"tool_ids": {"call_0": "search"}}']
+
+
+def test_skipped_payload_is_not_rendered():
+    handler = CollectingHandler()
+    logger = create_logger("test-skipped", handler)
+    logger.setLevel(logging.INFO)
+
+    payload = Payload()
+    logger.debug("payload: %s", LazyJson(payload))
+
+    assert handler.messages == []
+    assert payload.rendered_in == []
+
+
+def test_sampling_filter_keeps_higher_levels():
+    handler = CollectingHandler()
+    logger = create_logger("test-sampling", handler)
+    logger.filters = [SamplingFilter(0.0)]
+
+    payload = Payload()
+    logger.debug("payload: %s", LazyJson(payload))
+    logger.warning("warning")
+
+    assert handler.messages == ["warning"]
+    assert payload.rendered_in == []
+
+
+def test_records_are_dropped_when_queue_is_full():
+    queue: Queue = Queue(2)
+    logger = create_logger("test-dropped", _DeferredQueueHandler(queue))
+
+    for idx in range(4):
+        logger.info("message %d", idx)
+
+    assert [queue.get_nowait().getMessage() for _ in range(2)] == [
+        "message 0",
+        "message 1",
+    ]
+
+    logger.info("message 4")
+
+    assert [queue.get_nowait().getMessage() for _ in range(2)] == [
+        "2 log records were dropped, because the log queue was full",
+        "message 4",
+    ]
+
+
+def test_sampling_is_configured_once():
+    logger = logging.getLogger("test-sampling-once")
+
+    _configure_sampling({"test-sampling-once": 0.5})
+    _configure_sampling({"test-sampling-once": 0.1})
+
+    [sampling] = logger.filters
+    assert isinstance(sampling, SamplingFilter) and sampling.rate == 0.1
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+import aidial_adapter_vertexai.telemetry.loop_monitor as loop_monitor_module
+from aidial_adapter_vertexai.telemetry.loop_monitor import LoopMonitor
+from tests.utils.metrics import FakeHistogram
+
+
+def block_the_loop(duration: float) -> None:
+    time.sleep(duration)
+
+
+@pytest.mark.asyncio
+async def test_lag_is_sampled(monkeypatch):
+    histogram = FakeHistogram()
+    monkeypatch.setattr(loop_monitor_module, "loop_lag_histogram", histogram)
+
+    monitor = LoopMonitor(interval=0.01, blocking_threshold=0)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.02)
+        block_the_loop(0.1)
+        await asyncio.sleep(0.02)
+    finally:
+        await monitor.stop()
+
+    assert histogram.records
+    assert max(amount for amount, _ in histogram.records) >= 50
+
+
+@pytest.mark.asyncio
+async def test_blocking_stack_is_logged(caplog):
+    monitor = LoopMonitor(interval=0, blocking_threshold=0.05)
+    monitor.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="app"):
+            await asyncio.sleep(0.05)
+            block_the_loop(0.3)
+            await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    [record] = [
+        record
+        for record in caplog.records
+        if "the event loop is blocked" in record.getMessage()
+    ]
+    assert "block_the_loop" in record.getMessage()
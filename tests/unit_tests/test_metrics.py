@@ -0,0 +1,60 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+from aidial_sdk.telemetry.types import TelemetryConfig
+
+import aidial_adapter_vertexai.telemetry.stream as stream_module
+from aidial_adapter_vertexai.telemetry.metrics import (
+    time_to_first_token_histogram,
+)
+from aidial_adapter_vertexai.telemetry.prometheus import (
+    configure_metrics,
+    metrics,
+)
+from aidial_adapter_vertexai.telemetry.stream import measured_stream
+from aidial_adapter_vertexai.utils.timer import Timer
+from tests.utils.metrics import FakeHistogram
+
+
+async def produce(delays: List[float]) -> AsyncIterator[int]:
+    for idx, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield idx
+
+
+@pytest.mark.asyncio
+async def test_stream_timings(monkeypatch):
+    ttft, gaps, total = FakeHistogram(), FakeHistogram(), FakeHistogram()
+    monkeypatch.setattr(stream_module, "time_to_first_token_histogram", ttft)
+    monkeypatch.setattr(stream_module, "inter_chunk_gap_histogram", gaps)
+    monkeypatch.setattr(stream_module, "generation_time_histogram", total)
+
+    stream = measured_stream(produce([0.02, 0.0, 0.01]), deployment="test")
+    assert [chunk async for chunk in stream] == [0, 1, 2]
+
+    assert len(ttft.records) == 1 and ttft.records[0][0] >= 20
+    assert len(gaps.records) == 2 and gaps.records[1][0] >= 10
+    assert len(total.records) == 1 and total.records[0][0] >= 30
+    assert total.records[0][1] == {"deployment": "test"}
+
+
+def test_timer_records_milliseconds():
+    histogram = FakeHistogram()
+    with Timer("{time}", lambda _: None, histogram, {"deployment": "test"}):  # type: ignore
+        pass
+
+    [(amount, attributes)] = histogram.records
+    assert 0 <= amount < 1000
+    assert attributes == {"deployment": "test"}
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    configure_metrics(TelemetryConfig(metrics=None))
+    time_to_first_token_histogram.record(100, {"deployment": "test"})
+
+    response = await metrics()
+    assert response.media_type.startswith("text/plain")
+    assert b"# TYPE" in response.body
+    assert b"adapter_chat_time_to_first_token" in response.body
@@ -0,0 +1,101 @@
+from typing import List
+
+import pytest
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+
+from aidial_adapter_vertexai.regions import (
+    CircuitBreaker,
+    CircuitState,
+    RegionRouter,
+    routed_call,
+)
+from aidial_adapter_vertexai.utils.retry import (
+    RetryBudget,
+    RetryPolicy,
+    call_with_retries,
+)
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+
+    breaker.on_failure()
+    assert breaker.is_available()
+
+    breaker.on_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.is_available()
+
+
+def test_circuit_breaker_half_open_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+
+    breaker.on_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    breaker.on_request()
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    breaker.on_success()
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_router_prefers_faster_region():
+    router = RegionRouter("model", ["slow", "fast"], exploration_rate=0)
+    router.report_success("slow", latency=2.0)
+    router.report_success("fast", latency=0.5)
+
+    assert router.select() == "fast"
+
+
+def test_router_avoids_failing_region():
+    router = RegionRouter("model", ["a", "b"], exploration_rate=0)
+    router.report_success("a", latency=0.5)
+    router.report_success("b", latency=1.0)
+
+    for _ in range(10):
+        router.report_failure("a", ResourceExhausted("quota"))
+
+    assert router.select() == "b"
+
+
+def test_router_ignores_invalid_requests():
+    router = RegionRouter("model", ["a", "b"], exploration_rate=0)
+    router.report_success("a", latency=0.5)
+    router.report_success("b", latency=1.0)
+
+    for _ in range(10):
+        router.report_failure("a", InvalidArgument("bad request"))
+
+    assert router.select() == "a"
+
+
+@pytest.mark.asyncio
+async def test_failover_to_another_region():
+    router = RegionRouter("model", ["a", "b"], exploration_rate=0)
+    router.report_success("a", latency=0.5)
+    router.report_success("b", latency=1.0)
+
+    regions: List[str] = []
+
+    async def func(region: str) -> str:
+        regions.append(region)
+        if region == "a":
+            raise ResourceExhausted("quota")
+        return region
+
+    result = await call_with_retries(
+        routed_call(router, func),
+        operation="test",
+        deployment="model",
+        policy=RetryPolicy(
+            max_retries=2,
+            initial_backoff=0.0,
+            max_backoff=0.0,
+            max_retry_hint=0.0,
+        ),
+        budget=RetryBudget(ratio=0.0, min_per_second=1000.0),
+    )
+
+    assert result == "b"
+    assert regions == ["a", "b"]
@@ -0,0 +1,79 @@
+import pytest
+from aidial_sdk.chat_completion import FinishReason
+from vertexai.preview.generative_models import Content, Part
+
+from aidial_adapter_vertexai.chat.result import (
+    ChatCompletionResult,
+    ChoiceResult,
+    RecordingConsumer,
+    ToolCallResult,
+)
+from aidial_adapter_vertexai.dial_api.token_usage import TokenUsage
+from aidial_adapter_vertexai.response_cache import InMemoryCacheBackend
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    backend = InMemoryCacheBackend(max_size=2, ttl=60)
+
+    await backend.set("a", "1")
+    await backend.set("b", "2")
+    assert await backend.get("a") == "1"
+
+    await backend.set("c", "3")
+
+    assert await backend.get("a") == "1"
+    assert await backend.get("b") is None
+    assert await backend.get("c") == "3"
+
+
+@pytest.mark.asyncio
+async def test_ttl_expiration():
+    now = 0.0
+    backend = InMemoryCacheBackend(max_size=2, ttl=10, clock=lambda: now)
+
+    await backend.set("a", "1")
+    now = 5.0
+    assert await backend.get("a") == "1"
+
+    now = 10.0
+    assert await backend.get("a") is None
+
+
+class ChunkRecorder(RecordingConsumer):
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    async def append_content(self, content: str):
+        self.chunks.append(content)
+        await super().append_content(content)
+
+
+@pytest.mark.asyncio
+async def test_result_roundtrip_and_chunked_replay():
+    choice = ChoiceResult(
+        content="Hello, world!",
+        tool_calls=[ToolCallResult(id="f_1", name="f", arguments="{}")],
+        usage=TokenUsage(prompt_tokens=3, completion_tokens=5),
+        finish_reason=FinishReason.TOOL_CALLS,
+    )
+    result = ChatCompletionResult.parse_raw(
+        ChatCompletionResult(choices=[choice]).json()
+    )
+
+    consumer = ChunkRecorder()
+    await result.choices[0].replay(consumer, chunk_size=5)
+
+    assert consumer.chunks == ["Hello", ", wor", "ld!"]
+    assert consumer.result == choice
+    assert result.usage.total_tokens == 8
+
+
+def test_prompt_hash_covers_vertex_ai_objects():
+    def content(text: str) -> Content:
+        return Content(role="user", parts=[Part.from_text(text)])
+
+    assert canonical_hash([content("a")]) == canonical_hash([content("a")])
+    assert canonical_hash([content("a")]) != canonical_hash([content("b")])
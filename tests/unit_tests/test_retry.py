@@ -0,0 +1,172 @@
+from typing import AsyncIterator, List
+
+import pytest
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+from google.protobuf.duration_pb2 import Duration
+from google.rpc.error_details_pb2 import RetryInfo
+
+from aidial_adapter_vertexai.utils.retry import (
+    RetryBudget,
+    RetryPolicy,
+    call_with_retries,
+    get_retry_hint,
+    stream_with_retries,
+)
+
+policy = RetryPolicy(
+    max_retries=2, initial_backoff=0.0, max_backoff=0.0, max_retry_hint=1.0
+)
+
+
+def unlimited_budget() -> RetryBudget:
+    return RetryBudget(ratio=0.0, min_per_second=1000.0)
+
+
+def failing_call(errors: List[Exception]):
+    calls = 0
+
+    async def func() -> int:
+        nonlocal calls
+        calls += 1
+        if errors:
+            raise errors.pop(0)
+        return calls
+
+    return func
+
+
+@pytest.mark.asyncio
+async def test_transient_error_is_retried():
+    func = failing_call(
+        [ResourceExhausted("quota"), ResourceExhausted("quota")]
+    )
+
+    result = await call_with_retries(
+        func,
+        operation="test",
+        deployment="test",
+        policy=policy,
+        budget=unlimited_budget(),
+    )
+
+    assert result == 3
+
+
+@pytest.mark.asyncio
+async def test_max_retries():
+    func = failing_call([ResourceExhausted("quota")] * 3)
+
+    with pytest.raises(ResourceExhausted):
+        await call_with_retries(
+            func,
+            operation="test",
+            deployment="test",
+            policy=policy,
+            budget=unlimited_budget(),
+        )
+
+
+@pytest.mark.asyncio
+async def test_non_transient_error_is_not_retried():
+    func = failing_call([InvalidArgument("bad request")])
+
+    with pytest.raises(InvalidArgument):
+        await call_with_retries(
+            func,
+            operation="test",
+            deployment="test",
+            policy=policy,
+            budget=unlimited_budget(),
+        )
+
+
+@pytest.mark.asyncio
+async def test_exhausted_budget():
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0)
+    func = failing_call([ResourceExhausted("quota")] * 2)
+
+    # The first call deposits only half of a retry
+    with pytest.raises(ResourceExhausted):
+        await call_with_retries(
+            func,
+            operation="test",
+            deployment="test",
+            policy=policy,
+            budget=budget,
+        )
+
+    # The second call completes the deposit
+    result = await call_with_retries(
+        func, operation="test", deployment="test", policy=policy, budget=budget
+    )
+    assert result == 3
+
+
+def test_retry_hint():
+    retry_info = RetryInfo(retry_delay=Duration(seconds=2, nanos=500_000_000))
+    error = ResourceExhausted("quota", details=[retry_info])
+
+    assert get_retry_hint(error) == 2.5
+    assert get_retry_hint(ResourceExhausted("quota")) is None
+
+
+@pytest.mark.asyncio
+async def test_too_long_retry_hint_is_not_waited_for():
+    retry_info = RetryInfo(retry_delay=Duration(seconds=60))
+    func = failing_call([ResourceExhausted("quota", details=[retry_info])])
+
+    with pytest.raises(ResourceExhausted):
+        await call_with_retries(
+            func,
+            operation="test",
+            deployment="test",
+            policy=policy,
+            budget=unlimited_budget(),
+        )
+
+
+@pytest.mark.asyncio
+async def test_stream_is_retried_before_first_element():
+    attempts = 0
+
+    async def generator() -> AsyncIterator[str]:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise ResourceExhausted("quota")
+        yield "a"
+        yield "b"
+
+    items = [
+        item
+        async for item in stream_with_retries(
+            generator,
+            operation="test",
+            deployment="test",
+            policy=policy,
+            budget=unlimited_budget(),
+        )
+    ]
+
+    assert items == ["a", "b"]
+    assert attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_is_not_retried_after_first_element():
+    async def generator() -> AsyncIterator[str]:
+        yield "a"
+        raise ResourceExhausted("quota")
+
+    items: List[str] = []
+    with pytest.raises(ResourceExhausted):
+        async for item in stream_with_retries(
+            generator,
+            operation="test",
+            deployment="test",
+            policy=policy,
+            budget=unlimited_budget(),
+        ):
+            items.append(item)
+
+    assert items == ["a"]
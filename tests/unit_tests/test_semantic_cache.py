@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from aidial_sdk.chat_completion import FinishReason, Message, Role
+from aidial_sdk.chat_completion.request import ChatCompletionRequest
+
+from aidial_adapter_vertexai.chat.result import (
+    ChatCompletionResult,
+    ChoiceResult,
+)
+from aidial_adapter_vertexai.dial_api.request import ModelParameters
+from aidial_adapter_vertexai.semantic_cache import (
+    SemanticCache,
+    SemanticQuery,
+    _get_question,
+)
+
+
+def create_query(*vector: float, partition: str = "p") -> SemanticQuery:
+    array = np.asarray(vector, dtype=np.float32)
+    return SemanticQuery(
+        deployment="model",
+        partition=partition,
+        vector=array / np.linalg.norm(array),
+    )
+
+
+def create_result(
+    content: str, finish_reason: FinishReason = FinishReason.STOP
+) -> ChatCompletionResult:
+    return ChatCompletionResult(
+        choices=[ChoiceResult(content=content, finish_reason=finish_reason)]
+    )
+
+
+def create_cache(**kwargs) -> SemanticCache:
+    return SemanticCache(
+        **{
+            "threshold": 0.95,
+            "near_miss_margin": 0.1,
+            "ttl": 60,
+            "max_size": 10,
+            **kwargs,
+        }
+    )
+
+
+def test_similar_question_hits():
+    cache = create_cache()
+    cache.store(create_query(1.0, 0.0), create_result("answer"))
+
+    hit = cache.lookup(create_query(1.0, 0.1))
+    assert hit is not None and hit.choices[0].content == "answer"
+
+    # cos = 0.89 is a near miss
+    assert cache.lookup(create_query(1.0, 0.5)) is None
+    # Orthogonal question
+    assert cache.lookup(create_query(0.0, 1.0)) is None
+
+
+def test_partitions_are_isolated():
+    cache = create_cache()
+    cache.store(create_query(1.0, 0.0, partition="a"), create_result("a"))
+
+    assert cache.lookup(create_query(1.0, 0.0, partition="b")) is None
+
+
+def test_incomplete_answers_are_not_stored():
+    cache = create_cache()
+    cache.store(
+        create_query(1.0, 0.0), create_result("answer", FinishReason.LENGTH)
+    )
+
+    assert cache.lookup(create_query(1.0, 0.0)) is None
+
+
+def test_ttl_and_eviction():
+    expiring = create_cache(ttl=0)
+    expiring.store(create_query(1.0, 0.0), create_result("answer"))
+    assert expiring.lookup(create_query(1.0, 0.0)) is None
+
+    bounded = create_cache(max_size=1)
+    bounded.store(create_query(1.0, 0.0), create_result("first"))
+    bounded.store(create_query(0.0, 1.0), create_result("second"))
+    assert bounded.lookup(create_query(1.0, 0.0)) is None
+    assert bounded.lookup(create_query(0.0, 1.0)) is not None
+
+
+@pytest.mark.parametrize(
+    "messages, question",
+    [
+        (
+            [
+                Message(role=Role.SYSTEM, content="Be brief"),
+                Message(role=Role.USER, content="Hi"),
+            ],
+            "Hi",
+        ),
+        (
+            [
+                Message(role=Role.USER, content="Hi"),
+                Message(role=Role.ASSISTANT, content="Hello"),
+                Message(role=Role.USER, content="How are you?"),
+            ],
+            None,
+        ),
+    ],
+)
+def test_only_first_question_is_cached(messages, question):
+    request = ChatCompletionRequest(messages=messages)
+    assert _get_question(request, ModelParameters()) == question
+
+
+def test_prompt_limit_bypasses_cache():
+    request = ChatCompletionRequest(
+        messages=[Message(role=Role.USER, content="Hi")]
+    )
+    params = ModelParameters(max_prompt_tokens=100)
+    assert _get_question(request, params) is None
@@ -0,0 +1,67 @@
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from aidial_adapter_vertexai.telemetry.server_timing import (
+    ServerTiming,
+    ServerTimingMiddleware,
+)
+from aidial_adapter_vertexai.utils.timer import Timer
+
+
+def create_client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completion():
+        with Timer("{time}", lambda _: None, stage="parse"):
+            pass
+        with Timer("{time}", lambda _: None, stage="generate"):
+            pass
+        return JSONResponse({})
+
+    @app.post("/stream")
+    async def stream():
+        with Timer("{time}", lambda _: None, stage="parse"):
+            pass
+        return StreamingResponse(
+            iter(["data: {}\n\n"]), media_type="text/event-stream"
+        )
+
+    return TestClient(app)
+
+
+def test_header_is_opt_in():
+    client = create_client()
+    response = client.post("/openai/deployments/model/chat/completions")
+    assert "server-timing" not in response.headers
+
+
+def test_header_breaks_down_stages():
+    client = create_client()
+    response = client.post(
+        "/openai/deployments/model/chat/completions",
+        headers={"X-Server-Timing": "true"},
+    )
+
+    stages = [
+        entry.split(";")[0]
+        for entry in response.headers["server-timing"].split(", ")
+    ]
+    assert stages == ["parse", "generate"]
+
+
+def test_no_header_for_streaming():
+    client = create_client()
+    response = client.post("/stream", headers={"X-Server-Timing": "true"})
+    assert "server-timing" not in response.headers
+
+
+def test_durations_are_summed():
+    timing = ServerTiming()
+    timing.add("download", 0.01)
+    timing.add("download", 0.02)
+    timing.add("ttft", 0.1)
+
+    assert timing.to_header() == "download;dur=30.0, ttft;dur=100.0"
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from aidial_adapter_vertexai.utils.hash import canonical_hash
+from aidial_adapter_vertexai.utils.single_flight import SingleFlight
+
+
+def test_canonical_hash_ignores_key_order():
+    assert canonical_hash({"a": 1, "b": [1, 2]}) == canonical_hash(
+        {"b": [1, 2], "a": 1}
+    )
+    assert canonical_hash({"a": 1}) != canonical_hash({"a": 2})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_coalesced():
+    flights: SingleFlight[int] = SingleFlight("test")
+    calls = 0
+
+    async def func() -> int:
+        nonlocal calls
+        calls += 1
+        result = calls
+        await asyncio.sleep(0.01)
+        return result
+
+    results = await asyncio.gather(
+        flights.do("a", func), flights.do("a", func), flights.do("b", func)
+    )
+
+    assert results == [1, 1, 2]
+    assert calls == 2
+
+    # The completed calls aren't reused
+    assert await flights.do("a", func) == 3
+
+
+@pytest.mark.asyncio
+async def test_error_is_shared():
+    flights: SingleFlight[int] = SingleFlight("test")
+
+    async def func() -> int:
+        await asyncio.sleep(0.01)
+        raise ValueError("error")
+
+    results = await asyncio.gather(
+        flights.do("a", func), flights.do("a", func), return_exceptions=True
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_doesnt_cancel_others():
+    flights: SingleFlight[str] = SingleFlight("test")
+
+    async def func() -> str:
+        await asyncio.sleep(0.01)
+        return "done"
+
+    first = asyncio.create_task(flights.do("a", func))
+    second = asyncio.create_task(flights.do("a", func))
+    await asyncio.sleep(0)
+
+    first.cancel()
+
+    assert await second == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await first
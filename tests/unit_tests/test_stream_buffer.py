@@ -0,0 +1,108 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+
+from aidial_adapter_vertexai.chat.consumer import ChoiceConsumer
+from aidial_adapter_vertexai.utils.stream_buffer import (
+    OverflowPolicy,
+    StreamBufferOverflowError,
+    buffered_stream,
+)
+
+
+async def produce(
+    items: List[int], produced: List[int], error: Exception | None = None
+) -> AsyncIterator[int]:
+    for item in items:
+        produced.append(item)
+        yield item
+    if error is not None:
+        raise error
+
+
+async def collect(stream: AsyncIterator[int], delay: float = 0.0) -> List[int]:
+    ret: List[int] = []
+    async for item in stream:
+        ret.append(item)
+        await asyncio.sleep(delay)
+    return ret
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_size", [0, 1, 3, 100])
+async def test_order_is_preserved(max_size: int):
+    items = list(range(10))
+    stream = buffered_stream(
+        produce(items, []), deployment="test", max_size=max_size
+    )
+    assert await collect(stream) == items
+
+
+@pytest.mark.asyncio
+async def test_errors_are_propagated():
+    stream = buffered_stream(
+        produce([1, 2], [], ValueError("boom")), deployment="test", max_size=4
+    )
+    received: List[int] = []
+
+    with pytest.raises(ValueError, match="boom"):
+        async for item in stream:
+            received.append(item)
+
+    assert received == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_reader_runs_ahead_of_slow_consumer():
+    produced: List[int] = []
+    stream = buffered_stream(
+        produce(list(range(10)), produced), deployment="test", max_size=3
+    )
+
+    assert await stream.__anext__() == 0
+    await asyncio.sleep(0.01)
+
+    # the first item is consumed, three more are buffered,
+    # and the reader is blocked on the next one
+    assert produced == [0, 1, 2, 3, 4]
+
+    assert await collect(stream) == list(range(1, 10))
+
+
+@pytest.mark.asyncio
+async def test_fail_policy_overflows():
+    stream = buffered_stream(
+        produce(list(range(10)), []),
+        deployment="test",
+        max_size=3,
+        policy=OverflowPolicy.FAIL,
+    )
+
+    with pytest.raises(StreamBufferOverflowError):
+        await collect(stream, delay=0.01)
+
+
+class FakeChoice:
+    def append_content(self, content: str) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_consumer_waits_for_client():
+    waits = 0
+
+    async def wait_for_client() -> None:
+        nonlocal waits
+        waits += 1
+
+    consumer = ChoiceConsumer(
+        FakeChoice(),  # type: ignore
+        wait_for_client=wait_for_client,
+        max_pending_events=3,
+    )
+
+    for _ in range(7):
+        await consumer.append_content("a")
+
+    assert waits == 2
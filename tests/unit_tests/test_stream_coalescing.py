@@ -0,0 +1,82 @@
+import asyncio
+from typing import List
+
+import pytest
+from aidial_sdk.chat_completion import Request
+from aidial_sdk.chat_completion.request import ChatCompletionRequestCustomFields
+
+from aidial_adapter_vertexai.chat.consumer import ChoiceConsumer
+from aidial_adapter_vertexai.chat.errors import ValidationError
+from aidial_adapter_vertexai.chat.stream_coalescing import (
+    StreamCoalescingConfig,
+    get_stream_coalescing_config,
+)
+
+
+class FakeChoice:
+    events: List[str]
+
+    def __init__(self):
+        self.events = []
+
+    def append_content(self, content: str) -> None:
+        self.events.append(content)
+
+    def create_function_tool_call(self, id, name, arguments) -> None:
+        self.events.append(f"tool:{name}")
+
+
+def create_consumer(max_size: int, max_delay: float = 10.0):
+    choice = FakeChoice()
+    config = StreamCoalescingConfig(max_size=max_size, max_delay=max_delay)
+    return choice, ChoiceConsumer(choice, config)  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_deltas_are_merged_up_to_size():
+    choice, consumer = create_consumer(max_size=4)
+
+    for delta in ["a", "b", "", "cd", "e"]:
+        await consumer.append_content(delta)
+
+    assert choice.events == ["abcd"]
+    assert not consumer.is_empty()
+
+    await consumer.create_tool_call("f_1", "f", "{}")
+    assert choice.events == ["abcd", "e", "tool:f"]
+    assert consumer.content_events == 2
+
+
+@pytest.mark.asyncio
+async def test_deltas_are_flushed_after_delay():
+    choice, consumer = create_consumer(max_size=100, max_delay=0.01)
+
+    await consumer.append_content("a")
+    await consumer.append_content("b")
+    assert choice.events == []
+
+    await asyncio.sleep(0.02)
+    assert choice.events == ["ab"]
+
+
+def create_request(configuration=None) -> Request:
+    return Request.construct(
+        deployment_id="model",
+        stream=True,
+        custom_fields=ChatCompletionRequestCustomFields(
+            configuration=configuration
+        ),
+    )
+
+
+def test_request_configuration_overrides_deployment():
+    assert get_stream_coalescing_config(create_request()) is None
+
+    request = create_request({"stream_coalescing": {"max_size": 8}})
+    assert get_stream_coalescing_config(request) == StreamCoalescingConfig(
+        max_size=8
+    )
+
+    request = create_request({"stream_coalescing": {"max_size": "big"}})
+    with pytest.raises(ValidationError):
+        get_stream_coalescing_config(request)
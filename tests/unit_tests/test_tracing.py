@@ -0,0 +1,61 @@
+from typing import AsyncIterator
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+
+import aidial_adapter_vertexai.chat.truncate_prompt as truncate_prompt_module
+import aidial_adapter_vertexai.telemetry.stream as stream_module
+import aidial_adapter_vertexai.telemetry.tracing as tracing_module
+from aidial_adapter_vertexai.telemetry.stream import measured_stream
+from tests.utils.bison import create_prompt, tokenize_by_words
+
+
+@pytest.fixture
+def exporter(monkeypatch) -> InMemorySpanExporter:
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer("aidial_adapter_vertexai")
+
+    # The modules import the tracer by name
+    for module in [tracing_module, stream_module, truncate_prompt_module]:
+        monkeypatch.setattr(module, "tracer", tracer)
+
+    return exporter
+
+
+async def produce(n: int) -> AsyncIterator[int]:
+    for idx in range(n):
+        yield idx
+
+
+@pytest.mark.asyncio
+async def test_generate_span(exporter: InMemorySpanExporter):
+    stream = measured_stream(produce(3), deployment="test")
+    assert [chunk async for chunk in stream] == [0, 1, 2]
+
+    [span] = exporter.get_finished_spans()
+    assert span.name == "generate"
+    assert span.attributes is not None
+    assert span.attributes["deployment"] == "test"
+    assert span.attributes["generate.chunks"] == 3
+    assert [event.name for event in span.events] == ["first_chunk"]
+
+
+@pytest.mark.asyncio
+async def test_truncation_span(exporter: InMemorySpanExporter):
+    prompt = create_prompt(5)
+    truncated = await prompt.truncate(tokenizer=tokenize_by_words, user_limit=6)
+
+    [span] = exporter.get_finished_spans()
+    assert span.name == "truncate_prompt"
+    assert span.attributes is not None
+    assert span.attributes["messages.count"] == len(prompt)
+    assert span.attributes["messages.discarded"] == len(
+        truncated.discarded_messages
+    )
+    assert span.attributes["truncation.iterations"] > 1
@@ -0,0 +1,153 @@
+import json
+import threading
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from aidial_adapter_vertexai.telemetry import traffic_capture
+from aidial_adapter_vertexai.telemetry.traffic_capture import (
+    TrafficCaptureMiddleware,
+    get_embeddings_shape,
+    record_attachment_size,
+)
+
+ATTACHMENT_URL = "files/bucket/secret/photo.png"
+
+
+def capture(tmp_path: Path, path: str, body: dict) -> list:
+    capture_file = tmp_path / "capture.jsonl"
+
+    app = FastAPI()
+    app.add_middleware(TrafficCaptureMiddleware, path=str(capture_file))
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completion(request: Request):
+        await request.json()
+        record_attachment_size(ATTACHMENT_URL, 1234)
+        return JSONResponse({"choices": []})
+
+    @app.get("/health")
+    async def health():
+        return JSONResponse({})
+
+    client = TestClient(app)
+    client.get("/health")
+    client.post(path, json=body)
+
+    traffic_capture._writer.submit(lambda: None).result()
+    if not capture_file.exists():
+        return []
+    return [json.loads(line) for line in capture_file.read_text().splitlines()]
+
+
+def test_chat_shape_is_anonymized(tmp_path: Path):
+    records = capture(
+        tmp_path,
+        "/openai/deployments/gemini/chat/completions",
+        {
+            "messages": [
+                {"role": "system", "content": "You are a secret agent"},
+                {
+                    "role": "user",
+                    "content": "What is it?",
+                    "custom_content": {
+                        "attachments": [
+                            {"type": "image/png", "url": ATTACHMENT_URL}
+                        ]
+                    },
+                },
+            ],
+            "temperature": 0.5,
+            "stop": "###",
+            "user": "john.doe",
+        },
+    )
+
+    assert len(records) == 1
+    record = records[0]
+    assert "secret" not in json.dumps(record)
+    assert "john.doe" not in json.dumps(record)
+
+    assert record["deployment"] == "gemini"
+    assert record["endpoint"] == "chat/completions"
+    assert record["status"] == 200
+    assert record["duration"] >= record["time_to_first_byte"] >= 0
+    assert record["request"] == {
+        "messages": [
+            {
+                "role": "system",
+                "content_length": 22,
+                "attachments": [],
+                "tool_calls": 0,
+                "function_call": False,
+            },
+            {
+                "role": "user",
+                "content_length": 11,
+                "attachments": [
+                    {"type": "image/png", "ext": "png", "size": 1234}
+                ],
+                "tool_calls": 0,
+                "function_call": False,
+            },
+        ],
+        "parameters": {"temperature": 0.5},
+        "stop": 1,
+        "tools": 0,
+        "functions": 0,
+        "tool_choice": None,
+    }
+
+
+def test_image_url_size_is_captured(tmp_path: Path):
+    records = capture(
+        tmp_path,
+        "/openai/deployments/gemini/chat/completions",
+        {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "What is it?"},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": ATTACHMENT_URL},
+                        },
+                    ],
+                }
+            ]
+        },
+    )
+
+    [message] = records[0]["request"]["messages"]
+    assert message["content_length"] == 11
+    assert message["attachments"] == [
+        {"type": None, "ext": "png", "size": 1234}
+    ]
+
+
+def test_capture_is_dropped_when_backlog_is_full(tmp_path: Path, monkeypatch):
+    backlog = threading.BoundedSemaphore(1)
+    backlog.acquire()
+    monkeypatch.setattr(traffic_capture, "_backlog", backlog)
+
+    records = capture(
+        tmp_path,
+        "/openai/deployments/gemini/chat/completions",
+        {"messages": [{"role": "user", "content": "Hello"}]},
+    )
+
+    assert records == []
+
+
+def test_embeddings_shape():
+    assert get_embeddings_shape({"input": "hello", "dimensions": 256}) == {
+        "inputs": [5],
+        "custom_inputs": 0,
+        "dimensions": 256,
+        "encoding_format": None,
+        "type": None,
+        "instruction_length": 0,
+    }
@@ -0,0 +1,29 @@
+from typing import List
+
+from vertexai.preview.language_models import ChatMessage
+
+from aidial_adapter_vertexai.chat.bison.prompt import BisonPrompt, ChatAuthor
+
+
+async def tokenize_by_words(prompt: BisonPrompt) -> int:
+    text = " ".join(
+        [
+            prompt.system_instruction or "",
+            *[msg.content for msg in prompt.history],
+            prompt.last_user_message,
+        ]
+    )
+    return len(text.split())
+
+
+def create_prompt(turns: int) -> BisonPrompt:
+    history: List[ChatMessage] = []
+    for idx in range(turns):
+        history.append(ChatMessage(author=ChatAuthor.USER, content=f"q{idx}"))
+        history.append(ChatMessage(author=ChatAuthor.BOT, content=f"a{idx}"))
+
+    return BisonPrompt(
+        system_instruction="system",
+        history=history,
+        last_user_message=f"q{turns}",
+    )
@@ -0,0 +1,11 @@
+from typing import List, Tuple
+
+
+class FakeHistogram:
+    records: List[Tuple[float, dict]]
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, amount: float, attributes: dict | None = None) -> None:
+        self.records.append((amount, attributes or {}))